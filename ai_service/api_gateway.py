@@ -4,12 +4,24 @@ API Gateway - AI 服务 API 网关
 Requirements: 13.1, 13.2, 13.3, 13.4
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from asgiref.wsgi import WsgiToAsgi
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from functools import wraps
+import io
 import logging
+import mmap
+import tempfile
+import threading
+import orjson
+import uvicorn
 from typing import Dict, Any, Optional
+from pydantic import BaseModel, Field, ValidationError
 import requests
-from dataclasses import dataclass, asdict
+from requests.adapters import HTTPAdapter
 
 # 可选导入音频模块
 try:
@@ -20,10 +32,11 @@ except ImportError:
     logger = logging.getLogger(__name__)
     logger.warning("Voice input module not available (missing audio dependencies)")
 
-from asr_engine import ASREngine
+from asr_engine import ASREngine, ASRWorker, decode_compressed_audio
 from semantic_parser import SemanticParser
 from knowledge_base import KnowledgeBase
 from session_manager import SessionManager
+from semantic_cache import LRUCache, audio_fingerprint
 from config import Config
 
 # 配置日志
@@ -33,43 +46,267 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class ORJSONProvider(JSONProvider):
+    """基于 orjson 的 Flask JSON 序列化（支持 numpy 标量、dataclass、datetime）"""
+    
+    options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, option=self.options).decode('utf-8')
+    
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+    
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        # 直接写入 bytes，省去 str -> bytes 的二次编码
+        return self._app.response_class(
+            orjson.dumps(obj, option=self.options),
+            mimetype='application/json'
+        )
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
-# 初始化服务
 config = Config()
-voice_input = VoiceInputModule() if VOICE_INPUT_AVAILABLE else None
 
-# ASR Engine 可选（需要 whisper）
-try:
-    asr_engine = ASREngine()
-    ASR_AVAILABLE = True
-except RuntimeError:
-    asr_engine = None
-    ASR_AVAILABLE = False
-    logger.warning("ASR Engine not available (missing whisper dependencies)")
 
-semantic_parser = SemanticParser()
-knowledge_base = KnowledgeBase()
-session_manager = SessionManager()
+def lazy_service(factory):
+    """
+    线程安全的惰性单例：首次调用时构造，之后复用
+    
+    重量级服务（Whisper 模型、LLM 客户端等）推迟到每个 worker 首次使用时初始化，
+    模块导入保持轻量。
+    """
+    lock = threading.Lock()
+    holder = []
+    
+    @wraps(factory)
+    def get():
+        if not holder:
+            with lock:
+                if not holder:
+                    holder.append(factory())
+        return holder[0]
+    return get
+
+
+# 初始化服务（惰性）
+@lazy_service
+def get_voice_input() -> Optional["VoiceInputModule"]:
+    return VoiceInputModule() if VOICE_INPUT_AVAILABLE else None
+
+
+@lazy_service
+def get_asr_engine() -> Optional[ASREngine]:
+    # ASR Engine 可选（需要 whisper）
+    try:
+        return ASREngine()
+    except RuntimeError:
+        logger.warning("ASR Engine not available (missing whisper dependencies)")
+        return None
+
+
+@lazy_service
+def get_asr_worker() -> Optional[ASRWorker]:
+    engine = get_asr_engine()
+    return ASRWorker(engine) if engine else None
+
+
+@lazy_service
+def get_semantic_parser() -> SemanticParser:
+    return SemanticParser()
+
+
+@lazy_service
+def get_knowledge_base() -> KnowledgeBase:
+    return KnowledgeBase()
+
+
+@lazy_service
+def get_session_manager() -> SessionManager:
+    return SessionManager()
+
+# 转录缓存：相同音频直接复用转录结果
+# （解析结果由 SemanticParser 内部按会话上下文缓存，网关层不再缓存）
+transcription_cache = None
+if config.semantic_cache_enabled:
+    transcription_cache = LRUCache(max_size=config.semantic_cache_max_size)
 
 # Web3 服务 URL
 WEB3_SERVICE_URL = config.web3_service_url or "http://localhost:3001"
+URL_PAYMENT_START = f"{WEB3_SERVICE_URL}/payment/start"
+URL_PAYMENT_CONFIRM = f"{WEB3_SERVICE_URL}/payment/confirm"
+URL_PAYMENT_CANCEL = f"{WEB3_SERVICE_URL}/payment/cancel"
 
+# Web3 服务 HTTP 会话：复用 keep-alive 连接，避免每次支付调用重新握手
+web3_session = requests.Session()
+_web3_adapter = HTTPAdapter(pool_connections=20, pool_maxsize=100)
+web3_session.mount("http://", _web3_adapter)
+web3_session.mount("https://", _web3_adapter)
+
+# 会话上下文写入不在响应关键路径上，交给后台线程异步执行
+context_writer = ThreadPoolExecutor(max_workers=4, thread_name_prefix="context-writer")
+
+
+def update_context_async(session_id: str, updates: Dict[str, Any]) -> None:
+    """在后台线程更新会话上下文，失败只记录日志"""
+    def _write():
+        try:
+            get_session_manager().update_fields(session_id, updates)
+        except Exception as e:
+            logger.warning(f"异步更新会话上下文失败: {e}")
+    
+    context_writer.submit(_write)
+
+
+def get_session_language(session_id: str) -> Optional[str]:
+    """获取会话中已识别的语言，未知时返回 None（由 ASR 自动检测）"""
+    try:
+        session = get_session_manager().get_session(session_id)
+    except Exception as e:
+        logger.warning(f"读取会话语言失败: {e}")
+        return None
+    return session.last_language if session else None
+
+
+def remember_session_language(session_id: str, known: Optional[str], detected: str) -> None:
+    """首次检测到语言后写入会话，后续转录直接复用"""
+    if known is None and detected and detected != 'unknown':
+        update_context_async(session_id, {'last_language': detected})
+
+# 等待 ASR 后台推理结果的超时时间（秒）
+ASR_TIMEOUT_SECONDS = 30
 
-@dataclass
-class APIResponse:
-    """统一 API 响应格式"""
-    success: bool
-    data: Optional[Any] = None
-    error: Optional[str] = None
-    session_id: Optional[str] = None
+
+def transcribe_in_worker(audio, language: Optional[str]):
+    """在 ASR 后台线程转录并等待结果；超时后取消排队中的请求，避免积压"""
+    future = get_asr_worker().submit(audio, language)
+    try:
+        return future.result(timeout=ASR_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
+
+
+@contextmanager
+def upload_buffer(file_storage):
+    """
+    以只读缓冲区形式访问上传文件，尽量避免复制
+    
+    Werkzeug 把上传内容放在 SpooledTemporaryFile 中：未落盘时取其内部
+    BytesIO 的内存视图（不会触发落盘）；已落盘的临时文件使用 mmap 映射。
+    其他情况回退为 read()。
+    
+    Args:
+        file_storage: Flask 上传文件对象
+        
+    Yields:
+        bytes-like 对象（memoryview / mmap / bytes）
+    """
+    stream = file_storage.stream
+    if isinstance(stream, tempfile.SpooledTemporaryFile):
+        # 解开包装：未落盘时为 BytesIO，已落盘时为真实临时文件。
+        # 不能直接调用 SpooledTemporaryFile.fileno()，它会强制把内存内容写入磁盘
+        stream = stream._file
+    if isinstance(stream, io.BytesIO):
+        view = stream.getbuffer()
+        try:
+            yield view
+        finally:
+            view.release()
+        return
+    
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        fileno = None
+    if fileno is not None:
+        stream.flush()
+        try:
+            mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            mapped = None
+        if mapped is not None:
+            with mapped:
+                yield mapped
+            return
+    
+    yield file_storage.read()
 
 
 def create_response(success: bool, data: Any = None, error: str = None, session_id: str = None) -> Dict:
-    """创建标准化响应"""
-    response = APIResponse(success=success, data=data, error=error, session_id=session_id)
-    return asdict(response)
+    """
+    创建标准化响应
+
+    统一格式: {success, data, error, session_id}，字段始终存在
+    （直接构造字典，避免 dataclasses.asdict 的递归深拷贝）
+    """
+    return {
+        'success': success,
+        'data': data,
+        'error': error,
+        'session_id': session_id
+    }
+
+
+# 请求模型（pydantic v2 在类定义时生成校验器，直接从原始 JSON 字节解析）
+class SessionRequest(BaseModel):
+    session_id: Optional[str] = None
+
+
+class TranscribeRequest(BaseModel):
+    session_id: str = Field(min_length=1)
+
+
+class ParseRequest(BaseModel):
+    text: str = Field(min_length=1)
+    session_id: Optional[str] = None
+
+
+class SearchRequest(BaseModel):
+    query: str = Field(min_length=1)
+    session_id: Optional[str] = None
+    filters: Dict[str, Any] = Field(default_factory=dict)
+    top_k: int = 5
+    list_all: bool = False
+
+
+class PaymentRequest(BaseModel):
+    product_id: str = Field(min_length=1)
+    session_id: Optional[str] = None
+
+
+def _validation_message(error: ValidationError) -> str:
+    """将 pydantic 校验错误转换为简短的错误消息"""
+    first = error.errors()[0]
+    field = ".".join(str(loc) for loc in first.get('loc', ())) or 'body'
+    if first.get('type') in ('missing', 'string_too_short'):
+        return f'缺少 {field}'
+    return f'参数 {field} 无效'
+
+
+def validate_body(model: type):
+    """
+    校验 JSON 请求体并以 body 参数注入处理函数
+    
+    Args:
+        model: pydantic 请求模型
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            raw = request.get_data(cache=False)
+            try:
+                body = model.model_validate_json(raw if raw.strip() else b'{}')
+            except ValidationError as e:
+                return jsonify(create_response(success=False, error=_validation_message(e))), 400
+            return func(*args, body=body, **kwargs)
+        return wrapper
+    return decorator
 
 
 def is_list_all_query(text: str) -> bool:
@@ -109,16 +346,16 @@ def health_check():
 
 
 @app.route('/voice/start-recording', methods=['POST'])
-def start_recording():
+@validate_body(SessionRequest)
+def start_recording(body: SessionRequest):
     """开始录音"""
     try:
-        data = request.json or {}
-        session_id = data.get('session_id')
+        session_id = body.session_id
         
         if not session_id:
-            session_id = session_manager.create_session()
+            session_id = get_session_manager().create_session()
         
-        voice_input.start_recording()
+        get_voice_input().start_recording()
         
         return jsonify(create_response(
             success=True,
@@ -134,12 +371,15 @@ def start_recording():
 def stop_recording():
     """停止录音并返回音频数据"""
     try:
-        audio_data = voice_input.stop_recording()
+        # 只停止录音，不编码 WAV；转录时直接读取同一缓冲区视图
+        voice_input = get_voice_input()
+        audio_array = voice_input.finish_recording()
         
         return jsonify(create_response(
             success=True,
             data={
-                'audio_length': len(audio_data),
+                'audio_length': len(audio_array),
+                'duration': len(audio_array) / voice_input.sample_rate,
                 'sample_rate': voice_input.sample_rate
             }
         ))
@@ -149,26 +389,30 @@ def stop_recording():
 
 
 @app.route('/voice/transcribe', methods=['POST'])
-def transcribe_audio():
+@validate_body(TranscribeRequest)
+def transcribe_audio(body: TranscribeRequest):
     """语音转文字"""
     try:
-        data = request.json or {}
-        session_id = data.get('session_id')
-        
-        if not session_id:
-            return jsonify(create_response(success=False, error='缺少 session_id')), 400
+        session_id = body.session_id
         
         # 获取录音数据
-        audio_data = voice_input.get_audio_buffer()
+        audio_data = get_voice_input().get_audio_buffer()
         
         if audio_data is None or len(audio_data) == 0:
             return jsonify(create_response(success=False, error='没有音频数据')), 400
         
-        # ASR 转录
-        asr_result = asr_engine.transcribe(audio_data)
+        # ASR 转录（在后台推理线程执行，相同音频直接命中缓存）
+        fingerprint = audio_fingerprint(audio_data) if transcription_cache else None
+        asr_result = transcription_cache.get(fingerprint) if fingerprint else None
+        if asr_result is None:
+            language = get_session_language(session_id)
+            asr_result = transcribe_in_worker(audio_data, language)
+            remember_session_language(session_id, language, asr_result.language)
+            if fingerprint:
+                transcription_cache.put(fingerprint, asr_result)
         
         # 更新会话上下文
-        session_manager.update_context(session_id, {
+        get_session_manager().update_context(session_id, {
             'last_transcription': asr_result.text,
             'confidence': asr_result.confidence
         })
@@ -187,29 +431,128 @@ def transcribe_audio():
         return jsonify(create_response(success=False, error=str(e))), 500
 
 
+@app.route('/voice/transcribe/opus', methods=['POST'])
+def transcribe_compressed_audio():
+    """上传压缩音频 (Opus 等) 并转文字"""
+    try:
+        session_id = request.form.get('session_id')
+        audio_file = request.files.get('audio')
+        
+        if not session_id:
+            return jsonify(create_response(success=False, error='缺少 session_id')), 400
+        
+        if audio_file is None:
+            return jsonify(create_response(success=False, error='缺少 audio 文件')), 400
+        
+        with upload_buffer(audio_file) as compressed:
+            if not len(compressed):
+                return jsonify(create_response(success=False, error='没有音频数据')), 400
+            
+            fingerprint = audio_fingerprint(compressed) if transcription_cache else None
+            asr_result = transcription_cache.get(fingerprint) if fingerprint else None
+            audio_array = None
+            if asr_result is None:
+                # 解码并重采样为 16kHz float32，直接送入 ASR，跳过 WAV 读取
+                try:
+                    audio_array = decode_compressed_audio(compressed, sample_rate=config.audio_sample_rate)
+                except ValueError as e:
+                    return jsonify(create_response(success=False, error=str(e))), 400
+        
+        if asr_result is None:
+            if len(audio_array) == 0:
+                return jsonify(create_response(success=False, error='没有音频数据')), 400
+            language = get_session_language(session_id)
+            asr_result = transcribe_in_worker(audio_array, language)
+            remember_session_language(session_id, language, asr_result.language)
+            if fingerprint:
+                transcription_cache.put(fingerprint, asr_result)
+        
+        update_context_async(session_id, {
+            'last_transcription': asr_result.text,
+            'confidence': asr_result.confidence
+        })
+        
+        return jsonify(create_response(
+            success=True,
+            data={
+                'text': asr_result.text,
+                'confidence': asr_result.confidence,
+                'language': asr_result.language
+            },
+            session_id=session_id
+        ))
+    except Exception as e:
+        logger.error(f"压缩音频转录失败: {e}")
+        return jsonify(create_response(success=False, error=str(e))), 500
+
+
+@app.route('/voice/transcribe/stream', methods=['POST'])
+@validate_body(TranscribeRequest)
+def transcribe_audio_stream(body: TranscribeRequest):
+    """边录音边转文字（Server-Sent Events 推送部分结果）"""
+    session_id = body.session_id
+    
+    voice_input = get_voice_input()
+    if not voice_input or not voice_input.is_recording():
+        return jsonify(create_response(success=False, error='录音未开始')), 400
+    
+    language = get_session_language(session_id)
+    
+    def generate():
+        texts = []
+        detected = None
+        try:
+            chunks = voice_input.iter_audio_chunks()
+            for partial in get_asr_engine().transcribe_streaming(
+                chunks,
+                sample_rate=voice_input.sample_rate,
+                language=language
+            ):
+                texts.append(partial.text)
+                detected = detected or partial.language
+                payload = {
+                    'text': partial.text,
+                    'confidence': partial.confidence,
+                    'language': partial.language
+                }
+                yield f"event: partial\ndata: {app.json.dumps(payload)}\n\n"
+            
+            full_text = " ".join(texts).strip()
+            if detected:
+                remember_session_language(session_id, language, detected)
+            update_context_async(session_id, {'last_transcription': full_text})
+            yield f"event: done\ndata: {app.json.dumps({'text': full_text})}\n\n"
+        except Exception as e:
+            logger.error(f"流式语音转录失败: {e}")
+            yield f"event: error\ndata: {app.json.dumps({'error': str(e)})}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/semantic/parse', methods=['POST'])
-def parse_intent():
+@validate_body(ParseRequest)
+def parse_intent(body: ParseRequest):
     """语义解析"""
     try:
-        data = request.json or {}
-        text = data.get('text')
-        session_id = data.get('session_id')
-        
-        if not text:
-            return jsonify(create_response(success=False, error='缺少 text 参数')), 400
+        text = body.text
+        session_id = body.session_id
         
         if not session_id:
-            session_id = session_manager.create_session()
+            session_id = get_session_manager().create_session()
         
         # 获取会话上下文
-        session = session_manager.get_session(session_id)
+        session = get_session_manager().get_session(session_id)
         context = session.get('context', {}) if session else {}
         
-        # 语义解析
-        parsed_intent = semantic_parser.parse(text, context)
+        # 语义解析（解析器内部的语义缓存命中时跳过 LLM 调用）
+        parsed_intent = get_semantic_parser().parse(text, context)
         
-        # 更新会话
-        session_manager.update_context(session_id, {
+        # 更新会话（异步写入，不阻塞响应）
+        update_context_async(session_id, {
             'last_intent': parsed_intent.intent_type.value,
             'entities': parsed_intent.entities,
             'conversation_history': context.get('conversation_history', []) + [text]
@@ -230,26 +573,23 @@ def parse_intent():
 
 
 @app.route('/knowledge/search', methods=['POST'])
-def search_products():
+@validate_body(SearchRequest)
+def search_products(body: SearchRequest):
     """商品搜索"""
     try:
-        data = request.json or {}
-        query = data.get('query')
-        session_id = data.get('session_id')
-        filters = data.get('filters', {})
-        top_k = data.get('top_k', 5)
-        list_all = bool(data.get('list_all')) or is_list_all_query(query)
-        
-        if not query:
-            return jsonify(create_response(success=False, error='缺少 query 参数')), 400
+        query = body.query
+        session_id = body.session_id
+        filters = body.filters
+        top_k = body.top_k
+        list_all = body.list_all or is_list_all_query(query)
         
         # 搜索商品
-        products = knowledge_base.search_by_text(query, filters=filters, top_k=top_k, allow_all=list_all)
+        products = get_knowledge_base().search_by_text(query, filters=filters, top_k=top_k, allow_all=list_all)
         results = [p.to_dict() for p in products]
         
         # 更新会话
         if session_id:
-            session_manager.update_context(session_id, {
+            get_session_manager().update_context(session_id, {
                 'last_search_query': query,
                 'search_results': [p.id for p in products]
             })
@@ -268,7 +608,7 @@ def search_products():
 def get_product(product_id: str):
     """获取商品详情"""
     try:
-        product = knowledge_base.get_by_id(product_id)
+        product = get_knowledge_base().get_by_id(product_id)
         
         if not product:
             return jsonify(create_response(success=False, error='商品不存在')), 404
@@ -280,18 +620,15 @@ def get_product(product_id: str):
 
 
 @app.route('/payment/initiate', methods=['POST'])
-def initiate_payment():
+@validate_body(PaymentRequest)
+def initiate_payment(body: PaymentRequest):
     """发起支付流程（调用 Web3 服务）"""
     try:
-        data = request.json or {}
-        session_id = data.get('session_id')
-        product_id = data.get('product_id')
-        
-        if not product_id:
-            return jsonify(create_response(success=False, error='缺少 product_id')), 400
+        session_id = body.session_id
+        product_id = body.product_id
         
         # 获取商品信息
-        product = knowledge_base.get_by_id(product_id)
+        product = get_knowledge_base().get_by_id(product_id)
         if not product:
             return jsonify(create_response(success=False, error='商品不存在')), 404
         
@@ -304,8 +641,8 @@ def initiate_payment():
         }
         
         # 调用 Web3 服务
-        response = requests.post(
-            f"{WEB3_SERVICE_URL}/payment/start",
+        response = web3_session.post(
+            URL_PAYMENT_START,
             json=payment_request,
             timeout=10
         )
@@ -315,7 +652,7 @@ def initiate_payment():
             
             # 更新会话
             if session_id:
-                session_manager.update_context(session_id, {
+                get_session_manager().update_context(session_id, {
                     'payment_initiated': True,
                     'product_id': product_id,
                     'payment_amount': product['price']
@@ -339,15 +676,15 @@ def initiate_payment():
 
 
 @app.route('/payment/confirm', methods=['POST'])
-def confirm_payment():
+@validate_body(SessionRequest)
+def confirm_payment(body: SessionRequest):
     """确认支付（调用 Web3 服务）"""
     try:
-        data = request.json or {}
-        session_id = data.get('session_id')
+        session_id = body.session_id
         
         # 调用 Web3 服务
-        response = requests.post(
-            f"{WEB3_SERVICE_URL}/payment/confirm",
+        response = web3_session.post(
+            URL_PAYMENT_CONFIRM,
             json={},
             timeout=30
         )
@@ -357,7 +694,7 @@ def confirm_payment():
             
             # 更新会话
             if session_id:
-                session_manager.update_context(session_id, {
+                get_session_manager().update_context(session_id, {
                     'payment_confirmed': True
                 })
             
@@ -379,15 +716,15 @@ def confirm_payment():
 
 
 @app.route('/payment/cancel', methods=['POST'])
-def cancel_payment():
+@validate_body(SessionRequest)
+def cancel_payment(body: SessionRequest):
     """取消支付（调用 Web3 服务）"""
     try:
-        data = request.json or {}
-        session_id = data.get('session_id')
+        session_id = body.session_id
         
         # 调用 Web3 服务
-        response = requests.post(
-            f"{WEB3_SERVICE_URL}/payment/cancel",
+        response = web3_session.post(
+            URL_PAYMENT_CANCEL,
             json={},
             timeout=10
         )
@@ -397,7 +734,7 @@ def cancel_payment():
             
             # 清理会话
             if session_id:
-                session_manager.update_context(session_id, {
+                get_session_manager().update_context(session_id, {
                     'payment_cancelled': True,
                     'payment_initiated': False
                 })
@@ -423,7 +760,7 @@ def cancel_payment():
 def create_session():
     """创建新会话"""
     try:
-        session_id = session_manager.create_session()
+        session_id = get_session_manager().create_session()
         return jsonify(create_response(
             success=True,
             data={'session_id': session_id},
@@ -438,7 +775,7 @@ def create_session():
 def get_session(session_id: str):
     """获取会话信息"""
     try:
-        session = session_manager.get_session(session_id)
+        session = get_session_manager().get_session(session_id)
         
         if not session:
             return jsonify(create_response(success=False, error='会话不存在')), 404
@@ -462,7 +799,41 @@ def internal_error(error):
     return jsonify(create_response(success=False, error='服务器内部错误')), 500
 
 
+_wsgi_asgi_app = WsgiToAsgi(app)
+
+
+async def asgi_app(scope, receive, send):
+    """
+    ASGI 入口：由 uvicorn 托管，支持 HTTP keep-alive 和多 worker
+    
+    每个 worker 在 lifespan 启动事件中于后台加载并预热 Whisper，不阻塞启动；
+    仅导入本模块（工具脚本、测试）不会加载模型。其余请求交给 Flask 处理。
+    """
+    if scope["type"] != "lifespan":
+        await _wsgi_asgi_app(scope, receive, send)
+        return
+    
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            threading.Thread(target=get_asr_worker, name="asr-preload", daemon=True).start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
 if __name__ == '__main__':
     port = config.ai_service_port or 5000
-    logger.info(f"AI Service 启动在端口 {port}")
-    app.run(host='0.0.0.0', port=port, debug=config.debug)
+    # 每个 worker 都会加载一份 Whisper 模型，worker 数量需结合内存评估
+    workers = 1 if config.debug else config.ai_service_workers
+    logger.info(f"AI Service 启动在端口 {port}, workers={workers}")
+    uvicorn.run(
+        "api_gateway:asgi_app",
+        host='0.0.0.0',
+        port=port,
+        workers=workers,
+        loop="auto",  # Linux/macOS 使用 uvloop，Windows 回退到 asyncio
+        http="auto",  # 安装了 httptools 时自动使用
+        reload=config.debug
+    )
@@ -4,10 +4,19 @@ ASR 引擎模块 (ASR Engine)
 """
 
 import logging
+import os
+import queue
+import struct
+import threading
+from concurrent.futures import Future
 from dataclasses import dataclass
-from typing import Optional
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Union
 import time
 
+if TYPE_CHECKING:
+    import numpy as np
+
 logger = logging.getLogger(__name__)
 
 # 尝试导入 faster-whisper，如果失败则使用标准 whisper
@@ -15,8 +24,15 @@ try:
     from faster_whisper import WhisperModel
     FASTER_WHISPER_AVAILABLE = True
     logger.info("使用 faster-whisper 进行 ASR 推理")
+    # 批量推理管线需要 faster-whisper >= 1.0
+    try:
+        from faster_whisper import BatchedInferencePipeline
+        BATCHED_PIPELINE_AVAILABLE = True
+    except ImportError:
+        BATCHED_PIPELINE_AVAILABLE = False
 except ImportError:
     FASTER_WHISPER_AVAILABLE = False
+    BATCHED_PIPELINE_AVAILABLE = False
     logger.warning("faster-whisper 不可用，将使用标准 whisper")
     try:
         import whisper
@@ -27,6 +43,118 @@ except ImportError:
         logger.error("whisper 和 faster-whisper 都不可用")
 
 
+def decode_compressed_audio(audio_data: bytes, sample_rate: int = 16000) -> "np.ndarray":
+    """
+    解码压缩音频 (Opus/WebM/Ogg 等) 并重采样为 float32 单声道
+    
+    Args:
+        audio_data: 压缩音频数据，任意 bytes-like 对象（bytes / memoryview / mmap）
+        sample_rate: 目标采样率 (Hz)，默认 16000
+    
+    Returns:
+        np.ndarray: float32 单声道音频数组
+    
+    Raises:
+        RuntimeError: 如果 PyAV 不可用
+        ValueError: 如果音频无法解码
+    """
+    import io
+    import numpy as np
+    
+    try:
+        import av
+    except ImportError:
+        raise RuntimeError("解码压缩音频需要 PyAV: pip install av")
+    
+    try:
+        resampler = av.AudioResampler(format='flt', layout='mono', rate=sample_rate)
+        chunks = []
+        with av.open(io.BytesIO(audio_data)) as container:
+            for frame in container.decode(audio=0):
+                for resampled in resampler.resample(frame):
+                    chunks.append(resampled.to_ndarray().reshape(-1))
+            # 冲刷重采样器内部缓存
+            for resampled in resampler.resample(None):
+                chunks.append(resampled.to_ndarray().reshape(-1))
+    except av.AVError as e:
+        raise ValueError(f"无法解码音频: {e}")
+    
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks).astype(np.float32, copy=False)
+
+
+def _pcm16_mono_view(audio_data: bytes) -> Optional["np.ndarray"]:
+    """
+    将 16-bit PCM 单声道 WAV 的数据块映射为 int16 数组（不复制）
+    
+    Args:
+        audio_data: WAV 格式的音频数据，任意 bytes-like 对象（bytes / memoryview / mmap）
+    
+    Returns:
+        np.ndarray: int16 采样视图；格式不符时返回 None（交由 soundfile 处理）
+    """
+    import numpy as np
+    
+    if len(audio_data) < 44 or audio_data[:4] != b'RIFF' or audio_data[8:12] != b'WAVE':
+        return None
+    
+    # fmt 块: audio_format=1 (PCM), channels=1, bits_per_sample=16
+    if audio_data[12:16] != b'fmt ':
+        return None
+    audio_format, channels = struct.unpack_from('<HH', audio_data, 20)
+    bits_per_sample, = struct.unpack_from('<H', audio_data, 34)
+    if audio_format != 1 or channels != 1 or bits_per_sample != 16:
+        return None
+    
+    # 查找 data 块（标准头部为 44 字节，但可能存在 LIST 等附加块）
+    offset = 12
+    while offset + 8 <= len(audio_data):
+        chunk_id = audio_data[offset:offset + 4]
+        chunk_size, = struct.unpack_from('<I', audio_data, offset + 4)
+        if chunk_id == b'data':
+            start = offset + 8
+            end = min(start + chunk_size, len(audio_data))
+            return np.frombuffer(audio_data, dtype='<i2', count=(end - start) // 2, offset=start)
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+_model_load_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _cached_whisper_model(model_name: str, device: str, compute_type: Optional[str]):
+    """按 (模型, 设备, 精度) 加载模型，进程内只加载一次"""
+    if compute_type is not None:
+        return WhisperModel(
+            model_name,
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=os.cpu_count() or 0,
+            num_workers=2  # 允许流式转录与后台推理并行
+        )
+    return whisper.load_model(model_name, device=device)
+
+
+def _load_whisper_model(model_name: str, device: str, compute_type: Optional[str]):
+    """
+    获取共享的 Whisper 模型实例
+    
+    同一进程中多个 ASREngine 复用已加载的权重，避免重复下载和加载。
+    
+    Args:
+        model_name: 模型名称
+        device: 运行设备
+        compute_type: faster-whisper 计算精度，标准 whisper 传 None
+        
+    Returns:
+        模型实例
+    """
+    with _model_load_lock:
+        return _cached_whisper_model(model_name, device, compute_type)
+
+
 @dataclass
 class ASRResult:
     """
@@ -59,8 +187,11 @@ class ASREngine:
         self,
         model_name: str = "large-v3",
         device: str = "cpu",
-        compute_type: str = "int8",
-        confidence_threshold: float = 0.7
+        compute_type: str = "auto",
+        confidence_threshold: float = 0.7,
+        batched: bool = True,
+        batch_size: int = 8,
+        warmup: bool = True
     ):
         """
         初始化 ASR 引擎
@@ -69,9 +200,14 @@ class ASREngine:
             model_name: Whisper 模型名称，默认 "large-v3" (最高精度)
                        可选: tiny, base, small, medium, large, large-v2, large-v3
             device: 计算设备，默认 "cpu"，可选 "cuda" (需要 GPU)
-            compute_type: 计算精度，默认 "int8"
+            compute_type: 计算精度，默认 "auto" (按设备能力自动选择)
                          faster-whisper 支持: int8, int8_float16, float16, float32
             confidence_threshold: 置信度阈值，默认 0.7
+            batched: 是否使用 faster-whisper 批量推理管线，默认 True
+                     (不可用时自动回退到逐段 beam search 解码)
+            batch_size: 批量推理时每批的音频窗口数，默认 8
+            warmup: 是否在加载后用静音数据预热模型，默认 True
+                    (避免首个请求承担内核初始化/cuDNN 调优的开销)
         
         Raises:
             RuntimeError: 如果 Whisper 模型不可用
@@ -86,10 +222,16 @@ class ASREngine:
         self.device = device
         self.compute_type = compute_type
         self.confidence_threshold = confidence_threshold
+        self.batched = batched and BATCHED_PIPELINE_AVAILABLE
+        self.batch_size = batch_size
+        self.pipeline = None
         
         # 加载模型
         self._load_model()
         
+        if warmup:
+            self._warmup()
+        
         logger.info(
             f"ASREngine 初始化完成: model={model_name}, device={device}, "
             f"confidence_threshold={confidence_threshold}"
@@ -99,29 +241,86 @@ class ASREngine:
         """加载 Whisper 模型"""
         try:
             if FASTER_WHISPER_AVAILABLE:
+                if self.compute_type == "auto":
+                    self.compute_type = self._select_compute_type()
                 # 使用 faster-whisper (2-4x 速度提升)
-                self.model = WhisperModel(
-                    self.model_name,
-                    device=self.device,
-                    compute_type=self.compute_type
-                )
+                self.model = _load_whisper_model(self.model_name, self.device, self.compute_type)
                 self.use_faster_whisper = True
-                logger.info(f"成功加载 faster-whisper 模型: {self.model_name}")
+                if self.batched:
+                    self.pipeline = BatchedInferencePipeline(model=self.model)
+                logger.info(
+                    f"成功加载 faster-whisper 模型: {self.model_name}, "
+                    f"batched={self.batched}"
+                )
             else:
                 # 使用标准 whisper
-                self.model = whisper.load_model(self.model_name, device=self.device)
+                self.model = _load_whisper_model(self.model_name, self.device, None)
                 self.use_faster_whisper = False
                 logger.info(f"成功加载标准 whisper 模型: {self.model_name}")
         except Exception as e:
             logger.error(f"加载 Whisper 模型失败: {e}")
             raise RuntimeError(f"无法加载 Whisper 模型: {e}")
     
-    def transcribe(self, audio_data: bytes) -> ASRResult:
+    def _select_compute_type(self) -> str:
+        """
+        根据设备支持的 CTranslate2 计算类型选择最快的精度
+        
+        GPU 优先 float16 (Tensor Core)，CPU 优先 int8 (AVX2/AVX512-VNNI 内核)。
+        CTranslate2 在 CPU 上不执行 float16，因此 CPU 不选择 *_float16。
+        
+        Returns:
+            str: 计算类型
+        """
+        import ctranslate2
+        
+        supported = ctranslate2.get_supported_compute_types(self.device)
+        if self.device == "cuda":
+            preferences = ("float16", "int8_float16", "int8", "float32")
+        else:
+            preferences = ("int8", "int8_float32", "float32")
+        
+        for compute_type in preferences:
+            if compute_type in supported:
+                logger.info(f"自动选择计算精度: {compute_type} (支持: {sorted(supported)})")
+                return compute_type
+        return "default"
+    
+    def _warmup(self, seconds: int = 15, sample_rate: int = 16000) -> None:
+        """
+        使用静音数据执行一次推理，预先分配推理内核
+        
+        Args:
+            seconds: 预热音频时长 (秒)
+            sample_rate: 采样率 (Hz)
+        """
+        import numpy as np
+        
+        start_time = time.time()
+        silence = np.zeros(seconds * sample_rate, dtype=np.float32)
+        try:
+            if self.use_faster_whisper:
+                segments, _ = self.model.transcribe(silence, beam_size=1, vad_filter=False)
+                list(segments)  # segments 是惰性生成器，需要消费才会真正解码
+            else:
+                self.model.transcribe(silence, fp16=(self.device == "cuda"))
+            logger.info(f"ASR 模型预热完成，耗时 {time.time() - start_time:.2f}s")
+        except Exception as e:
+            # 预热失败不影响正常使用，首个请求会承担初始化开销
+            logger.warning(f"ASR 模型预热失败: {e}")
+    
+    def transcribe(
+        self,
+        audio_data: Union[bytes, "np.ndarray"],
+        language: Optional[str] = None
+    ) -> ASRResult:
         """
         转录音频为文本
         
         Args:
-            audio_data: WAV 格式的音频数据 (16-bit PCM, 16kHz 推荐)
+            audio_data: WAV 格式的音频数据 (16-bit PCM, 16kHz 推荐)，
+                        或已解码的 float32 单声道 16kHz 音频数组
+            language: 语言代码 (如 'zh', 'en')，None 表示自动检测。
+                      已知语言时传入可跳过语言检测的编码器前向计算
         
         Returns:
             ASRResult: 包含文本、置信度、语言和处理时长的结果对象
@@ -130,16 +329,16 @@ class ASREngine:
             ValueError: 如果音频数据为空或格式无效
             RuntimeError: 如果转录过程失败
         """
-        if not audio_data or len(audio_data) == 0:
+        if audio_data is None or len(audio_data) == 0:
             raise ValueError("音频数据为空")
         
         start_time = time.time()
         
         try:
             if self.use_faster_whisper:
-                result = self._transcribe_faster_whisper(audio_data)
+                result = self._transcribe_faster_whisper(audio_data, language)
             else:
-                result = self._transcribe_standard_whisper(audio_data)
+                result = self._transcribe_standard_whisper(audio_data, language)
             
             duration = time.time() - start_time
             
@@ -164,50 +363,89 @@ class ASREngine:
             logger.error(f"ASR 转录失败: {e}")
             raise RuntimeError(f"转录过程失败: {e}")
     
-    def _transcribe_faster_whisper(self, audio_data: bytes) -> dict:
+    def _load_audio(self, audio_data: Union[bytes, "np.ndarray"]) -> "np.ndarray":
         """
-        使用 faster-whisper 进行转录
+        将输入统一为 float32 音频数组
         
         Args:
-            audio_data: WAV 格式的音频数据
+            audio_data: WAV 格式的音频数据或已解码的音频数组
         
         Returns:
-            dict: 包含 text, confidence, language 的字典
+            np.ndarray: float32 音频数组
         """
+        import numpy as np
+        
+        if isinstance(audio_data, np.ndarray):
+            return audio_data.astype(np.float32, copy=False)
+        
+        # 快速路径：录音模块产出的 16-bit PCM 单声道 WAV 直接按内存视图解析
+        pcm = _pcm16_mono_view(audio_data)
+        if pcm is not None:
+            # 单次分配完成 int16 -> float32 转换与归一化
+            return np.multiply(pcm, np.float32(1.0 / 32768.0), dtype=np.float32)
+        
         import io
         import soundfile as sf
         
         # 从字节数据读取音频
         audio_buffer = io.BytesIO(audio_data)
         audio_array, sample_rate = sf.read(audio_buffer, dtype='float32')
+        return audio_array
+    
+    def _transcribe_faster_whisper(
+        self,
+        audio_data: Union[bytes, "np.ndarray"],
+        language: Optional[str] = None
+    ) -> dict:
+        """
+        使用 faster-whisper 进行转录
         
-        # 转录音频
-        segments, info = self.model.transcribe(
-            audio_array,
-            language=None,  # 自动检测语言
-            beam_size=5,
-            vad_filter=True,  # 启用 VAD (Voice Activity Detection)
-            vad_parameters=dict(min_silence_duration_ms=500)
-        )
+        Args:
+            audio_data: WAV 格式的音频数据或 float32 音频数组
+            language: 语言代码，None 表示自动检测
         
-        # 合并所有片段
-        text_segments = []
-        confidence_scores = []
+        Returns:
+            dict: 包含 text, confidence, language 的字典
+        """
+        import numpy as np
         
-        for segment in segments:
-            text_segments.append(segment.text)
-            # faster-whisper 提供平均对数概率，转换为置信度
-            # avg_logprob 范围通常是 [-1, 0]，转换为 [0, 1]
-            confidence = max(0.0, min(1.0, segment.avg_logprob + 1.0))
-            confidence_scores.append(confidence)
+        audio_array = self._load_audio(audio_data)
+        
+        if self.batched:
+            # 批量推理：按 VAD 切分为 <=30s 的窗口后成批贪心解码
+            # (各窗口独立解码，不依赖前文，相当于 condition_on_previous_text=False)
+            segments, info = self.pipeline.transcribe(
+                audio_array,
+                language=language,  # None 时自动检测语言
+                batch_size=self.batch_size,
+                beam_size=1,
+                vad_filter=True
+            )
+            segments = sorted(segments, key=lambda segment: segment.start)
+        else:
+            # 转录音频
+            segments, info = self.model.transcribe(
+                audio_array,
+                language=language,  # None 时自动检测语言
+                beam_size=5,
+                vad_filter=True,  # 启用 VAD (Voice Activity Detection)
+                vad_parameters=dict(min_silence_duration_ms=500)
+            )
         
-        # 合并文本
-        full_text = " ".join(text_segments).strip()
+        # 合并所有片段
+        segments = list(segments)
+        full_text = " ".join(segment.text for segment in segments).strip()
         
-        # 计算平均置信度
+        # faster-whisper 提供平均对数概率，转换为置信度
+        # avg_logprob 范围通常是 [-1, 0]，+1 后裁剪到 [0, 1] 再取平均
+        log_probs = np.fromiter(
+            (segment.avg_logprob for segment in segments),
+            dtype=np.float32,
+            count=len(segments)
+        )
         avg_confidence = (
-            sum(confidence_scores) / len(confidence_scores)
-            if confidence_scores else 0.0
+            float(np.clip(log_probs + 1.0, 0.0, 1.0).mean())
+            if log_probs.size else 0.0
         )
         
         return {
@@ -216,28 +454,27 @@ class ASREngine:
             'language': info.language
         }
     
-    def _transcribe_standard_whisper(self, audio_data: bytes) -> dict:
+    def _transcribe_standard_whisper(
+        self,
+        audio_data: Union[bytes, "np.ndarray"],
+        language: Optional[str] = None
+    ) -> dict:
         """
         使用标准 whisper 进行转录
         
         Args:
-            audio_data: WAV 格式的音频数据
+            audio_data: WAV 格式的音频数据或 float32 音频数组
+            language: 语言代码，None 表示自动检测
         
         Returns:
             dict: 包含 text, confidence, language 的字典
         """
-        import io
-        import soundfile as sf
-        import torch
-        
-        # 从字节数据读取音频
-        audio_buffer = io.BytesIO(audio_data)
-        audio_array, sample_rate = sf.read(audio_buffer, dtype='float32')
+        audio_array = self._load_audio(audio_data)
         
         # 转录音频
         result = self.model.transcribe(
             audio_array,
-            language=None,  # 自动检测语言
+            language=language,  # None 时自动检测语言
             fp16=(self.device == "cuda")  # GPU 使用 fp16
         )
         
@@ -279,15 +516,190 @@ class ASREngine:
         """
         return confidence >= self.confidence_threshold
     
-    def transcribe_streaming(self, audio_stream):
+    def transcribe_streaming(
+        self,
+        audio_stream: Iterable,
+        sample_rate: int = 16000,
+        window_seconds: float = 2.5,
+        language: Optional[str] = None
+    ) -> Iterator[ASRResult]:
         """
-        流式转录 (未来优化)
+        流式转录：边录音边识别，按 VAD 切分的片段逐段产出结果
+        
+        音频块会累积到滚动缓冲区中，每新到达 window_seconds 秒音频就对缓冲区
+        做一次增量解码。窗口内最后一个片段可能被截断，因此会留到下一个窗口继续识别。
         
         Args:
-            audio_stream: 音频流
+            audio_stream: float32 音频块的可迭代对象 (单声道, sample_rate 采样率)
+            sample_rate: 采样率 (Hz)，默认 16000
+            window_seconds: 解码窗口长度 (秒)，默认 2.5
+            language: 语言代码，None 表示由首个窗口检测后沿用
+        
+        Yields:
+            ASRResult: 每个已完成片段的部分转录结果
         
         Raises:
-            NotImplementedError: 此功能尚未实现
+            RuntimeError: 如果转录过程失败
+        """
+        import numpy as np
+        
+        window_samples = int(window_seconds * sample_rate)
+        # 缓冲区上限，防止连续无停顿的长语音无限累积
+        max_buffer_samples = window_samples * 3
+        buffer = np.zeros(0, dtype=np.float32)
+        # 上次解码之后新到达的采样数；保留的尾部片段不计入，避免同一段音频被反复解码
+        pending_samples = 0
+        
+        def _flush(audio: np.ndarray, final: bool):
+            nonlocal language
+            start_time = time.time()
+            try:
+                segments, detected = self._transcribe_window(audio, language)
+            except Exception as e:
+                logger.error(f"流式 ASR 转录失败: {e}")
+                raise RuntimeError(f"流式转录过程失败: {e}")
+            
+            # 非最终窗口保留最后一个片段，等待更多音频后再识别
+            keep_from = None
+            if not final and len(audio) < max_buffer_samples and segments:
+                keep_from = int(segments[-1][0] * sample_rate)
+                segments = segments[:-1]
+            
+            # 首个窗口检测到的语言沿用到后续窗口，避免重复检测
+            if language is None and segments:
+                language = detected
+            
+            duration = time.time() - start_time
+            results = [
+                ASRResult(
+                    text=text,
+                    confidence=confidence,
+                    language=detected,
+                    duration=duration
+                )
+                for _, text, confidence in segments
+                if text
+            ]
+            remainder = audio[keep_from:] if keep_from is not None else audio[:0]
+            return results, remainder
+        
+        for chunk in audio_stream:
+            chunk = np.asarray(chunk, dtype=np.float32).reshape(-1)
+            if chunk.size == 0:
+                continue
+            buffer = np.concatenate((buffer, chunk))
+            pending_samples += chunk.size
+            if pending_samples < window_samples and len(buffer) < max_buffer_samples:
+                continue
+            
+            results, buffer = _flush(buffer, final=False)
+            pending_samples = 0
+            for result in results:
+                logger.debug(f"流式 ASR 片段: text='{result.text[:50]}'")
+                yield result
+        
+        if len(buffer) > 0:
+            results, _ = _flush(buffer, final=True)
+            yield from results
+    
+    def _transcribe_window(self, audio_array, language: Optional[str] = None) -> tuple:
         """
-        raise NotImplementedError("流式转录功能尚未实现，将在未来版本中添加")
+        对单个流式窗口做低延迟解码
+        
+        Args:
+            audio_array: float32 音频数组
+            language: 语言代码，None 表示自动检测
+        
+        Returns:
+            tuple: ([(start, text, confidence), ...], language)
+        """
+        if self.use_faster_whisper:
+            segments, info = self.model.transcribe(
+                audio_array,
+                language=language,
+                beam_size=1,
+                condition_on_previous_text=False,
+                vad_filter=True,
+                vad_parameters=dict(min_silence_duration_ms=300)
+            )
+            items = [
+                (
+                    segment.start,
+                    segment.text.strip(),
+                    max(0.0, min(1.0, segment.avg_logprob + 1.0))
+                )
+                for segment in segments
+            ]
+            return items, info.language
+        
+        result = self.model.transcribe(
+            audio_array,
+            language=language,
+            fp16=(self.device == "cuda"),
+            condition_on_previous_text=False
+        )
+        items = [
+            (
+                segment.get('start', 0.0),
+                segment.get('text', '').strip(),
+                max(0.0, min(1.0, segment.get('avg_logprob', -1.0) + 1.0))
+            )
+            for segment in result.get('segments', [])
+        ]
+        return items, result.get('language', 'unknown')
+
 
+class ASRWorker:
+    """
+    ASR 后台推理线程
+    
+    职责：
+    - 让模型推理离开请求线程，请求线程只等待 Future
+    - 由单一线程独占模型，避免多个请求线程争抢同一模型实例
+    - 按到达顺序逐个推理，已取消（如超时）的请求直接跳过
+    """
+    
+    def __init__(self, engine: ASREngine):
+        """
+        初始化并启动后台推理线程
+        
+        Args:
+            engine: ASR 引擎实例
+        """
+        self.engine = engine
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="asr-worker", daemon=True)
+        self._thread.start()
+        
+        logger.info("ASRWorker 启动")
+    
+    def submit(
+        self,
+        audio_data: Union[bytes, "np.ndarray"],
+        language: Optional[str] = None
+    ) -> Future:
+        """
+        提交音频进行转录
+        
+        Args:
+            audio_data: WAV 格式的音频数据或 float32 音频数组
+            language: 语言代码，None 表示自动检测
+        
+        Returns:
+            Future: 完成后结果为 ASRResult；等待超时后调用方应 cancel()
+        """
+        future: Future = Future()
+        self._queue.put((audio_data, language, future))
+        return future
+    
+    def _run(self) -> None:
+        """后台推理循环：模型逐条解码，排队的请求无需额外等待窗口"""
+        while True:
+            audio_data, language, future = self._queue.get()
+            # 请求方已取消（如超时）则跳过
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.engine.transcribe(audio_data, language))
+            except Exception as e:
+                future.set_exception(e)
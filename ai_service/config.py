@@ -28,6 +28,9 @@ class Settings(BaseSettings):
     zhipu_model: str = Field(default="glm-4", env="ZHIPU_MODEL")
     zhipu_embedding_model: str = Field(default="embedding-2", env="ZHIPU_EMBEDDING_MODEL")
     
+    # 跨会话合并 LLM 请求（多个用户的输入拼入同一提示），默认关闭
+    llm_cross_session_batching: bool = Field(default=False, env="LLM_CROSS_SESSION_BATCHING")
+    
     # Whisper 配置
     whisper_model: str = Field(default="whisper-large-v3", env="WHISPER_MODEL")
     whisper_device: str = Field(default="cpu", env="WHISPER_DEVICE")
@@ -49,6 +52,7 @@ class Settings(BaseSettings):
     # 服务配置
     ai_service_host: str = Field(default="localhost", env="AI_SERVICE_HOST")
     ai_service_port: int = Field(default=8000, env="AI_SERVICE_PORT")
+    ai_service_workers: int = Field(default=1, env="AI_SERVICE_WORKERS")
     web3_service_url: str = Field(default="http://localhost:3001", env="WEB3_SERVICE_URL")
     debug: bool = Field(default=False, env="DEBUG")
     
@@ -61,11 +65,20 @@ class Settings(BaseSettings):
     
     # 知识库配置
     search_top_k: int = Field(default=5, env="SEARCH_TOP_K")
+    semantic_search_enabled: bool = Field(default=False, env="SEMANTIC_SEARCH_ENABLED")
 
     # 匹配配置
     match_min_score: float = Field(default=0.3, env="MATCH_MIN_SCORE")
     match_top_k: int = Field(default=5, env="MATCH_TOP_K")
     candidate_limit: int = Field(default=20, env="CANDIDATE_LIMIT")
+    nft_index_path: Optional[str] = Field(default=None, env="NFT_INDEX_PATH")
+    nft_quantize_embeddings: bool = Field(default=False, env="NFT_QUANTIZE_EMBEDDINGS")
+    
+    # 语义缓存配置
+    semantic_cache_enabled: bool = Field(default=True, env="SEMANTIC_CACHE_ENABLED")
+    semantic_cache_threshold: float = Field(default=0.87, env="SEMANTIC_CACHE_THRESHOLD")
+    semantic_cache_max_size: int = Field(default=1024, env="SEMANTIC_CACHE_MAX_SIZE")
+    semantic_cache_quantize: bool = Field(default=False, env="SEMANTIC_CACHE_QUANTIZE")
     
     # 日志配置
     log_level: str = Field(default="info", env="LOG_LEVEL")
@@ -4,13 +4,15 @@ Requirements: 13.1, 13.2, 13.3, 13.4, 13.5, 13.6, 13.7
 """
 
 from typing import Optional, Dict, Any
-from enum import Enum
+from enum import IntEnum
+from functools import partial
 import logging
 
 logger = logging.getLogger(__name__)
+_ERROR_LEVEL = logging.ERROR
 
 
-class ErrorCode(Enum):
+class ErrorCode(IntEnum):
     """错误代码枚举"""
     # 通用错误 (1xxx)
     UNKNOWN_ERROR = 1000
@@ -45,9 +47,46 @@ class ErrorCode(Enum):
     LLM_RATE_LIMIT = 6003
 
 
+# 默认的用户友好消息（模块加载时构建一次）
+_DEFAULT_USER_MESSAGES: Dict[ErrorCode, str] = {
+    ErrorCode.UNKNOWN_ERROR: "抱歉，系统出现了未知错误",
+    ErrorCode.INVALID_INPUT: "输入格式不正确，请重试",
+    ErrorCode.MISSING_PARAMETER: "缺少必要的参数",
+    ErrorCode.INVALID_PARAMETER: "参数值无效",
+    
+    ErrorCode.VOICE_INPUT_ERROR: "语音输入失败，请重试",
+    ErrorCode.ASR_ERROR: "语音识别失败，请说清楚一些",
+    ErrorCode.AUDIO_DEVICE_ERROR: "无法访问麦克风，请检查权限",
+    
+    ErrorCode.SEMANTIC_PARSE_ERROR: "无法理解您的意思，请换个说法",
+    ErrorCode.INTENT_RECOGNITION_ERROR: "无法识别您的意图",
+    ErrorCode.ENTITY_EXTRACTION_ERROR: "无法提取关键信息",
+    
+    ErrorCode.KNOWLEDGE_BASE_ERROR: "商品查询失败",
+    ErrorCode.PRODUCT_NOT_FOUND: "没有找到相关商品",
+    ErrorCode.SEARCH_ERROR: "搜索失败，请重试",
+    
+    ErrorCode.SESSION_ERROR: "会话错误",
+    ErrorCode.SESSION_NOT_FOUND: "会话不存在",
+    ErrorCode.SESSION_EXPIRED: "会话已过期，请重新开始",
+    
+    ErrorCode.LLM_ERROR: "AI 处理失败",
+    ErrorCode.LLM_API_ERROR: "AI 服务暂时不可用",
+    ErrorCode.LLM_TIMEOUT: "AI 处理超时，请重试",
+    ErrorCode.LLM_RATE_LIMIT: "请求过于频繁，请稍后再试"
+}
+
+_UNKNOWN_ERROR = ErrorCode.UNKNOWN_ERROR
+
+
 class AppError(Exception):
     """应用错误基类"""
     
+    __slots__ = (
+        "code", "_code_value", "message", "details", "user_message",
+        "_cached_dict", "_cached_response_error"
+    )
+    
     def __init__(
         self,
         code: ErrorCode,
@@ -65,53 +104,44 @@ class AppError(Exception):
             user_message: 用户友好的错误消息
         """
         self.code = code
+        self._code_value = code.value
         self.message = message
         self.details = details or {}
         self.user_message = user_message or self._get_default_user_message(code)
         
+        # 序列化结果缓存（构造后字段不再修改）
+        self._cached_dict: Optional[Dict[str, Any]] = None
+        self._cached_response_error: Optional[Dict[str, Any]] = None
+        
         super().__init__(self.message)
     
-    def _get_default_user_message(self, code: ErrorCode) -> str:
+    @staticmethod
+    def _get_default_user_message(code: ErrorCode) -> str:
         """获取默认的用户友好消息"""
-        messages = {
-            ErrorCode.UNKNOWN_ERROR: "抱歉，系统出现了未知错误",
-            ErrorCode.INVALID_INPUT: "输入格式不正确，请重试",
-            ErrorCode.MISSING_PARAMETER: "缺少必要的参数",
-            ErrorCode.INVALID_PARAMETER: "参数值无效",
-            
-            ErrorCode.VOICE_INPUT_ERROR: "语音输入失败，请重试",
-            ErrorCode.ASR_ERROR: "语音识别失败，请说清楚一些",
-            ErrorCode.AUDIO_DEVICE_ERROR: "无法访问麦克风，请检查权限",
-            
-            ErrorCode.SEMANTIC_PARSE_ERROR: "无法理解您的意思，请换个说法",
-            ErrorCode.INTENT_RECOGNITION_ERROR: "无法识别您的意图",
-            ErrorCode.ENTITY_EXTRACTION_ERROR: "无法提取关键信息",
-            
-            ErrorCode.KNOWLEDGE_BASE_ERROR: "商品查询失败",
-            ErrorCode.PRODUCT_NOT_FOUND: "没有找到相关商品",
-            ErrorCode.SEARCH_ERROR: "搜索失败，请重试",
-            
-            ErrorCode.SESSION_ERROR: "会话错误",
-            ErrorCode.SESSION_NOT_FOUND: "会话不存在",
-            ErrorCode.SESSION_EXPIRED: "会话已过期，请重新开始",
-            
-            ErrorCode.LLM_ERROR: "AI 处理失败",
-            ErrorCode.LLM_API_ERROR: "AI 服务暂时不可用",
-            ErrorCode.LLM_TIMEOUT: "AI 处理超时，请重试",
-            ErrorCode.LLM_RATE_LIMIT: "请求过于频繁，请稍后再试"
-        }
-        return messages.get(code, "系统错误")
+        return _DEFAULT_USER_MESSAGES.get(code, "系统错误")
     
     def to_dict(self) -> Dict[str, Any]:
-        """转换为字典格式"""
-        return {
-            "error": {
-                "code": self.code.value,
-                "message": self.message,
-                "user_message": self.user_message,
+        """转换为字典格式（首次构建后缓存）"""
+        if self._cached_dict is None:
+            self._cached_dict = {
+                "error": {
+                    "code": self._code_value,
+                    "message": self.message,
+                    "user_message": self.user_message,
+                    "details": self.details
+                }
+            }
+        return self._cached_dict
+    
+    def response_error(self) -> Dict[str, Any]:
+        """获取标准错误响应中的 error 部分（首次构建后缓存）"""
+        if self._cached_response_error is None:
+            self._cached_response_error = {
+                "code": self._code_value,
+                "message": self.user_message,
                 "details": self.details
             }
-        }
+        return self._cached_response_error
 
 
 class ErrorResponse:
@@ -134,25 +164,24 @@ class ErrorResponse:
         """
         response = {
             "success": False,
-            "error": {
-                "code": error.code.value,
-                "message": error.user_message,
-                "details": error.details
-            }
+            "error": error.response_error()
         }
         
         if request_id:
             response["request_id"] = request_id
         
-        # 记录错误日志
-        logger.error(
-            f"Error {error.code.value}: {error.message}",
-            extra={
-                "error_code": error.code.value,
-                "details": error.details,
-                "request_id": request_id
-            }
-        )
+        # 记录错误日志（日志级别被过滤时跳过格式化和 extra 构建）
+        if logger.isEnabledFor(_ERROR_LEVEL):
+            logger.error(
+                "Error %s: %s",
+                error._code_value,
+                error.message,
+                extra={
+                    "error_code": error._code_value,
+                    "details": error.details,
+                    "request_id": request_id
+                }
+            )
         
         return response
     
@@ -171,12 +200,13 @@ class ErrorResponse:
         Returns:
             标准错误响应字典
         """
-        if isinstance(exception, AppError):
+        # 绝大多数情况是 AppError 本身，先做精确类型判断再回退到 isinstance
+        if type(exception) is AppError or isinstance(exception, AppError):
             return ErrorResponse.create(exception, request_id)
         
         # 未知错误
         error = AppError(
-            code=ErrorCode.UNKNOWN_ERROR,
+            code=_UNKNOWN_ERROR,
             message=str(exception),
             details={"exception_type": type(exception).__name__}
         )
@@ -184,45 +214,32 @@ class ErrorResponse:
         return ErrorResponse.create(error, request_id)
 
 
-# 便捷的错误创建函数
-def invalid_input_error(message: str, details: Optional[Dict] = None) -> AppError:
-    """创建无效输入错误"""
-    return AppError(ErrorCode.INVALID_INPUT, message, details)
+# 便捷的错误创建函数（预绑定错误代码，签名为 (message, details=None)）
+invalid_input_error = partial(AppError, ErrorCode.INVALID_INPUT)
+voice_input_error = partial(AppError, ErrorCode.VOICE_INPUT_ERROR)
+asr_error = partial(AppError, ErrorCode.ASR_ERROR)
+semantic_parse_error = partial(AppError, ErrorCode.SEMANTIC_PARSE_ERROR)
+llm_error = partial(AppError, ErrorCode.LLM_ERROR)
 
-
-def voice_input_error(message: str, details: Optional[Dict] = None) -> AppError:
-    """创建语音输入错误"""
-    return AppError(ErrorCode.VOICE_INPUT_ERROR, message, details)
-
-
-def asr_error(message: str, details: Optional[Dict] = None) -> AppError:
-    """创建 ASR 错误"""
-    return AppError(ErrorCode.ASR_ERROR, message, details)
-
-
-def semantic_parse_error(message: str, details: Optional[Dict] = None) -> AppError:
-    """创建语义解析错误"""
-    return AppError(ErrorCode.SEMANTIC_PARSE_ERROR, message, details)
+_PRODUCT_NOT_FOUND_FMT = "Product not found for query: {query}"
+_SESSION_NOT_FOUND_FMT = "Session not found: {session_id}"
 
 
 def product_not_found_error(query: str) -> AppError:
     """创建商品未找到错误"""
+    details = {"query": query}
     return AppError(
         ErrorCode.PRODUCT_NOT_FOUND,
-        f"Product not found for query: {query}",
-        {"query": query}
+        _PRODUCT_NOT_FOUND_FMT.format_map(details),
+        details
     )
 
 
 def session_not_found_error(session_id: str) -> AppError:
     """创建会话未找到错误"""
+    details = {"session_id": session_id}
     return AppError(
         ErrorCode.SESSION_NOT_FOUND,
-        f"Session not found: {session_id}",
-        {"session_id": session_id}
+        _SESSION_NOT_FOUND_FMT.format_map(details),
+        details
     )
-
-
-def llm_error(message: str, details: Optional[Dict] = None) -> AppError:
-    """创建 LLM 错误"""
-    return AppError(ErrorCode.LLM_ERROR, message, details)
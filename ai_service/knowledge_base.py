@@ -3,21 +3,158 @@
 使用本地数据文件存储和检索 Web3 商品信息
 """
 
-from dataclasses import dataclass
-from typing import List, Dict, Optional, Any
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, List, Dict, Optional, Any, Set, Callable
+from collections import Counter
 from datetime import datetime
+from functools import lru_cache
+import asyncio
+import atexit
+import hashlib
+import heapq
 import logging
+import math
+import threading
+import time
 import json
 import re
 from pathlib import Path
 
+import orjson
+
 from config import settings
+from semantic_cache import LRUCache, quantize_rows, quantize_vector
+
+if TYPE_CHECKING:
+    from llm_adapter import LLMAdapter
 
 
 logger = logging.getLogger(__name__)
 
+# 分词：连续的小写字母数字串，或单个汉字
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]")
+
+# 向量检索依赖（可选）：numpy 用于嵌入矩阵，numba 用于 JIT 编译相似度内核
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    logger.warning("numpy 不可用，嵌入向量检索已禁用")
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _cosine_scores(query, matrix):
+        """单位查询向量与单位行向量矩阵的余弦相似度，即点积（多线程、SIMD 向量化）"""
+        n, dim = matrix.shape
+        scores = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            dot = np.float32(0.0)
+            for j in range(dim):
+                dot += matrix[i, j] * query[j]
+            scores[i] = dot
+        return scores
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _int8_scores(query, matrix, scales):
+        """int8 量化向量的点积：int32 累加后乘以各行缩放系数"""
+        n, dim = matrix.shape
+        scores = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            acc = np.int32(0)
+            for j in range(dim):
+                acc += np.int32(matrix[i, j]) * np.int32(query[j])
+            scores[i] = acc * scales[i]
+        return scores
+else:
+    def _cosine_scores(query, matrix):
+        """单位查询向量与单位行向量矩阵的余弦相似度，即点积"""
+        return matrix @ query
+
+    # 无 numba 时按行分块计算：每块只把 _INT8_BLOCK_ROWS 行转换为 float32，
+    # 不为每次查询复制整个 int8 矩阵
+    _INT8_BLOCK_ROWS = 4096
+
+    def _int8_scores(query, matrix, scales):
+        """int8 量化向量的点积，乘以各行缩放系数"""
+        q = query.astype(np.float32)
+        scores = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], _INT8_BLOCK_ROWS):
+            block = slice(start, start + _INT8_BLOCK_ROWS)
+            np.dot(matrix[block].astype(np.float32), q, out=scores[block])
+        return scores * scales
+
+
+# 时间戳缓存粒度（纳秒）：同一粒度内的写入共用一个时间戳
+_TIMESTAMP_QUANTUM_NS = 10_000_000
+_timestamp_lock = threading.Lock()
+_last_timestamp: tuple = (-1, None)
+
+
+def _utcnow() -> datetime:
+    """获取当前 UTC 时间，10ms 内的调用复用同一个 datetime 对象"""
+    global _last_timestamp
+    bucket = time.monotonic_ns() // _TIMESTAMP_QUANTUM_NS
+    with _timestamp_lock:
+        if _last_timestamp[0] != bucket:
+            _last_timestamp = (bucket, datetime.utcnow())
+        return _last_timestamp[1]
+
+
+@lru_cache(maxsize=1024)
+def _isoformat(value: datetime) -> str:
+    """datetime -> ISO 字符串；批量写入的商品共享时间戳，保存时大多命中缓存"""
+    return value.isoformat()
+
+
+def _text_digest(text: str) -> bytes:
+    """嵌入文本的摘要，用于判断是否需要重新生成嵌入"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _unit_vector(vector: List[float]) -> List[float]:
+    """L2 归一化向量（零向量原样返回）"""
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm > 0 else list(vector)
+
+
+def _top_k_rows(scores, k: int, tiebreak=None):
+    """
+    取分数最高的 k 个下标，按分数降序、同分按 tiebreak（默认为下标）升序
+    
+    先用 np.partition 在 O(N) 内找到第 k 大的分数，只对不低于它的元素排序，
+    结果与完整的稳定排序一致。
+    """
+    n = len(scores)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= n:
+        candidates = np.arange(n)
+    else:
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        candidates = np.flatnonzero(scores >= kth)
+    ties = candidates if tiebreak is None else tiebreak[candidates]
+    order = np.lexsort((ties, -scores[candidates]))
+    return candidates[order][:k]
+
+
+def _rank_key(item: tuple) -> tuple:
+    """(score, 商品下标) 的排序键：分数降序，同分按下标升序"""
+    return -item[0], item[1]
+
+
+def _price_key(product: "ProductEntity") -> float:
+    return product.price
 
-@dataclass
+
+@dataclass(slots=True)
 class ProductEntity:
     """商品实体数据模型"""
     id: str
@@ -47,35 +184,32 @@ class ProductEntity:
             "contract_address": self.contract_address,
             "token_id": self.token_id,
             "metadata": self.metadata or {},
-            "created_at": self.created_at.isoformat() if self.created_at else None,
-            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "created_at": _isoformat(self.created_at) if self.created_at else None,
+            "updated_at": _isoformat(self.updated_at) if self.updated_at else None,
         }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> "ProductEntity":
         """从字典创建实例"""
-        created_at = None
-        if data.get("created_at"):
-            created_at = datetime.fromisoformat(data["created_at"])
-        
-        updated_at = None
-        if data.get("updated_at"):
-            updated_at = datetime.fromisoformat(data["updated_at"])
+        get = data.get
+        price = data["price"]
+        created_at = get("created_at")
+        updated_at = get("updated_at")
         
         return cls(
             id=data["id"],
             name=data["name"],
             description=data["description"],
             category=data["category"],
-            price=float(data["price"]),
+            price=price if type(price) is float else float(price),
             currency=data["currency"],
             chain=data["chain"],
             contract_address=data["contract_address"],
-            token_id=data.get("token_id"),
-            metadata=data.get("metadata"),
-            embedding=data.get("embedding"),
-            created_at=created_at,
-            updated_at=updated_at,
+            token_id=get("token_id"),
+            metadata=get("metadata"),
+            embedding=get("embedding"),
+            created_at=datetime.fromisoformat(created_at) if created_at else None,
+            updated_at=datetime.fromisoformat(updated_at) if updated_at else None,
         )
 
 
@@ -85,35 +219,236 @@ class KnowledgeBase:
     负责商品信息的存储、检索和本地搜索
     """
     
+    # 单次嵌入请求的最大文本条数
+    EMBEDDING_BATCH_SIZE = 256
+    # 异步检索使用的线程数
+    SEARCH_WORKERS = 8
+    # 估计选择性不超过该值时先过滤再计算相似度，否则先算相似度再过滤
+    PREFILTER_SELECTIVITY = 0.5
+    # 后过滤时首轮检查的候选数量（top_k 的倍数）
+    POSTFILTER_WINDOW = 4
+    # 查询嵌入缓存：容量与存活时间（秒）
+    EMBEDDING_CACHE_SIZE = 2000
+    EMBEDDING_CACHE_TTL = 600
+    
     def __init__(
         self,
         data_path: Optional[str] = None,
+        llm_adapter: Optional["LLMAdapter"] = None,
+        autoflush: bool = True,
+        flush_interval: float = 5.0,
+        quantize_embeddings: bool = False,
     ):
+        """
+        初始化知识库
+        
+        Args:
+            data_path: 商品数据文件路径，默认 data/test_products.json
+            llm_adapter: 用于为新增商品生成嵌入向量的 LLM 适配器，None 表示不生成
+            autoflush: 每次变更后立即写回数据文件；为 False 时由后台定时写回
+            flush_interval: autoflush 关闭时的定时写回间隔（秒）
+            quantize_embeddings: 以 int8 存储嵌入矩阵（内存约为 1/4，相似度为近似值）
+        """
+        self.llm_adapter = llm_adapter
+        self.autoflush = autoflush
+        self.flush_interval = flush_interval
+        # 写回控制：未写回标记、批量上下文嵌套深度、定时写回
+        self._dirty = False
+        # 待应用的变更是否涉及检索文本或嵌入（否则只需刷新列式数据）
+        self._needs_reindex = False
+        self._batch_depth = 0
+        # 待应用的商品列表副本：变更先写入副本，应用时整体替换 self.products 并重建索引，
+        # 检索始终读取与索引一致的列表
+        self._staged: Optional[List[ProductEntity]] = None
+        self._flush_timer: Optional[threading.Timer] = None
+        self._write_lock = threading.RLock()
         base_path = Path(data_path) if data_path else Path(__file__).parent / "data" / "test_products.json"
         self.data_path = base_path
         self.products: List[ProductEntity] = []
+        # id -> 商品索引，get_by_id O(1) 查找
+        self._by_id: Dict[str, ProductEntity] = {}
+        # 倒排索引：词元 -> 商品下标集合；_haystacks 为各商品的小写检索文本
+        self._haystacks: List[str] = []
+        self._postings: Dict[str, Set[int]] = {}
+        self._ascii_terms: List[str] = []
+        # 嵌入矩阵：(N, D) float32 单位向量，_emb_rows[i] 为第 i 行对应的商品下标；
+        # 启用量化时改为 int8 矩阵 + 每行缩放系数，不保留 float32 矩阵
+        self.quantize_embeddings = quantize_embeddings
+        self._emb = None
+        self._emb_i8 = None
+        self._emb_scales = None
+        self._emb_dim = 0
+        self._emb_rows: List[int] = []
+        # 列式存储（过滤只读取相关列）：价格列与按需构建的小写字符串列
+        self._price_col = None
+        self._lower_cols: Dict[str, Any] = {}
+        # 过滤选择性估计：各属性取值计数与排序后的价格列
+        self._value_counts: Dict[str, Counter] = {}
+        self._sorted_prices = None
+        # 搜索结果缓存，商品数据变更时整体失效
+        self._search_cache = LRUCache(max_size=4096)
+        # 查询文本 -> 嵌入向量，重复查询无需再请求 LLM（不随商品变更失效）
+        self._embedding_cache = LRUCache(
+            max_size=self.EMBEDDING_CACHE_SIZE,
+            ttl=self.EMBEDDING_CACHE_TTL
+        )
+        # 异步接口把检索放到线程池执行，不阻塞事件循环
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.SEARCH_WORKERS,
+            thread_name_prefix="kb-search"
+        )
         self._load_products()
+        if not autoflush:
+            atexit.register(self.flush)
         logger.info(f"KnowledgeBase 初始化完成，商品数量: {len(self.products)}")
 
     def _load_products(self) -> None:
+        self.products = []
         if not self.data_path.exists():
-            self.products = []
+            self._reindex()
             return
         try:
-            with self.data_path.open("r", encoding="utf-8") as f:
-                raw = json.load(f)
-            if isinstance(raw, list):
-                self.products = [ProductEntity.from_dict(item) for item in raw if isinstance(item, dict)]
-            else:
-                self.products = []
+            # 一次读入字节后用 orjson 解析，省去文本解码和 stdlib json 的开销
+            raw = orjson.loads(self.data_path.read_bytes())
+            if type(raw) is list:
+                # orjson 只产出内置 dict，精确类型判断即可
+                from_dict = ProductEntity.from_dict
+                self.products = [from_dict(item) for item in raw if type(item) is dict]
         except Exception as e:
             logger.error(f"加载商品数据失败: {e}")
             self.products = []
+        self._reindex()
+
+    def _reindex(self) -> None:
+        """重建 id 索引、倒排索引并清空搜索缓存（商品数据变更后调用）"""
+        self._haystacks = [
+            f"{p.name} {p.description} {p.category} {p.chain} {p.currency}".lower()
+            for p in self.products
+        ]
+        postings: Dict[str, Set[int]] = {}
+        for index, haystack in enumerate(self._haystacks):
+            for token in self._tokenize(haystack):
+                postings.setdefault(token, set()).add(index)
+        self._postings = postings
+        self._ascii_terms = [t for t in postings if not self._is_cjk_token(t)]
+        self._build_embedding_matrix()
+        self._refresh_columns()
+
+    def _refresh_columns(self) -> None:
+        """重建 id 索引、列式数据并清空搜索缓存（商品文本与嵌入未变化时可代替 _reindex）"""
+        self._by_id = {p.id: p for p in self.products}
+        self._lower_cols = {}
+        self._value_counts = {}
+        self._price_col = (
+            np.array([p.price for p in self.products], dtype=np.float64)
+            if NUMPY_AVAILABLE else None
+        )
+        self._sorted_prices = np.sort(self._price_col) if NUMPY_AVAILABLE else None
+        self._search_cache.clear()
 
+    def _build_embedding_matrix(self) -> None:
+        """把带嵌入的商品堆叠为连续的 float32 矩阵，各行归一化为单位向量"""
+        self._emb = None
+        self._emb_i8 = None
+        self._emb_scales = None
+        self._emb_dim = 0
+        self._emb_rows = []
+        if not NUMPY_AVAILABLE:
+            return
+        rows = [i for i, p in enumerate(self.products) if p.embedding]
+        if not rows:
+            return
+        dim = len(self.products[rows[0]].embedding)
+        rows = [i for i in rows if len(self.products[i].embedding) == dim]
+        emb = np.ascontiguousarray(
+            [self.products[i].embedding for i in rows], dtype=np.float32
+        )
+        # 入库时归一化一次，查询时余弦相似度退化为点积；零向量保持为零
+        norms = np.linalg.norm(emb, axis=1, keepdims=True)
+        np.divide(emb, norms, out=emb, where=norms > 0)
+        self._emb_dim = dim
+        if self.quantize_embeddings:
+            self._emb_i8, self._emb_scales = quantize_rows(emb)
+        else:
+            self._emb = emb
+        self._emb_rows = rows
+
+    def __enter__(self) -> "KnowledgeBase":
+        """
+        批量变更：上下文内的修改在退出时统一重建索引并写回一次
+        
+        上下文内的修改写入商品列表副本，检索和 get_by_id 仍基于进入前的商品与索引。
+        """
+        with self._write_lock:
+            self._batch_depth += 1
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        with self._write_lock:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._staged is not None:
+                self._apply_changes()
+    
+    def _staged_products(self) -> List[ProductEntity]:
+        """返回待修改的商品列表副本，首次修改时复制（调用方需持有 _write_lock）"""
+        if self._staged is None:
+            self._staged = list(self.products)
+        return self._staged
+    
+    def _mark_dirty(self, reindex: bool = True) -> None:
+        """
+        记录商品数据已变更；批量上下文之外立即应用副本、重建索引并按策略写回
+        
+        Args:
+            reindex: 变更是否涉及检索文本或嵌入；False 时只刷新列式数据
+        """
+        with self._write_lock:
+            self._needs_reindex = self._needs_reindex or reindex
+            if self._batch_depth == 0:
+                self._apply_changes()
+    
+    def _apply_changes(self) -> None:
+        if self._staged is not None:
+            self.products = self._staged
+            self._staged = None
+        self._dirty = True
+        if self._needs_reindex:
+            self._reindex()
+        else:
+            self._refresh_columns()
+        self._needs_reindex = False
+        if self.autoflush:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def flush(self) -> None:
+        """把未写回的变更写入数据文件"""
+        with self._write_lock:
+            self._flush_timer = None
+            if not self._dirty:
+                return
+            self._save_products()
+            self._dirty = False
+    
     def _save_products(self) -> None:
         self.data_path.parent.mkdir(parents=True, exist_ok=True)
-        with self.data_path.open("w", encoding="utf-8") as f:
-            json.dump([p.to_dict() for p in self.products], f, ensure_ascii=False, indent=2)
+        payload = orjson.dumps(
+            [self._storage_dict(p) for p in self.products],
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+        )
+        self.data_path.write_bytes(payload)
+    
+    @staticmethod
+    def _storage_dict(product: ProductEntity) -> Dict[str, Any]:
+        """持久化用的商品字典（在 to_dict 基础上保留嵌入向量，价格存为数值）"""
+        data = product.to_dict()
+        data["price"] = product.price
+        if product.embedding:
+            data["embedding"] = product.embedding
+        return data
     
     def search(
         self,
@@ -125,34 +460,210 @@ class KnowledgeBase:
         results = self.search_by_text(query_text, top_k=top_k, filters=filters, allow_all=allow_all)
         return results
     
+    async def search_async(
+        self,
+        query_text: str,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        allow_all: bool = False
+    ) -> List[ProductEntity]:
+        """在线程池中执行 search，供异步接口调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            lambda: self.search(query_text, top_k=top_k, filters=filters, allow_all=allow_all)
+        )
+    
+    async def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[List[ProductEntity]]:
+        """
+        并发执行多个查询
+        
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回的数量
+            filters: 过滤条件（所有查询共用）
+            
+        Returns:
+            与 queries 顺序一致的结果列表
+        """
+        return list(await asyncio.gather(
+            *(self.search_async(q, top_k=top_k, filters=filters) for q in queries)
+        ))
+    
     def get_by_id(self, product_id: str) -> Optional[ProductEntity]:
-        for product in self.products:
-            if product.id == product_id:
-                return product
-        return None
-    
-    def update_product(self, product: ProductEntity) -> None:
-        existing_index = next((i for i, p in enumerate(self.products) if p.id == product.id), None)
-        product.updated_at = datetime.utcnow()
-        if existing_index is None:
-            self.products.append(product)
-        else:
-            self.products[existing_index] = product
-        self._save_products()
+        return self._by_id.get(product_id)
+    
+    def get_by_ids(self, product_ids: List[str]) -> List[Optional[ProductEntity]]:
+        """批量按 id 获取商品，不存在的位置为 None"""
+        by_id = self._by_id
+        return [by_id.get(product_id) for product_id in product_ids]
+    
+    def update_product(self, product: ProductEntity, embedding_changed: bool = True) -> None:
+        """
+        更新商品（不存在时新增）
+        
+        检索文本与嵌入都未变化时（如只改了价格）只刷新列式数据，
+        不重建倒排索引和嵌入矩阵；批量导入请使用 add_products。
+        
+        Args:
+            product: 新的商品数据
+            embedding_changed: 为 False 时表示嵌入相关字段未改动，直接沿用原嵌入，不再生成
+        """
+        with self._write_lock:
+            products = self._staged_products()
+            existing_index = next((i for i, p in enumerate(products) if p.id == product.id), None)
+            existing = products[existing_index] if existing_index is not None else None
+            if existing is not None and not embedding_changed:
+                if not product.embedding:
+                    product.embedding = existing.embedding
+            else:
+                self._embed_products([product])
+            product.updated_at = _utcnow()
+            if existing_index is None:
+                products.append(product)
+            else:
+                products[existing_index] = product
+            reindex = (
+                existing is None
+                or self._embedding_text(product) != self._embedding_text(existing)
+                or product.embedding != existing.embedding
+            )
+            self._mark_dirty(reindex=reindex)
     
     def add_product(self, product: ProductEntity) -> None:
-        product.created_at = datetime.utcnow()
-        product.updated_at = product.created_at
-        existing = self.get_by_id(product.id)
-        if existing:
-            self.update_product(product)
+        self.add_products([product])
+    
+    def add_products(
+        self,
+        products: List[ProductEntity],
+        texts: Optional[List[str]] = None
+    ) -> None:
+        """
+        批量添加商品（已存在的 id 覆盖原商品）
+        
+        整批只写一次数据文件、重建一次索引。
+        
+        Args:
+            products: 商品列表
+            texts: 与 products 一一对应的嵌入文本，None 时按商品字段构造
+        """
+        if not products:
+            return
+        self._embed_products(products, texts)
+        now = _utcnow()
+        with self._write_lock:
+            staged = self._staged_products()
+            positions = {p.id: i for i, p in enumerate(staged)}
+            for product in products:
+                product.created_at = now
+                product.updated_at = now
+                index = positions.get(product.id)
+                if index is None:
+                    positions[product.id] = len(staged)
+                    staged.append(product)
+                else:
+                    staged[index] = product
+            self._mark_dirty()
+    
+    async def add_products_async(self, items: List[Dict[str, Any]]) -> None:
+        """
+        批量导入商品字典
+        
+        字段校验、嵌入文本构造、嵌入生成与写入都在线程池中执行，不阻塞事件循环。
+        
+        Args:
+            items: 商品字典列表（格式同数据文件）
+            
+        Raises:
+            KeyError, ValueError: 商品字典缺少必填字段或字段格式错误
+        """
+        if not items:
             return
-        self.products.append(product)
-        self._save_products()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._ingest, items)
+    
+    def _ingest(self, items: List[Dict[str, Any]]) -> None:
+        """校验商品字典、构造嵌入文本并整批写入"""
+        products = [ProductEntity.from_dict(item) for item in items]
+        self.add_products(products, [self._embedding_text(p) for p in products])
+    
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量生成嵌入向量，按 EMBEDDING_BATCH_SIZE 分批请求
+        
+        Args:
+            texts: 文本列表
+            
+        Returns:
+            与输入顺序一致的嵌入向量列表
+        """
+        if self.llm_adapter is None:
+            raise RuntimeError("未配置 LLM 适配器，无法生成嵌入向量")
+        embeddings: List[List[float]] = []
+        for start in range(0, len(texts), self.EMBEDDING_BATCH_SIZE):
+            embeddings.extend(
+                self.llm_adapter.generate_embeddings(texts[start:start + self.EMBEDDING_BATCH_SIZE])
+            )
+        return embeddings
+    
+    def _embed_products(
+        self,
+        products: List[ProductEntity],
+        texts: Optional[List[str]] = None
+    ) -> None:
+        """
+        为缺少嵌入的商品批量生成嵌入（未配置 LLM 适配器时跳过）
+        
+        按嵌入文本的摘要去重：已入库商品的文本未变化时直接复用其嵌入，
+        同一批次中文本相同的商品只请求一次。
+        
+        Args:
+            products: 商品列表
+            texts: 预先构造好的嵌入文本（与 products 对应），None 时现场构造
+        """
+        if self.llm_adapter is None:
+            return
+        if texts is None:
+            texts = [self._embedding_text(product) for product in products]
+        # 文本摘要 -> (文本, 待写入嵌入的商品)
+        pending: Dict[bytes, tuple] = {}
+        for product, text in zip(products, texts):
+            if product.embedding:
+                continue
+            digest = _text_digest(text)
+            existing = self._by_id.get(product.id)
+            if (
+                existing is not None
+                and existing.embedding
+                and _text_digest(self._embedding_text(existing)) == digest
+            ):
+                product.embedding = existing.embedding
+                continue
+            pending.setdefault(digest, (text, []))[1].append(product)
+        if not pending:
+            return
+        groups = list(pending.values())
+        embeddings = self.generate_embeddings([text for text, _ in groups])
+        for (_, targets), embedding in zip(groups, embeddings):
+            unit = _unit_vector(embedding)
+            for product in targets:
+                product.embedding = unit
+    
+    @staticmethod
+    def _embedding_text(product: ProductEntity) -> str:
+        """用于生成嵌入的商品文本"""
+        return f"{product.name} {product.description} {product.category} {product.chain} {product.currency}"
     
     def delete_product(self, product_id: str) -> None:
-        self.products = [p for p in self.products if p.id != product_id]
-        self._save_products()
+        with self._write_lock:
+            staged = self._staged_products()
+            staged[:] = [p for p in staged if p.id != product_id]
+            self._mark_dirty()
     
     def search_by_text(
         self,
@@ -161,56 +672,392 @@ class KnowledgeBase:
         filters: Optional[Dict[str, Any]] = None,
         allow_all: bool = False
     ) -> List[ProductEntity]:
-        filtered = [p for p in self.products if self._match_filters(p, filters)]
-        if not filtered:
+        cache_key = (
+            query_text,
+            json.dumps(filters, sort_keys=True, default=str) if filters else None,
+            top_k,
+            allow_all,
+        )
+        cached = self._search_cache.get(cache_key)
+        if cached is None:
+            cached = self._search_uncached(query_text, top_k, filters, allow_all)
+            self._search_cache.put(cache_key, cached)
+        return list(cached)
+
+    def search_by_embedding(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[ProductEntity]:
+        """
+        按嵌入向量的余弦相似度检索商品
+        
+        Args:
+            query_embedding: 查询向量，维度需与商品嵌入一致
+            top_k: 返回数量
+            filters: 过滤条件
+            
+        Returns:
+            按相似度降序排列的商品列表；没有可用嵌入时返回空列表
+        """
+        if not self._emb_rows or len(query_embedding) != self._emb_dim:
             return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+        limit = self._limit_top_k(top_k)
+        
+        if filters and self._estimate_selectivity(filters) <= self.PREFILTER_SELECTIVITY:
+            # 过滤条件选择性高：先按列过滤，只对满足条件的行计算相似度
+            rows = np.flatnonzero(self._filter_mask(filters)[self._emb_rows])
+            if rows.size == 0:
+                return []
+            scores = self._embedding_scores(query, rows)
+            ranked = rows[_top_k_rows(scores, limit)]
+            return [self.products[self._emb_rows[row]] for row in ranked]
+        
+        # 过滤条件宽松（或无过滤）：先算全部相似度，再按排名逐个检查条件。
+        # 先在前 POSTFILTER_WINDOW 倍 top_k 的候选中查找，不够时再完整排序
+        scores = self._embedding_scores(query)
+        predicate = self._compile_filters(filters)
+        window = _top_k_rows(scores, limit * self.POSTFILTER_WINDOW if filters else limit)
+        results = self._take_matching(window, predicate, limit)
+        if len(results) < limit and len(window) < len(scores):
+            results = self._take_matching(np.argsort(-scores, kind="stable"), predicate, limit)
+        return results
+
+    def _take_matching(self, ranked_rows, predicate, limit: int) -> List[ProductEntity]:
+        """按排名顺序取出满足条件的前 limit 个商品"""
+        results: List[ProductEntity] = []
+        for row in ranked_rows:
+            product = self.products[self._emb_rows[row]]
+            if predicate(product):
+                results.append(product)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def _embedding_scores(self, query, rows=None):
+        """
+        计算单位查询向量与嵌入矩阵（或其中部分行）的余弦相似度
+        
+        Args:
+            query: float32 单位查询向量
+            rows: 参与计算的矩阵行下标，None 表示全部
+            
+        Returns:
+            float32 相似度数组
+        """
+        if self._emb_i8 is None:
+            matrix = self._emb if rows is None else self._emb[rows]
+            return _cosine_scores(query, matrix)
+        query_i8, query_scale = quantize_vector(query)
+        matrix = self._emb_i8 if rows is None else self._emb_i8[rows]
+        scales = self._emb_scales if rows is None else self._emb_scales[rows]
+        return _int8_scores(query_i8, matrix, scales * query_scale)
+
+    def _estimate_selectivity(self, filters: Dict[str, Any]) -> float:
+        """
+        估计满足过滤条件的商品比例（假设各条件相互独立）
+        
+        等值条件按取值计数估计，价格区间在排序后的价格列上二分计数。
+        """
+        total = len(self.products)
+        if total == 0:
+            return 0.0
+        equalities, gte, lte = self._split_filters(filters)
+        selectivity = 1.0
+        for key, expected in equalities:
+            counts = self._value_counts.get(key)
+            if counts is None:
+                counts = Counter(self._lower_column(key).tolist())
+                self._value_counts[key] = counts
+            selectivity *= counts.get(expected, 0) / total
+        if gte is not None or lte is not None:
+            lo = np.searchsorted(self._sorted_prices, gte, side="left") if gte is not None else 0
+            hi = np.searchsorted(self._sorted_prices, lte, side="right") if lte is not None else total
+            selectivity *= max(int(hi) - int(lo), 0) / total
+        return selectivity
+
+    def search_semantic(
+        self,
+        query_text: str,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[ProductEntity]:
+        """
+        语义检索：生成查询嵌入后按余弦相似度检索
+        
+        未配置 LLM 适配器或商品没有嵌入时退回关键词检索。
+        
+        Args:
+            query_text: 查询文本
+            top_k: 返回数量
+            filters: 过滤条件
+            
+        Returns:
+            商品列表
+        """
+        if self.llm_adapter is None or not self._emb_rows or not query_text:
+            return self.search_by_text(query_text, top_k=top_k, filters=filters)
+        try:
+            query_embedding = self.embed_query(query_text)
+        except Exception as e:
+            logger.warning(f"生成查询嵌入失败，退回关键词检索: {e}")
+            return self.search_by_text(query_text, top_k=top_k, filters=filters)
+        return self.search_by_embedding(query_embedding, top_k=top_k, filters=filters)
+
+    async def search_semantic_async(
+        self,
+        query_text: str,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[ProductEntity]:
+        """在线程池中执行 search_semantic，供异步接口调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            lambda: self.search_semantic(query_text, top_k=top_k, filters=filters)
+        )
+
+    def backfill_embeddings(self) -> int:
+        """
+        为缺少嵌入的已有商品补齐嵌入（未配置 LLM 适配器时跳过）
+        
+        在商品副本上生成嵌入后整批写回，补齐前 search_semantic 退回关键词检索。
+        
+        Returns:
+            补齐嵌入的商品数量
+        """
+        if self.llm_adapter is None:
+            return 0
+        originals = [p for p in self.products if not p.embedding]
+        if not originals:
+            return 0
+        pending = [replace(p) for p in originals]
+        self._embed_products(pending)
+        with self._write_lock:
+            staged = self._staged_products()
+            positions = {p.id: i for i, p in enumerate(staged)}
+            for original, product in zip(originals, pending):
+                index = positions.get(product.id)
+                # 补齐期间被更新或删除的商品保持最新状态
+                if index is not None and staged[index] is original:
+                    staged[index] = product
+            self._mark_dirty()
+        logger.info(f"已为 {len(pending)} 个商品补齐嵌入")
+        return len(pending)
+
+    def embed_query(self, query_text: str) -> List[float]:
+        """生成查询文本的嵌入向量（带 LRU + TTL 缓存）"""
+        key = hashlib.blake2b(query_text.encode("utf-8"), digest_size=16).digest()
+        embedding = self._embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.llm_adapter.generate_embedding(query_text)
+            self._embedding_cache.put(key, embedding)
+        return embedding
+
+    def _search_uncached(
+        self,
+        query_text: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        allow_all: bool
+    ) -> List[ProductEntity]:
         if not query_text:
-            sorted_items = sorted(filtered, key=lambda p: p.price)
-            return sorted_items if allow_all else sorted_items[: self._limit_top_k(top_k)]
-        scored = self._score_products(query_text, filtered)
-        sorted_items = sorted(scored, key=lambda x: x[0], reverse=True)
-        results = [p for _, p in sorted_items if allow_all or _ > 0]
-        if allow_all:
-            return results
-        return results[: self._limit_top_k(top_k)]
+            filtered = [self.products[i] for i in self._matching_indices(filters)]
+            if allow_all:
+                return sorted(filtered, key=_price_key)
+            return heapq.nsmallest(self._limit_top_k(top_k), filtered, key=_price_key)
+        scored = self._score_products(query_text, filters)
+        if not allow_all:
+            limit = self._limit_top_k(top_k)
+            if NUMPY_AVAILABLE and len(scored) > limit:
+                # 整数分数放进 int32 数组，用 O(N) 的分区选出前 k 个；同分时保持商品原有顺序
+                count = len(scored)
+                scores = np.fromiter((score for score, _ in scored), dtype=np.int32, count=count)
+                indices = np.fromiter((i for _, i in scored), dtype=np.intp, count=count)
+                top = indices[_top_k_rows(scores, limit, tiebreak=indices)]
+                return [self.products[i] for i in top]
+            # 只需前 k 个：堆选择 O(N log k)；同分时保持商品原有顺序
+            top = heapq.nsmallest(limit, scored, key=_rank_key)
+            return [self.products[i] for _, i in top]
+        scored.sort(key=_rank_key)
+        results = [self.products[i] for _, i in scored]
+        hit = {i for _, i in scored}
+        results.extend(
+            self.products[i] for i in self._matching_indices(filters) if i not in hit
+        )
+        return results
 
     def _limit_top_k(self, top_k: int) -> int:
         if top_k <= 0:
             return settings.search_top_k
         return min(top_k, 5)
 
-    def _match_filters(self, product: ProductEntity, filters: Optional[Dict[str, Any]]) -> bool:
-        if not filters:
-            return True
+    @staticmethod
+    def _split_filters(filters: Dict[str, Any]) -> tuple:
+        """
+        把过滤条件拆分为等值条件和价格区间条件，过滤值只规范化一次
+        
+        Returns:
+            (等值条件 [(属性, 小写值)], 价格下界或 None, 价格上界或 None)
+        """
+        equalities = []
+        gte = lte = None
         for key, value in filters.items():
             if key == "price" and isinstance(value, dict):
-                if "$gte" in value and product.price < float(value["$gte"]):
-                    return False
-                if "$lte" in value and product.price > float(value["$lte"]):
-                    return False
+                if "$gte" in value:
+                    gte = float(value["$gte"])
+                if "$lte" in value:
+                    lte = float(value["$lte"])
             else:
+                equalities.append((key, str(value).lower()))
+        return equalities, gte, lte
+
+    def _filter_mask(self, filters: Dict[str, Any]):
+        """
+        按列计算过滤条件的布尔掩码
+        
+        选择性高的等值条件先于区间条件计算，掩码全为 False 时提前结束。
+        
+        Args:
+            filters: 过滤条件（非空）
+            
+        Returns:
+            长度为商品数量的布尔数组；numpy 不可用时返回 None
+        """
+        if not NUMPY_AVAILABLE:
+            return None
+        equalities, gte, lte = self._split_filters(filters)
+        mask = np.ones(len(self.products), dtype=bool)
+        for key, expected in equalities:
+            mask &= self._lower_column(key) == expected
+            if not mask.any():
+                return mask
+        if gte is not None:
+            mask &= ~(self._price_col < gte)
+        if lte is not None:
+            mask &= ~(self._price_col > lte)
+        return mask
+
+    def _lower_column(self, key: str):
+        """获取某个属性的小写字符串列（首次使用时构建，缺失值为 None）"""
+        column = self._lower_cols.get(key)
+        if column is None:
+            values = []
+            for product in self.products:
+                value = getattr(product, key, None)
+                values.append(None if value is None else str(value).lower())
+            column = np.empty(len(values), dtype=object)
+            column[:] = values
+            self._lower_cols[key] = column
+        return column
+
+    def _index_filter(self, filters: Optional[Dict[str, Any]]) -> Callable[[int], bool]:
+        """返回按商品下标判断是否满足过滤条件的函数"""
+        if not filters:
+            return lambda index: True
+        mask = self._filter_mask(filters)
+        if mask is not None:
+            return mask.__getitem__
+        predicate = self._compile_filters(filters)
+        return lambda index: predicate(self.products[index])
+
+    def _matching_indices(self, filters: Optional[Dict[str, Any]]) -> List[int]:
+        """返回满足过滤条件的商品下标（升序）"""
+        if not filters:
+            return list(range(len(self.products)))
+        mask = self._filter_mask(filters)
+        if mask is not None:
+            return np.flatnonzero(mask).tolist()
+        predicate = self._compile_filters(filters)
+        return [i for i, p in enumerate(self.products) if predicate(p)]
+
+    def _compile_filters(self, filters: Optional[Dict[str, Any]]) -> Callable[[ProductEntity], bool]:
+        """
+        把过滤条件编译为单个判断函数
+        
+        过滤值只规范化一次；等值条件先于区间条件检查，任一条件不满足立即返回。
+        """
+        if not filters:
+            return lambda product: True
+        equalities, gte, lte = self._split_filters(filters)
+        
+        def predicate(product: ProductEntity) -> bool:
+            for key, expected in equalities:
                 product_value = getattr(product, key, None)
-                if product_value is None:
+                if product_value is None or str(product_value).lower() != expected:
                     return False
-                if str(product_value).lower() != str(value).lower():
-                    return False
-        return True
+            if gte is not None and product.price < gte:
+                return False
+            if lte is not None and product.price > lte:
+                return False
+            return True
+        return predicate
 
-    def _score_products(self, query_text: str, products: List[ProductEntity]) -> List[tuple]:
+    def _match_filters(self, product: ProductEntity, filters: Optional[Dict[str, Any]]) -> bool:
+        return self._compile_filters(filters)(product)
+
+    def _score_products(self, query_text: str, filters: Optional[Dict[str, Any]]) -> List[tuple]:
+        """
+        基于倒排索引为商品打分
+        
+        每个命中的查询词元 +1，整句出现在商品文本中再 +3。只有命中至少一个
+        词元的商品才会被打分，无需扫描全部商品文本。
+        
+        Args:
+            query_text: 查询文本
+            filters: 过滤条件
+            
+        Returns:
+            (score, 商品下标) 列表，仅包含 score > 0 且满足过滤条件的商品
+        """
         tokens = self._tokenize(query_text)
         query_lower = query_text.lower().strip()
+        
+        if tokens:
+            counts: Counter = Counter()
+            for token in tokens:
+                counts.update(self._lookup_token(token))
+        elif query_lower:
+            # 没有可索引的词元，只能逐个检查整句匹配
+            counts = Counter({i: 0 for i, h in enumerate(self._haystacks) if query_lower in h})
+        else:
+            return []
+        
+        keep = self._index_filter(filters)
         results = []
-        for product in products:
-            haystack = f"{product.name} {product.description} {product.category} {product.chain} {product.currency}".lower()
-            score = 0
-            if query_lower and query_lower in haystack:
+        for index, score in counts.items():
+            if not keep(index):
+                continue
+            if query_lower and query_lower in self._haystacks[index]:
                 score += 3
-            for token in tokens:
-                if token and token in haystack:
-                    score += 1
-            results.append((score, product))
+            results.append((score, index))
         return results
 
+    def _lookup_token(self, token: str) -> Set[int]:
+        """
+        查找包含该词元的商品下标
+        
+        中文按单字切分，直接查倒排表；字母数字词元需要保持子串匹配语义
+        （如 "nft" 命中 "nfts"），因此在词表中查找包含它的所有词元并合并。
+        """
+        if self._is_cjk_token(token):
+            return self._postings.get(token, set())
+        matched: Set[int] = set()
+        for term in self._ascii_terms:
+            if token in term:
+                matched |= self._postings[term]
+        return matched
+
+    @staticmethod
+    def _is_cjk_token(token: str) -> bool:
+        return len(token) == 1 and "\u4e00" <= token <= "\u9fff"
+
     def _tokenize(self, text: str) -> List[str]:
-        parts = re.findall(r"[a-z0-9]+|[\u4e00-\u9fff]", text.lower())
-        return [p for p in parts if p.strip()]
+        # 正则只匹配非空的字母数字串或单个汉字，无需再过滤空白
+        return _TOKEN_RE.findall(text.casefold())
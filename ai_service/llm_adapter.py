@@ -30,6 +30,11 @@ class LLMAdapter(ABC):
     def generate_embedding(self, text: str) -> List[float]:
         """生成文本嵌入向量"""
         pass
+    
+    @abstractmethod
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """批量生成文本嵌入向量（单次请求，按输入顺序返回）"""
+        pass
 
 
 class OpenAIAdapter(LLMAdapter):
@@ -56,11 +61,24 @@ class OpenAIAdapter(LLMAdapter):
             input=text
         )
         return response.data[0].embedding
+    
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """OpenAI 批量文本嵌入"""
+        if not texts:
+            return []
+        response = self.client.embeddings.create(
+            model=self.embedding_model,
+            input=texts
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
 
 
 class ZhipuAdapter(LLMAdapter):
     """智谱 AI 适配器"""
     
+    # 智谱嵌入接口单次请求的最大文本条数
+    EMBEDDING_BATCH_SIZE = 64
+    
     def __init__(self, api_key: str, model: str, embedding_model: str):
         if not ZHIPU_AVAILABLE:
             raise ImportError(
@@ -96,6 +114,19 @@ class ZhipuAdapter(LLMAdapter):
             input=text
         )
         return response.data[0].embedding
+    
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """智谱 AI 批量文本嵌入（按接口上限分批请求）"""
+        embeddings: List[List[float]] = []
+        for start in range(0, len(texts), self.EMBEDDING_BATCH_SIZE):
+            response = self.client.embeddings.create(
+                model=self.embedding_model,
+                input=texts[start:start + self.EMBEDDING_BATCH_SIZE]
+            )
+            embeddings.extend(
+                item.embedding for item in sorted(response.data, key=lambda d: d.index)
+            )
+        return embeddings
 
 
 def get_llm_adapter() -> LLMAdapter:
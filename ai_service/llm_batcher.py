@@ -0,0 +1,145 @@
+"""
+LLM 微批处理模块 (LLM Micro-Batcher)
+把并发会话的 LLM 请求合并成一次调用，摊薄网络往返并减少限流等待
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    LLM 请求微批处理器
+
+    后台线程从队列中收集请求，凑满 max_batch_size 个或等待 max_wait 秒后
+    发出一次批量调用；批量结果无法使用时逐条回退到单次调用。
+    相邻两次调用之间至少间隔 min_interval 秒。
+    """
+
+    def __init__(
+        self,
+        single_call: Callable[[Any], str],
+        batch_call: Callable[[List[Any]], List[str]],
+        max_batch_size: int = 8,
+        max_wait: float = 0.05,
+        min_interval: float = 0.0
+    ):
+        """
+        初始化微批处理器
+
+        Args:
+            single_call: 单条请求的调用函数，返回 LLM 响应文本
+            batch_call: 批量调用函数，按输入顺序返回每条请求的响应文本；
+                结果无法解析时抛出 ValueError
+            max_batch_size: 单批最大请求数，默认 8
+            max_wait: 收集一批请求的最长等待时间（秒），默认 0.05
+            min_interval: 相邻两次 LLM 调用的最小间隔（秒）
+        """
+        self.single_call = single_call
+        self.batch_call = batch_call
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.min_interval = min_interval
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._last_call_ts = 0.0
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def submit(self, payload: Any) -> Future:
+        """
+        提交一条请求
+
+        Args:
+            payload: 请求内容，原样传给 single_call / batch_call
+
+        Returns:
+            Future，结果为 LLM 响应文本；调用失败时携带异常
+        """
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((payload, future))
+        return future
+
+    def _ensure_worker(self) -> None:
+        """首次提交时启动后台线程"""
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run,
+                    name="llm-batcher",
+                    daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self) -> List[Tuple[Any, Future]]:
+        """阻塞等待第一条请求，再在 max_wait 内尽量凑满一批"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        """后台线程主循环"""
+        while True:
+            batch = self._collect()
+            try:
+                self._dispatch(batch)
+            except Exception as e:
+                logger.error(f"LLM 批处理异常: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _throttle(self) -> None:
+        """保证相邻调用之间的最小间隔"""
+        wait_seconds = self.min_interval - (time.monotonic() - self._last_call_ts)
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+    def _call_single(self, payload: Any, future: Future) -> None:
+        """单条调用，结果或异常写入 future"""
+        self._throttle()
+        try:
+            future.set_result(self.single_call(payload))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self._last_call_ts = time.monotonic()
+
+    def _dispatch(self, batch: List[Tuple[Any, Future]]) -> None:
+        """发出一批请求并分发结果"""
+        if len(batch) == 1:
+            self._call_single(*batch[0])
+            return
+
+        self._throttle()
+        try:
+            responses = self.batch_call([payload for payload, _ in batch])
+            if len(responses) != len(batch):
+                raise ValueError(f"批量响应数量不符: {len(responses)} != {len(batch)}")
+        except Exception as e:
+            logger.warning(f"LLM 批量调用失败，回退为逐条调用（{len(batch)} 条）: {e}")
+            self._last_call_ts = time.monotonic()
+            for payload, future in batch:
+                self._call_single(payload, future)
+            return
+        self._last_call_ts = time.monotonic()
+
+        logger.debug(f"LLM 批量调用完成: {len(batch)} 条请求")
+        for (_, future), response in zip(batch, responses):
+            future.set_result(response)
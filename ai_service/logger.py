@@ -3,56 +3,130 @@
 Requirements: 20.1, 20.2, 20.3, 20.4, 20.5, 20.6, 20.7
 """
 
+import atexit
+import contextvars
+import copy
 import logging
+import mmap
+import queue
+import socket
 import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from pathlib import Path
 from typing import Optional
 from datetime import datetime
-import json
+from functools import lru_cache
+
+import orjson
+
+# 主机名在进程生命周期内不变，只取一次
+_HOSTNAME = socket.gethostname()
+
+# 轮转日志保留天数
+LOG_BACKUP_DAYS = 30
+
+# 当前会话 ID：每个请求（asyncio 任务/线程）各自独立，并发请求互不覆盖
+_session_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("session_id", default="N/A")
 
 
 class SessionContextFilter(logging.Filter):
-    """会话上下文过滤器，为日志添加 session_id"""
-    
-    def __init__(self):
-        super().__init__()
-        self.session_id: Optional[str] = None
+    """会话上下文过滤器，为日志添加当前上下文的 session_id"""
     
     def filter(self, record):
-        record.session_id = self.session_id or "N/A"
+        record.session_id = _session_id_var.get()
         return True
 
 
+@lru_cache(maxsize=64)
+def _utc_second(seconds: int) -> str:
+    """把整秒时间戳格式化为 UTC ISO 字符串（同一秒内的日志复用结果）"""
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+
+
 class JSONFormatter(logging.Formatter):
     """JSON 格式化器"""
     
+    # 可选的额外字段（通过 extra 传入）
+    EXTRA_FIELDS = ("error_code", "details", "request_id")
+    
     def format(self, record):
+        return self.format_bytes(record).decode()
+    
+    def format_bytes(self, record, option: int = 0) -> bytes:
+        """
+        把记录序列化为 UTF-8 编码的 JSON 字节
+        
+        Args:
+            record: 日志记录
+            option: 额外的 orjson 选项（如 orjson.OPT_APPEND_NEWLINE）
+        """
+        # 时间取自记录创建时刻 record.created，不再每条新建 datetime
+        created = record.created
+        seconds = int(created)
+        fields = record.__dict__
         log_data = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": f"{_utc_second(seconds)}.{int((created - seconds) * 1e6):06d}",
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
-            "session_id": getattr(record, "session_id", "N/A"),
+            "session_id": fields.get("session_id", "N/A"),
             "module": record.module,
             "function": record.funcName,
-            "line": record.lineno
+            "line": record.lineno,
+            "hostname": _HOSTNAME,
+            "pid": record.process,
         }
         
         # 添加额外字段
-        if hasattr(record, "error_code"):
-            log_data["error_code"] = record.error_code
-        
-        if hasattr(record, "details"):
-            log_data["details"] = record.details
-        
-        if hasattr(record, "request_id"):
-            log_data["request_id"] = record.request_id
+        for key in self.EXTRA_FIELDS:
+            if key in fields:
+                log_data[key] = fields[key]
         
-        # 添加异常信息
+        # 添加异常信息：格式化结果缓存在 record.exc_text，同一记录交给多个 handler 时只格式化一次
         if record.exc_info:
-            log_data["exception"] = self.formatException(record.exc_info)
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+            log_data["exception"] = record.exc_text
         
-        return json.dumps(log_data, ensure_ascii=False)
+        # orjson 直接输出 UTF-8，无法序列化的值按 str 处理
+        return orjson.dumps(log_data, default=str, option=option)
+
+
+class JSONStreamHandler(logging.StreamHandler):
+    """
+    JSON 日志流 handler
+    
+    流提供底层二进制缓冲（如 sys.stdout.buffer）时，直接写入 orjson 输出的字节，
+    省去 bytes -> str -> bytes 的往返；否则退回普通 StreamHandler 行为。
+    """
+    
+    def emit(self, record):
+        buffer = getattr(self.stream, "buffer", None)
+        formatter = self.formatter
+        if buffer is None or not isinstance(formatter, JSONFormatter):
+            super().emit(record)
+            return
+        try:
+            data = formatter.format_bytes(record, orjson.OPT_APPEND_NEWLINE)
+            # 先写出文本层已缓冲的内容，保证输出顺序
+            self.stream.flush()
+            buffer.write(data)
+            self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """入队前只合并消息参数，异常信息留给下游 formatter 按各自格式输出"""
+    
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
 
 
 def setup_logging(
@@ -75,37 +149,42 @@ def setup_logging(
     logger = logging.getLogger()
     logger.setLevel(getattr(logging, log_level.upper()))
     
-    # 清除现有的 handlers
+    # 清除现有的 handlers，并停止上一次配置的后台写日志线程
+    first_setup = not hasattr(logger, 'log_listener')
+    _stop_listener()
     logger.handlers.clear()
+    handlers = []
     
     # 添加会话上下文过滤器
     session_filter = SessionContextFilter()
     
     # 控制台 handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    
     if enable_json:
+        console_handler = JSONStreamHandler(sys.stdout)
         console_formatter = JSONFormatter()
     else:
+        console_handler = logging.StreamHandler(sys.stdout)
         console_formatter = logging.Formatter(
             '%(asctime)s - %(name)s - [%(session_id)s] - %(levelname)s - %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
         )
     
+    console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(console_formatter)
-    console_handler.addFilter(session_filter)
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
     
     # 文件 handler（如果指定了日志目录）
     if log_dir:
         log_path = Path(log_dir)
         log_path.mkdir(parents=True, exist_ok=True)
         
-        # 通用日志文件
-        file_handler = logging.FileHandler(
-            log_path / f"app_{datetime.now().strftime('%Y%m%d')}.log",
-            encoding='utf-8'
+        # 通用日志文件：每天午夜轮转（app.log -> app.log.YYYY-MM-DD），首次写入时才打开
+        file_handler = TimedRotatingFileHandler(
+            log_path / "app.log",
+            when="midnight",
+            backupCount=LOG_BACKUP_DAYS,
+            encoding='utf-8',
+            delay=True
         )
         file_handler.setLevel(logging.DEBUG)
         
@@ -119,53 +198,87 @@ def setup_logging(
             )
         
         file_handler.setFormatter(file_formatter)
-        file_handler.addFilter(session_filter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
         
         # 错误日志文件
-        error_handler = logging.FileHandler(
-            log_path / f"error_{datetime.now().strftime('%Y%m%d')}.log",
-            encoding='utf-8'
+        error_handler = TimedRotatingFileHandler(
+            log_path / "error.log",
+            when="midnight",
+            backupCount=LOG_BACKUP_DAYS,
+            encoding='utf-8',
+            delay=True
         )
         error_handler.setLevel(logging.ERROR)
         error_handler.setFormatter(file_formatter)
-        error_handler.addFilter(session_filter)
-        logger.addHandler(error_handler)
+        handlers.append(error_handler)
     
-    # 存储 session_filter 以便后续更新
+    # 根 logger 只挂一个 QueueHandler，请求线程只负责入队；
+    # 由后台 QueueListener 线程交给上面的 handlers 完成实际写出。
+    # session_id 在入队时写入记录，保证与产生日志的请求一致
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(session_filter)
+    logger.addHandler(queue_handler)
+    
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    if first_setup:
+        atexit.register(_stop_listener)
+    
+    # 存储 session_filter，存储 listener 以便退出时停止
     logger.session_filter = session_filter
+    logger.log_listener = listener
     
     return logger
 
 
-def set_session_id(session_id: str):
+def _stop_listener():
+    """停止后台写日志线程并写出缓冲中的日志（重新配置或进程退出时调用）"""
+    root = logging.getLogger()
+    listener = getattr(root, 'log_listener', None)
+    if listener is not None:
+        root.log_listener = None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.flush()
+
+
+def set_session_id(session_id: Optional[str]) -> contextvars.Token:
     """
-    设置当前会话 ID
+    设置当前上下文的会话 ID
     
     Args:
-        session_id: 会话 ID
+        session_id: 会话 ID，None 表示无会话
+        
+    Returns:
+        可传给 clear_session_id 以恢复之前值的 token
     """
-    logger = logging.getLogger()
-    if hasattr(logger, 'session_filter'):
-        logger.session_filter.session_id = session_id
+    return _session_id_var.set(session_id or "N/A")
 
 
-def clear_session_id():
-    """清除当前会话 ID"""
-    logger = logging.getLogger()
-    if hasattr(logger, 'session_filter'):
-        logger.session_filter.session_id = None
+def clear_session_id(token: Optional[contextvars.Token] = None):
+    """
+    清除当前上下文的会话 ID
+    
+    Args:
+        token: set_session_id 返回的 token，提供时恢复到设置前的值
+    """
+    if token is not None:
+        _session_id_var.reset(token)
+    else:
+        _session_id_var.set("N/A")
 
 
 class LoggerAdapter(logging.LoggerAdapter):
     """日志适配器，自动添加上下文信息"""
     
     def process(self, msg, kwargs):
-        # 添加额外的上下文信息
-        if 'extra' not in kwargs:
-            kwargs['extra'] = {}
-        
-        kwargs['extra'].update(self.extra)
+        # 添加额外的上下文信息：调用方未传 extra 时直接复用上下文字典，不再每次新建
+        extra = kwargs.get('extra')
+        if extra is None:
+            kwargs['extra'] = self.extra
+        elif self.extra:
+            kwargs['extra'] = {**extra, **self.extra}
         return msg, kwargs
 
 
@@ -197,6 +310,37 @@ class LogQuery:
         """
         self.log_dir = Path(log_dir)
     
+    def _log_file(self, name: str, date: Optional[str]) -> Optional[Path]:
+        """
+        定位某天的日志文件
+        
+        当天日志写在 {name}.log，午夜轮转后为 {name}.log.YYYY-MM-DD；
+        同时兼容旧的 {name}_YYYYMMDD.log 命名。
+        
+        Args:
+            name: 日志名（app / error）
+            date: 日期 (YYYYMMDD)，默认今天
+            
+        Returns:
+            日志文件路径，不存在时返回 None
+        """
+        if not date:
+            date = datetime.now().strftime('%Y%m%d')
+        current = self.log_dir / f"{name}.log"
+        candidates = [
+            current.with_name(f"{current.name}.{date[:4]}-{date[4:6]}-{date[6:8]}"),
+            self.log_dir / f"{name}_{date}.log",
+        ]
+        for path in candidates:
+            if path.exists():
+                return path
+        # 当天的日志，或进程在午夜后尚未写入（尚未轮转）时的前一天日志
+        if current.exists():
+            modified = datetime.fromtimestamp(current.stat().st_mtime).strftime('%Y%m%d')
+            if modified == date:
+                return current
+        return None
+    
     def query_by_session(
         self,
         session_id: str,
@@ -212,19 +356,30 @@ class LogQuery:
         Returns:
             日志记录列表
         """
-        if not date:
-            date = datetime.now().strftime('%Y%m%d')
+        log_file = self._log_file("app", date)
         
-        log_file = self.log_dir / f"app_{date}.log"
-        
-        if not log_file.exists():
+        if log_file is None:
             return []
         
+        # 内存映射后在字节层面查找会话 ID，只解码命中的行
+        needle = session_id.encode('utf-8')
         results = []
-        with open(log_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if session_id in line:
-                    results.append(line.strip())
+        with open(log_file, 'rb') as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # 空文件无法映射
+                return []
+            with mm:
+                pos = mm.find(needle)
+                while pos != -1:
+                    start = mm.rfind(b"\n", 0, pos) + 1
+                    end = mm.find(b"\n", pos)
+                    if end == -1:
+                        end = len(mm)
+                    results.append(mm[start:end].decode('utf-8', errors='replace').strip())
+                    # 同一行出现多次只记录一次
+                    pos = mm.find(needle, end)
         
         return results
     
@@ -243,12 +398,9 @@ class LogQuery:
         Returns:
             错误日志列表
         """
-        if not date:
-            date = datetime.now().strftime('%Y%m%d')
-        
-        error_file = self.log_dir / f"error_{date}.log"
+        error_file = self._log_file("error", date)
         
-        if not error_file.exists():
+        if error_file is None:
             return []
         
         results = []
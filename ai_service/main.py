@@ -5,10 +5,14 @@ FastAPI 服务器
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
+import asyncio
+import logging
 import os
+from collections import deque
+from types import MappingProxyType
 import uvicorn
 import uuid
 from config import settings
@@ -16,6 +20,7 @@ from voice_feedback import voice_feedback, FeedbackType
 from error_handler import AppError, ErrorResponse
 from logger import setup_logging, set_session_id, clear_session_id, get_logger
 import httpx
+import orjson
 
 # 配置日志系统
 setup_logging(
@@ -28,13 +33,17 @@ logger = get_logger(__name__)
 
 from semantic_parser import SemanticParser, IntentType
 from knowledge_base import KnowledgeBase
+from llm_adapter import llm_adapter
 from session_manager import SessionManager
 from nft_matcher import NFTMatcher
 
 # 初始化核心服务
 try:
     semantic_parser = SemanticParser()
-    knowledge_base = KnowledgeBase()
+    # 启用语义检索时知识库使用 LLM 适配器生成商品与查询嵌入
+    knowledge_base = KnowledgeBase(
+        llm_adapter=llm_adapter if settings.semantic_search_enabled else None
+    )
     session_manager = SessionManager()
     logger.info("核心服务初始化成功")
 except Exception as e:
@@ -46,14 +55,22 @@ if settings.llm_provider.lower() == "openai" and settings.openai_api_key:
     nft_matcher = NFTMatcher(
         openai_api_key=settings.openai_api_key,
         embedding_model=settings.openai_embedding_model,
-        min_score=settings.match_min_score
+        min_score=settings.match_min_score,
+        index_path=settings.nft_index_path,
+        quantize_embeddings=settings.nft_quantize_embeddings
     )
 
+# Web3 服务端点（启动时拼接一次）
+WEB3_ORDERBOOK_ORDERS_URL = f"{settings.web3_service_url}/api/orderbook/orders"
+WEB3_BUY_URL = f"{settings.web3_service_url}/api/web3/buy"
+
 # 创建 FastAPI 应用
 app = FastAPI(
     title="Voice-to-Pay AI Service",
     description="AI 语义层服务 - 语音识别、语义理解和商品知识库查询",
-    version="0.1.0"
+    version="0.1.0",
+    # 默认用 orjson 序列化响应
+    default_response_class=ORJSONResponse
 )
 
 # 配置 CORS
@@ -66,27 +83,65 @@ app.add_middleware(
 )
 
 
+# 预生成的请求 ID：一次读取 16*N 字节随机数切分为 N 个 UUID4，减少 urandom 系统调用
+_REQUEST_ID_BATCH = 256
+_request_id_pool: deque = deque()
+
+
+def _next_request_id() -> str:
+    """从请求 ID 池取一个 UUID4 字符串，池空时批量补充"""
+    try:
+        return _request_id_pool.popleft()
+    except IndexError:
+        buf = os.urandom(16 * _REQUEST_ID_BATCH)
+        _request_id_pool.extend(
+            str(uuid.UUID(bytes=buf[i:i + 16], version=4))
+            for i in range(0, len(buf), 16)
+        )
+        return _request_id_pool.popleft()
+
+
+@app.on_event("startup")
+async def backfill_product_embeddings():
+    """启用语义检索时在后台为缺少嵌入的商品补齐嵌入，不阻塞启动"""
+    if not settings.semantic_search_enabled:
+        return
+    
+    def _backfill():
+        try:
+            knowledge_base.backfill_embeddings()
+        except Exception as e:
+            logger.warning("商品嵌入补齐失败，语义检索将退回关键词检索: %s", e)
+    
+    asyncio.get_running_loop().run_in_executor(None, _backfill)
+
+
 # 请求 ID 中间件
 @app.middleware("http")
 async def add_request_id(request: Request, call_next):
     """为每个请求添加唯一 ID"""
-    request_id = str(uuid.uuid4())
+    request_id = _next_request_id()
     request.state.request_id = request_id
+    # 会话 ID 存放在当前请求的上下文中，结束时恢复，避免并发请求相互覆盖
+    session_token = set_session_id(request.headers.get("X-Session-ID"))
     
-    logger.info(
-        f"Request started: {request.method} {request.url.path}",
-        extra={"request_id": request_id}
-    )
-    
-    response = await call_next(request)
-    response.headers["X-Request-ID"] = request_id
-    
-    logger.info(
-        f"Request completed: {response.status_code}",
-        extra={"request_id": request_id}
-    )
-    
-    return response
+    try:
+        logger.info(
+            "Request started: %s %s", request.method, request.url.path,
+            extra={"request_id": request_id}
+        )
+        
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        
+        logger.info(
+            "Request completed: %s", response.status_code,
+            extra={"request_id": request_id}
+        )
+        
+        return response
+    finally:
+        clear_session_id(session_token)
 
 
 # 全局异常处理
@@ -161,21 +216,26 @@ class BuyRequest(BaseModel):
     dryRun: Optional[bool] = False
 
 
+# 固定内容的响应体只序列化一次
+_ROOT_BODY = orjson.dumps({
+    "service": "Voice-to-Pay AI Service",
+    "status": "running",
+    "version": "0.1.0"
+})
+_HEALTH_BODY = orjson.dumps({"status": "healthy"})
+
+
 @app.get("/")
 async def root():
     """健康检查端点"""
-    return {
-        "service": "Voice-to-Pay AI Service",
-        "status": "running",
-        "version": "0.1.0"
-    }
+    return Response(content=_ROOT_BODY, media_type="application/json")
 
 
 @app.get("/health")
 async def health_check():
     """健康检查"""
     logger.debug("Health check called")
-    return {"status": "healthy"}
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 
 # 语音反馈 API
@@ -191,7 +251,7 @@ async def generate_feedback(request: FeedbackRequest, req: Request):
         )
         
         logger.info(
-            f"Generated feedback: {request.template_key}",
+            "Generated feedback: %s", request.template_key,
             extra={"request_id": req.state.request_id}
         )
         
@@ -243,14 +303,19 @@ async def format_error_message(request: ErrorMessageRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# 无会话时传给语义解析的空上下文
+_EMPTY_CONTEXT = MappingProxyType({})
+
+
 # 语义解析 API（前端集成）
 @app.post("/parse")
 async def parse_text(request: ParseRequest, req: Request):
     """解析用户输入文本"""
     try:
-        logger.info(f"Parsing text: {request.text[:50]}...")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Parsing text: %s...", request.text[:50])
         
-        session_context = {}
+        session_context = _EMPTY_CONTEXT
         session_id = request.session_id
         session = None
 
@@ -265,40 +330,42 @@ async def parse_text(request: ParseRequest, req: Request):
                 session_id = session.session_id
 
             if session:
-                session_context = {
-                    "conversation_history": session.conversation_history,
-                    "selected_products": session.selected_products
-                }
+                # 只读视图直接引用会话对象的属性字典（含 conversation_history、selected_products），不复制
+                session_context = MappingProxyType(vars(session))
         except Exception as e:
-            logger.warning(f"获取会话失败: {e}")
+            logger.warning("获取会话失败: %s", e)
+        set_session_id(session_id)
 
-        # 调用语义解析
-        parsed_intent = semantic_parser.parse(
+        # 调用语义解析（在线程中等待，并发请求可合并为一次 LLM 调用）
+        parsed_intent = await asyncio.to_thread(
+            semantic_parser.parse,
             text=request.text,
             session_context=session_context
         )
 
         logger.info(
-            f"Parse result: intent={parsed_intent.intent.value}, "
-            f"confidence={parsed_intent.confidence:.3f}, "
-            f"entities={parsed_intent.entities}, "
-            f"missing_info={parsed_intent.missing_info}"
+            "Parse result: intent=%s, confidence=%.3f, entities=%s, missing_info=%s",
+            parsed_intent.intent.value,
+            parsed_intent.confidence,
+            parsed_intent.entities,
+            parsed_intent.missing_info
         )
         
         # 记录到会话历史
         try:
-            session_manager.add_conversation_message(session_id, "user", request.text)
-            session_manager.add_conversation_message(
-                session_id, 
-                "assistant", 
-                f"Parsed intent: {parsed_intent.intent.value}",
-                metadata={
-                    "intent": parsed_intent.intent.value,
-                    "confidence": parsed_intent.confidence
-                }
-            )
+            session_manager.add_conversation_messages(session_id, [
+                ("user", request.text, None),
+                (
+                    "assistant",
+                    f"Parsed intent: {parsed_intent.intent.value}",
+                    {
+                        "intent": parsed_intent.intent.value,
+                        "confidence": parsed_intent.confidence
+                    }
+                ),
+            ], turn_embedding=semantic_parser.turn_embedding(request.text))
         except Exception as e:
-            logger.warning(f"更新会话历史失败: {e}")
+            logger.warning("更新会话历史失败: %s", e)
 
         action = None
         discovery_filters = None
@@ -324,7 +391,7 @@ async def parse_text(request: ParseRequest, req: Request):
             "default_query": default_query
         }
 
-        return response_payload
+        return ORJSONResponse(response_payload)
     except Exception as e:
         logger.error(f"Parse failed: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -335,31 +402,34 @@ async def parse_text(request: ParseRequest, req: Request):
 async def search_products(request: SearchRequest, req: Request):
     """搜索商品"""
     try:
-        logger.info(f"Searching products: {request.query}")
+        logger.info("Searching products: %s", request.query)
 
         list_all = bool(request.list_all) or semantic_parser.is_list_all_request(request.query)
         top_k = request.top_k or 5
-        results = knowledge_base.search_by_text(
-            request.query,
-            top_k=top_k,
-            allow_all=list_all
-        )
+        if list_all:
+            results = await knowledge_base.search_async(request.query, top_k=top_k, allow_all=True)
+        else:
+            # 未启用语义检索或商品尚无嵌入时，search_semantic 退回关键词检索
+            results = await knowledge_base.search_semantic_async(request.query, top_k=top_k)
         products = [product.to_dict() for product in results]
 
         session_id = request.session_id
         if session_id:
-            session = session_manager.get_session(session_id)
-            if session is None:
-                session = session_manager.create_session(user_id=session_id)
-                session_id = session.session_id
-            session_manager.update_context(session_id, "selected_products", products)
-
-        return {
+            try:
+                # 直接写入选中商品；写入时已校验会话存在，无需先读取整个会话
+                session_manager.update_context(session_id, "selected_products", products)
+            except ValueError:
+                session_id = session_manager.create_session(user_id=session_id).session_id
+                session_manager.update_context(session_id, "selected_products", products)
+            set_session_id(session_id)
+
+        # 商品字典只含基础类型，直接用 orjson 序列化，跳过 jsonable_encoder
+        return ORJSONResponse({
             "success": True,
             "products": products,
             "total": len(products),
             "session_id": session_id
-        }
+        })
     except Exception as e:
         logger.error(f"Search failed: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -371,7 +441,7 @@ async def match_nfts(request: MatchRequest, req: Request):
     try:
         async with httpx.AsyncClient() as client:
             response = await client.get(
-                f"{settings.web3_service_url}/api/orderbook/orders",
+                WEB3_ORDERBOOK_ORDERS_URL,
                 params={"limit": settings.candidate_limit, "includeMetadata": "true"}
             )
             response.raise_for_status()
@@ -412,7 +482,7 @@ async def buy_nft(request: BuyRequest, req: Request):
             if request.maxPrice is not None:
                 payload["maxPrice"] = str(request.maxPrice)
             response = await client.post(
-                f"{settings.web3_service_url}/api/web3/buy",
+                WEB3_BUY_URL,
                 json=payload,
                 timeout=60.0,
             )
@@ -3,47 +3,271 @@ NFT 语义匹配模块
 使用 OpenAI Embedding 对用户查询与订单簿候选做语义匹配，返回最相关的 top_k 订单
 """
 
+import asyncio
+import hashlib
+import heapq
+import importlib.util
+import logging
 import math
+from functools import lru_cache
+from operator import itemgetter
+from pathlib import Path
 from typing import List, Dict, Any, Optional
 
-from openai import OpenAI
+import httpx
+import orjson
+from openai import AsyncOpenAI
 
+from semantic_cache import LRUCache, quantize_rows
 
-def _cosine_similarity(a: List[float], b: List[float]) -> float:
-    """计算两个向量的余弦相似度"""
-    if not a or not b or len(a) != len(b):
+logger = logging.getLogger(__name__)
+
+# numpy 可选：可用时一次矩阵乘法完成全部候选打分，否则逐个计算
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    logger.warning("numpy 不可用，NFT 匹配将逐个计算余弦相似度")
+
+# HTTP/2 需要 h2 包，不可用时使用 HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# FAISS 可选：可用时候选索引使用 FAISS 内积检索（SIMD 内核）
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+
+def _unit(vector: List[float]) -> List[float]:
+    """L2 归一化（零向量原样返回）"""
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return vector
+    return [x / norm for x in vector]
+
+
+def _cosine_similarity(unit_a: List[float], b: List[float]) -> float:
+    """
+    计算余弦相似度
+    
+    Args:
+        unit_a: 已归一化的向量（如查询向量，只需归一化一次）
+        b: 任意向量
+    """
+    if not unit_a or not b or len(unit_a) != len(b):
         return 0.0
-    dot = sum(x * y for x, y in zip(a, b))
-    norm_a = math.sqrt(sum(x * x for x in a))
-    norm_b = math.sqrt(sum(x * x for x in b))
-    if norm_a == 0 or norm_b == 0:
+    norm_b = math.sqrt(sum(y * y for y in b))
+    if norm_b == 0:
         return 0.0
-    return dot / (norm_a * norm_b)
+    return sum(x * y for x, y in zip(unit_a, b)) / norm_b
+
+
+def _top_indices(scores, top_k: int, min_score: float) -> List[int]:
+    """
+    选出得分 >= min_score 的前 top_k 个下标，按得分降序、同分按下标升序
+    
+    先用 np.argpartition 做 O(N) 选择，只对选中的部分排序。
+    """
+    candidates = np.flatnonzero(scores >= min_score)
+    if candidates.size > top_k > 0:
+        kth = np.argpartition(-scores[candidates], top_k - 1)[top_k - 1]
+        candidates = candidates[scores[candidates] >= scores[candidates[kth]]]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:max(top_k, 0)].tolist()
+
+
+@lru_cache(maxsize=None)
+def _shared_client(api_key: str) -> AsyncOpenAI:
+    """
+    按 API Key 共享的 AsyncOpenAI 客户端
+    
+    所有 NFTMatcher 实例复用同一个连接池，避免每个实例各自握手建立 TLS 连接。
+    """
+    http_client = httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+        timeout=15,
+    )
+    return AsyncOpenAI(api_key=api_key, http_client=http_client)
+
+
+def _candidates_signature(model: str, texts: List[str]) -> str:
+    """按模型与全部候选文本生成签名，用于判断候选集合是否变化"""
+    digest = hashlib.blake2b(model.encode("utf-8"), digest_size=16)
+    for text in texts:
+        digest.update(b"\x1f")
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _embedding_key(model: str, text: str) -> str:
+    """按模型和文本内容哈希生成嵌入缓存键"""
+    return f"emb:{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
 
 
 def _text_for_candidate(candidate: Dict[str, Any]) -> str:
-    """从候选订单中提取用于嵌入的文本（名称、描述等）"""
-    parts = []
-    # orderKey 可作为标识
-    order_key = candidate.get("orderKey") or ""
-    if order_key:
-        parts.append(order_key)
+    """从候选订单中提取用于嵌入的文本（orderKey、名称、tokenId、合约地址）"""
     # metadata 来自 orderbook API: { tokenURI, name }
-    metadata = candidate.get("metadata") or {}
-    name = metadata.get("name")
-    if name:
-        parts.append(str(name))
-    # 若有 order 信息，可拼接 nft 相关描述
-    order = candidate.get("order") or {}
-    nft = order.get("nft") or {}
-    if nft:
-        token_id = nft.get("tokenId")
-        if token_id is not None:
-            parts.append(f"tokenId {token_id}")
-        addr = nft.get("collectionAddr")
-        if addr:
-            parts.append(addr)
-    return " ".join(parts) if parts else order_key or "unknown"
+    name = (candidate.get("metadata") or {}).get("name")
+    nft = (candidate.get("order") or {}).get("nft") or {}
+    token_id = nft.get("tokenId")
+    text = " ".join(part for part in (
+        candidate.get("orderKey"),
+        str(name) if name else None,
+        f"tokenId {token_id}" if token_id is not None else None,
+        nft.get("collectionAddr"),
+    ) if part)
+    return text or "unknown"
+
+
+class CandidateIndex:
+    """
+    候选订单的嵌入索引（需要 numpy）
+    
+    订单簿变化缓慢：候选集合不变时复用已归一化的嵌入矩阵，
+    每次查询只需嵌入查询文本并做一次内积检索。可持久化到磁盘，重启后无需重新嵌入。
+    启用量化时矩阵以 int8 + 每行缩放系数存储，内存约为 1/4，相似度为近似值。
+    """
+
+    EMBEDDINGS_FILE = "embeddings.npy"
+    SCALES_FILE = "scales.npy"
+    CANDIDATES_FILE = "candidates.json"
+
+    def __init__(
+        self,
+        signature: str,
+        candidates: List[Dict[str, Any]],
+        rows: List[int],
+        matrix,
+        scales=None,
+        use_faiss: bool = True,
+    ):
+        """
+        Args:
+            signature: 候选集合签名
+            candidates: 全部候选订单
+            rows: 矩阵各行对应的候选下标
+            matrix: (len(rows), D) 单位向量矩阵，float32 或 int8
+            scales: int8 矩阵的每行缩放系数，float32 矩阵时为 None
+            use_faiss: FAISS 可用时构建 FAISS 索引；只检索一次的临时索引无需构建
+        """
+        self.signature = signature
+        self.candidates = candidates
+        self.rows = rows
+        self.matrix = matrix
+        self.scales = scales
+        self.faiss_index = None
+        if use_faiss and FAISS_AVAILABLE and rows:
+            dim = matrix.shape[1]
+            if scales is None:
+                self.faiss_index = faiss.IndexFlatIP(dim)
+            else:
+                self.faiss_index = faiss.IndexScalarQuantizer(
+                    dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+                )
+            vectors = self._float_matrix()
+            self.faiss_index.train(vectors)
+            self.faiss_index.add(vectors)
+
+    @classmethod
+    def build(
+        cls,
+        signature: str,
+        candidates: List[Dict[str, Any]],
+        embeddings: List[List[float]],
+        quantize: bool = False,
+        use_faiss: bool = True,
+    ) -> "CandidateIndex":
+        """
+        由候选与其嵌入构建索引，缺少嵌入或维度不一致的候选不入索引
+        
+        Args:
+            quantize: 以 int8 存储嵌入矩阵
+            use_faiss: 是否构建 FAISS 索引
+        """
+        dim = next((len(emb) for emb in embeddings if emb), 0)
+        rows = [i for i, emb in enumerate(embeddings) if emb and len(emb) == dim]
+        matrix = np.asarray([embeddings[i] for i in rows], dtype=np.float32).reshape(len(rows), dim)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+        if quantize and rows:
+            return cls(signature, candidates, rows, *quantize_rows(matrix), use_faiss=use_faiss)
+        return cls(signature, candidates, rows, matrix, use_faiss=use_faiss)
+
+    def _float_matrix(self):
+        """float32 形式的嵌入矩阵（int8 存储时反量化）"""
+        if self.scales is None:
+            return self.matrix
+        return self.matrix.astype(np.float32) * self.scales[:, None]
+
+    def search(self, query_emb: List[float], top_k: int, min_score: float) -> List[tuple]:
+        """
+        检索与查询向量最相似的候选
+        
+        Returns:
+            [(余弦相似度, 候选订单)]，按相似度降序，仅包含得分 >= min_score 的前 top_k 条
+        """
+        if not self.rows or top_k <= 0 or len(query_emb) != self.matrix.shape[1]:
+            return []
+        q = np.asarray(query_emb, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0:
+            return []
+        q /= q_norm
+        if self.faiss_index is not None:
+            scores, ids = self.faiss_index.search(q[None, :], min(top_k, len(self.rows)))
+            return [
+                (float(score), self.candidates[self.rows[j]])
+                for score, j in zip(scores[0], ids[0])
+                if j >= 0 and score >= min_score
+            ]
+        if self.scales is None:
+            scores = self.matrix @ q
+        else:
+            scores = (self.matrix @ q) * self.scales
+        return [
+            (float(scores[j]), self.candidates[self.rows[j]])
+            for j in _top_indices(scores, top_k, min_score)
+        ]
+
+    def save(self, directory: Path) -> None:
+        """把索引写入目录：嵌入矩阵存为 .npy，候选与签名存为 JSON"""
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / self.EMBEDDINGS_FILE, self.matrix)
+        scales_file = directory / self.SCALES_FILE
+        if self.scales is not None:
+            np.save(scales_file, self.scales)
+        elif scales_file.exists():
+            scales_file.unlink()
+        (directory / self.CANDIDATES_FILE).write_bytes(orjson.dumps({
+            "signature": self.signature,
+            "rows": self.rows,
+            "candidates": self.candidates,
+        }))
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional["CandidateIndex"]:
+        """从目录加载索引，文件不存在或损坏时返回 None"""
+        try:
+            meta = orjson.loads((directory / cls.CANDIDATES_FILE).read_bytes())
+            matrix = np.load(directory / cls.EMBEDDINGS_FILE)
+            scales = np.load(directory / cls.SCALES_FILE) if matrix.dtype == np.int8 else None
+        except (OSError, ValueError) as e:
+            logger.warning(f"加载 NFT 候选索引失败: {e}")
+            return None
+        rows = meta["rows"]
+        if (
+            matrix.ndim != 2
+            or matrix.shape[0] != len(rows)
+            or (scales is not None and scales.shape != (len(rows),))
+        ):
+            logger.warning("NFT 候选索引文件不一致，已忽略")
+            return None
+        if scales is None:
+            matrix = matrix.astype(np.float32)
+        return cls(meta["signature"], meta["candidates"], rows, matrix, scales)
 
 
 class NFTMatcher:
@@ -54,34 +278,135 @@ class NFTMatcher:
         openai_api_key: str,
         embedding_model: str = "text-embedding-3-small",
         min_score: float = 0.3,
+        cache_size: int = 4096,
+        index_path: Optional[str] = None,
+        quantize_embeddings: bool = False,
     ):
-        self.client = OpenAI(api_key=openai_api_key)
+        # 异步客户端：嵌入请求不阻塞 FastAPI 事件循环；同一 API Key 共享连接池
+        self.client = _shared_client(openai_api_key)
         self.embedding_model = embedding_model
         self.min_score = min_score
+        # 嵌入缓存：键为内容哈希，订单簿候选在多次查询间重复出现时无需重新请求
+        self._embedding_cache = LRUCache(max_size=cache_size)
+        # 候选嵌入索引：由 build_index 或候选集合变化后的后台刷新构建，候选集合一致时跨查询复用；
+        # 指定 index_path 时持久化到磁盘
+        self.index_path = Path(index_path) if index_path else None
+        self.quantize_embeddings = quantize_embeddings
+        self._index: Optional[CandidateIndex] = None
+        # 候选集合变化后在后台刷新共享索引的任务（同一时间只有一个）
+        self._refresh_task: Optional[asyncio.Task] = None
+        if NUMPY_AVAILABLE and self.index_path is not None and self.index_path.exists():
+            index = CandidateIndex.load(self.index_path)
+            # 磁盘索引的存储方式与 quantize_embeddings 不一致时丢弃，由下次查询触发重建
+            if index is not None and (index.scales is not None) != quantize_embeddings:
+                logger.info("NFT 候选索引的量化设置已变化，将重新构建")
+                index = None
+            self._index = index
 
-    def _embed(self, text: str) -> List[float]:
-        """单条文本嵌入"""
-        if not text.strip():
-            return []
-        resp = self.client.embeddings.create(
-            model=self.embedding_model,
-            input=text.strip(),
+    async def build_index(self, candidates: List[Dict[str, Any]]) -> Optional[CandidateIndex]:
+        """
+        预先为候选订单构建嵌入索引（需要 numpy）
+        
+        Args:
+            candidates: 候选订单列表
+            
+        Returns:
+            构建好的索引；numpy 不可用时返回 None
+        """
+        if not NUMPY_AVAILABLE:
+            return None
+        texts = [_text_for_candidate(c) for c in candidates]
+        embeddings = await self._embed_batch(texts)
+        signature = _candidates_signature(self.embedding_model, texts)
+        return await self._build_shared_index(signature, candidates, embeddings)
+
+    async def _build_shared_index(
+        self,
+        signature: str,
+        candidates: List[Dict[str, Any]],
+        embeddings: List[List[float]],
+    ) -> CandidateIndex:
+        """在线程中构建共享索引（含 FAISS 训练与量化），替换当前索引并持久化"""
+        index = await asyncio.to_thread(
+            CandidateIndex.build, signature, candidates, embeddings, self.quantize_embeddings
         )
-        return resp.data[0].embedding
-
-    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
-        """批量文本嵌入（过滤空字符串）"""
-        non_empty = [(i, t.strip()) for i, t in enumerate(texts) if t and t.strip()]
-        if not non_empty:
-            return [[]] * len(texts)
-        indices, valid_texts = zip(*non_empty)
-        resp = self.client.embeddings.create(
+        return await self._set_index(index)
+
+    def _schedule_refresh(
+        self,
+        signature: str,
+        candidates: List[Dict[str, Any]],
+        embeddings: List[List[float]],
+    ) -> None:
+        """候选集合变化时在后台刷新共享索引；已有刷新任务在运行时跳过，由之后的查询再次触发"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(
+            self._refresh_index(signature, candidates, embeddings)
+        )
+
+    async def _refresh_index(
+        self,
+        signature: str,
+        candidates: List[Dict[str, Any]],
+        embeddings: List[List[float]],
+    ) -> None:
+        """后台刷新任务：失败只记录日志，下次候选集合不一致时重试"""
+        try:
+            await self._build_shared_index(signature, candidates, embeddings)
+            logger.info(f"NFT 候选索引已刷新: {len(candidates)} 条候选")
+        except Exception as e:
+            logger.warning(f"刷新 NFT 候选索引失败: {e}")
+
+    async def _set_index(self, index: CandidateIndex) -> CandidateIndex:
+        """替换当前索引，配置了 index_path 时在线程中写入磁盘"""
+        self._index = index
+        if self.index_path is not None:
+            try:
+                await asyncio.to_thread(index.save, self.index_path)
+            except OSError as e:
+                logger.warning(f"保存 NFT 候选索引失败: {e}")
+        return index
+
+    async def _embed(self, text: str) -> List[float]:
+        """单条文本嵌入"""
+        return (await self._embed_batch([text]))[0]
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量文本嵌入（过滤空字符串，命中缓存的文本不再请求）
+        
+        先按文本去重：相同文本只计算一次缓存键、只请求一次，结果广播到所有位置。
+        """
+        results: List[List[float]] = [[] for _ in texts]
+        positions: Dict[str, List[int]] = {}
+        for i, t in enumerate(texts):
+            text = t.strip() if t else ""
+            if text:
+                positions.setdefault(text, []).append(i)
+
+        missing: List[str] = []
+        for text, indices in positions.items():
+            cached = self._embedding_cache.get(_embedding_key(self.embedding_model, text))
+            if cached is None:
+                missing.append(text)
+                continue
+            for i in indices:
+                results[i] = cached
+        if not missing:
+            return results
+
+        resp = await self.client.embeddings.create(
             model=self.embedding_model,
-            input=list(valid_texts),
+            input=missing,
         )
-        # 按原始顺序排列
-        by_idx = {indices[j]: resp.data[j].embedding for j in range(len(resp.data))}
-        return [by_idx.get(i, []) for i in range(len(texts))]
+        # 按原始顺序排列并写入缓存
+        for text, item in zip(missing, resp.data):
+            embedding = item.embedding
+            self._embedding_cache.put(_embedding_key(self.embedding_model, text), embedding)
+            for i in positions[text]:
+                results[i] = embedding
+        return results
 
     async def match_nfts(
         self,
@@ -96,28 +421,50 @@ class NFTMatcher:
         if not query or not candidates:
             return []
 
-        # 单次查询嵌入
-        query_emb = self._embed(query)
+        texts = [_text_for_candidate(c) for c in candidates]
+        signature = _candidates_signature(self.embedding_model, texts)
+        index = self._index
+        if NUMPY_AVAILABLE and index is not None and index.signature == signature:
+            # 候选集合未变化：只嵌入查询，直接在已有索引上检索
+            query_emb = await self._embed(query)
+            if not query_emb:
+                return []
+            scored = index.search(query_emb, top_k, self.min_score)
+            return self._format_matches(scored[:top_k])
+
+        # 查询与候选文本合并为一次嵌入请求，省去一次 HTTP 往返
+        embeddings = await self._embed_batch([query, *texts])
+        query_emb = embeddings[0]
         if not query_emb:
             return []
-
-        # 为每个候选生成文本并批量嵌入
-        texts = [_text_for_candidate(c) for c in candidates]
-        candidate_embs = self._embed_batch(texts)
+        candidate_embs = embeddings[1:]
 
         # 计算相似度并排序
-        scored: List[tuple] = []
-        for i, cand in enumerate(candidates):
-            emb = candidate_embs[i] if i < len(candidate_embs) else []
-            if not emb:
-                continue
-            score = _cosine_similarity(query_emb, emb)
-            if score >= self.min_score:
-                scored.append((score, cand))
-
-        scored.sort(key=lambda x: -x[0])
-        top = scored[:top_k]
+        if NUMPY_AVAILABLE:
+            # 候选集合与共享索引不一致：本次用临时矩阵打分（不构建 FAISS、不持久化），
+            # 同时在后台刷新共享索引，之后相同候选集合的查询只需嵌入查询文本
+            index = CandidateIndex.build(signature, candidates, candidate_embs, use_faiss=False)
+            scored = index.search(query_emb, top_k, self.min_score)
+            self._schedule_refresh(signature, candidates, candidate_embs)
+        else:
+            # 查询向量只归一化一次，每个候选只需计算自身范数与点积
+            unit_query = _unit(query_emb)
+            scores = (
+                (_cosine_similarity(unit_query, emb), cand)
+                for emb, cand in zip(candidate_embs, candidates)
+                if emb
+            )
+            # 堆选择 O(N log k)；同分时保持候选原有顺序
+            scored = heapq.nlargest(
+                top_k,
+                (item for item in scores if item[0] >= self.min_score),
+                key=itemgetter(0)
+            )
+        return self._format_matches(scored[:top_k])
 
+    @staticmethod
+    def _format_matches(top: List[tuple]) -> List[Dict[str, Any]]:
+        """把 (得分, 候选) 列表转换为接口返回格式"""
         return [
             {
                 "orderKey": t[1].get("orderKey"),
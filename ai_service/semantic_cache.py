@@ -0,0 +1,380 @@
+"""
+语义缓存模块 (Semantic Cache)
+对相同或语义相近的输入复用此前的模型结果，跳过 LLM / ASR 调用
+"""
+
+import base64
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# 尝试导入向量相似度依赖，如果失败则只做精确匹配
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    from sentence_transformers import SentenceTransformer
+    EMBEDDING_AVAILABLE = NUMPY_AVAILABLE
+except ImportError:
+    EMBEDDING_AVAILABLE = False
+    logger.warning("sentence-transformers 不可用，语义缓存将只使用精确匹配")
+
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：小写并折叠空白"""
+    return " ".join(text.lower().split())
+
+
+def audio_fingerprint(audio_data: bytes) -> str:
+    """计算音频数据的指纹，用作精确缓存键"""
+    return hashlib.sha1(audio_data).hexdigest()
+
+
+def encode_embedding(vector) -> str:
+    """
+    把句向量压缩为 float16 并做 base64 编码，便于存入会话
+
+    384 维向量编码后约 1KB，远小于 JSON 浮点数组
+    """
+    return base64.b64encode(np.asarray(vector, dtype=np.float16).tobytes()).decode("ascii")
+
+
+def decode_embeddings(encoded: Sequence[str]):
+    """
+    解码 encode_embedding 的结果
+
+    Args:
+        encoded: 编码后的向量列表（维度一致）
+
+    Returns:
+        (n, dim) float32 矩阵
+    """
+    raw = b"".join(base64.b64decode(item) for item in encoded)
+    return np.frombuffer(raw, dtype=np.float16).reshape(len(encoded), -1).astype(np.float32)
+
+
+def quantize_rows(matrix):
+    """
+    按行对称量化为 int8
+
+    Returns:
+        (int8 矩阵, 每行缩放系数 float32)，原值约等于 int8 值 * 缩放系数
+    """
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return np.ascontiguousarray(quantized), scales.astype(np.float32)
+
+
+def quantize_vector(vector):
+    """把单个向量对称量化为 int8，返回 (int8 向量, 缩放系数)"""
+    quantized, scales = quantize_rows(vector[None, :])
+    return quantized[0], scales[0]
+
+
+class LRUCache:
+    """线程安全的 LRU 缓存（可选 TTL 过期）"""
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        """
+        初始化 LRU 缓存
+
+        Args:
+            max_size: 最大条目数
+            ttl: 条目存活时间（秒），None 表示不过期
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (value, 过期时间)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """获取缓存值，不存在或已过期返回 None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            if len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SemanticCache:
+    """
+    语义缓存
+
+    先按规范化文本精确匹配；未命中时用句向量做余弦相似度检索，
+    相似度不低于阈值即视为命中。向量存放在预分配的矩阵中，按 LRU 淘汰，
+    可选 TTL 过期；可选按行 int8 量化存储（内存约为 1/4，相似度为近似值）。
+
+    传入 context（最近几轮输入的向量）时，上下文向量为 sum(decay^i * context[-i])，
+    与输入向量分开比较：只有输入相似度不低于 threshold、且上下文相似度不低于
+    context_threshold 的条目才能命中；有上下文与无上下文的条目互不命中。
+    同一句话在不同对话上下文下不会互相命中。
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.87,
+        max_size: int = 1024,
+        embedder: Optional[Callable[[str], List[float]]] = None,
+        ttl: Optional[float] = None,
+        model_name: str = DEFAULT_EMBEDDING_MODEL,
+        context_threshold: float = 0.9,
+        context_decay: float = 0.6,
+        context_turns: int = 3,
+        quantize: bool = False
+    ):
+        """
+        初始化语义缓存
+
+        Args:
+            threshold: 余弦相似度命中阈值，默认 0.87
+            max_size: 最大条目数，默认 1024
+            embedder: 文本向量化函数，默认使用 model_name 指定的模型（不可用时仅精确匹配）
+            ttl: 条目存活时间（秒），None 表示不过期
+            model_name: 未提供 embedder 时使用的 sentence-transformers 模型
+            context_threshold: 上下文向量的余弦相似度命中阈值，默认 0.9
+            context_decay: 上下文向量按轮次的衰减系数，默认 0.6
+            context_turns: 参与混合的最近轮数，默认 3
+            quantize: 是否以 int8 存储缓存向量（每行一个缩放系数）
+        """
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.model_name = model_name
+        self.context_threshold = context_threshold
+        self.context_decay = context_decay
+        self.context_turns = context_turns
+        self._embedder = embedder
+        self._use_vectors = EMBEDDING_AVAILABLE or (NUMPY_AVAILABLE and embedder is not None)
+        # 规范化文本 -> 单位向量，同一输入的查询、写入和会话记录只编码一次
+        self._embedding_memo = LRUCache(max_size=max_size)
+
+        # key -> (slot, value, 过期时间)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.quantize = quantize
+        self._vectors = None  # (max_size, dim) 单位向量矩阵（量化时为 int8），首次写入时分配
+        self._scales = None  # 量化时每行的缩放系数
+        self._contexts = None  # (max_size, dim) 各条目的单位上下文向量（float32），首次写入带上下文的条目时分配
+        self._has_context = None
+        self._valid = None
+        self._slot_keys: List[Optional[str]] = [None] * max_size
+        self._free_slots = list(range(max_size - 1, -1, -1))
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+
+    def _embed(self, text: str):
+        """计算单位化的文本向量"""
+        if self._embedder is None:
+            # 并发的首次查询只加载一次模型
+            with self._model_lock:
+                if self._embedder is None:
+                    model = SentenceTransformer(self.model_name)
+                    self._embedder = lambda t: model.encode(t, normalize_embeddings=True)
+        vector = self._embedding_memo.get(text)
+        if vector is None:
+            vector = self._normalize(np.asarray(self._embedder(text), dtype=np.float32))
+            self._embedding_memo.put(text, vector)
+        return vector
+
+    @staticmethod
+    def _normalize(vector):
+        """向量单位化（零向量原样返回）"""
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed(self, text: str) -> Optional[str]:
+        """
+        计算文本的单位向量并编码，供调用方保存为对话上下文
+
+        Args:
+            text: 原始输入文本
+
+        Returns:
+            encode_embedding 编码的向量，向量检索不可用时返回 None
+        """
+        if not self._use_vectors:
+            return None
+        return encode_embedding(self._embed(normalize_text(text)))
+
+    def _context_key(self, text: str, context: Optional[Sequence[Sequence[float]]]):
+        """
+        计算缓存键和检索向量
+
+        Returns:
+            (缓存键, 规范化文本, 上下文向量或 None)；上下文向量为最近几轮的衰减加权和（单位化）
+        """
+        key = normalize_text(text)
+        if not self._use_vectors or context is None or len(context) == 0:
+            return key, key, None
+        matrix = np.asarray(context, dtype=np.float32)[-self.context_turns:]
+        # 最近一轮权重 decay^1，依次递减
+        weights = self.context_decay ** np.arange(len(matrix), 0, -1, dtype=np.float32)
+        context_vector = self._normalize(weights @ matrix)
+        digest = hashlib.blake2b(matrix.tobytes(), digest_size=8).hexdigest()
+        return f"{key}#{digest}", key, context_vector
+
+    def get(
+        self,
+        text: str,
+        context: Optional[Sequence[Sequence[float]]] = None
+    ) -> Optional[Any]:
+        """
+        查询缓存
+
+        Args:
+            text: 原始输入文本
+            context: 最近几轮输入的向量（按时间顺序），None 表示不考虑上下文
+
+        Returns:
+            命中的缓存值，未命中返回 None
+        """
+        key, normalized, context_vector = self._context_key(text, context)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expire_if_stale(key, entry):
+                    return None
+                self._entries.move_to_end(key)
+                return entry[1]
+            if not self._use_vectors or self._vectors is None:
+                return None
+
+        vector = self._embed(normalized)
+        with self._lock:
+            scores = self._vectors @ vector
+            if self._scales is not None:
+                scores *= self._scales
+            scores[~self._valid] = -1.0
+            # 上下文不一致的条目不参与命中：无上下文只匹配无上下文，
+            # 有上下文时要求上下文相似度不低于 context_threshold
+            if context_vector is None:
+                if self._has_context is not None:
+                    scores[self._has_context] = -1.0
+            elif self._contexts is None:
+                return None
+            else:
+                context_scores = self._contexts @ context_vector
+                scores[~self._has_context | (context_scores < self.context_threshold)] = -1.0
+            slot = int(np.argmax(scores))
+            if scores[slot] < self.threshold:
+                return None
+            hit_key = self._slot_keys[slot]
+            entry = self._entries[hit_key]
+            if self._expire_if_stale(hit_key, entry):
+                return None
+            self._entries.move_to_end(hit_key)
+            logger.debug(f"语义缓存命中: '{key}' ~ '{hit_key}' ({scores[slot]:.3f})")
+            return entry[1]
+
+    def _expire_if_stale(self, key: str, entry: tuple) -> bool:
+        """条目已过期时删除并返回 True（调用方需持有锁）"""
+        expires_at = entry[2]
+        if expires_at is None or expires_at > time.monotonic():
+            return False
+        del self._entries[key]
+        self._release_slot(entry[0])
+        return True
+
+    def put(
+        self,
+        text: str,
+        value: Any,
+        context: Optional[Sequence[Sequence[float]]] = None
+    ) -> None:
+        """
+        写入缓存
+
+        Args:
+            text: 原始输入文本
+            value: 要缓存的结果
+            context: 最近几轮输入的向量（按时间顺序），需与查询时一致
+        """
+        key, normalized, context_vector = self._context_key(text, context)
+        vector = self._embed(normalized) if self._use_vectors else None
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                slot = self._entries[key][0]
+                self._entries[key] = (slot, value, expires_at)
+                self._entries.move_to_end(key)
+                return
+
+            if not self._free_slots:
+                _, (evicted_slot, _, _) = self._entries.popitem(last=False)
+                self._release_slot(evicted_slot)
+
+            slot = self._free_slots.pop()
+            if vector is not None:
+                if self._vectors is None:
+                    dtype = np.int8 if self.quantize else np.float32
+                    self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=dtype)
+                    self._valid = np.zeros(self.max_size, dtype=bool)
+                    if self.quantize:
+                        self._scales = np.ones(self.max_size, dtype=np.float32)
+                if self.quantize:
+                    self._vectors[slot], self._scales[slot] = quantize_vector(vector)
+                else:
+                    self._vectors[slot] = vector
+                if context_vector is not None and self._contexts is None:
+                    self._contexts = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+                    self._has_context = np.zeros(self.max_size, dtype=bool)
+                if self._contexts is not None:
+                    has_context = context_vector is not None
+                    self._contexts[slot] = context_vector if has_context else 0.0
+                    self._has_context[slot] = has_context
+                self._valid[slot] = True
+            self._slot_keys[slot] = key
+            self._entries[key] = (slot, value, expires_at)
+
+    def _release_slot(self, slot: int) -> None:
+        """释放向量槽位（调用方需持有锁）"""
+        if self._valid is not None:
+            self._valid[slot] = False
+        self._slot_keys[slot] = None
+        self._free_slots.append(slot)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            if self._valid is not None:
+                self._valid[:] = False
+            self._slot_keys = [None] * self.max_size
+            self._free_slots = list(range(self.max_size - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self._entries)
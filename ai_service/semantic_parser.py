@@ -3,24 +3,195 @@
 负责理解用户意图，提取关键实体和参数
 """
 
+import hashlib
 import logging
-import time
+import re
 import threading
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Any
+import time
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Dict, List, Mapping, Optional, Tuple, Any
 from enum import Enum
 
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate
-from langchain.output_parsers import PydanticOutputParser
+import orjson
+
 from pydantic import BaseModel, Field
 
 from config import settings
 from llm_adapter import llm_adapter
+from llm_batcher import MicroBatcher
+from semantic_cache import (
+    EMBEDDING_AVAILABLE,
+    LRUCache,
+    SemanticCache,
+    decode_embeddings,
+    normalize_text
+)
 
 logger = logging.getLogger(__name__)
 
+# 尝试导入 Aho-Corasick 自动机，如果失败则逐个关键词做子串匹配
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# 发现/推荐类请求的关键词
+DISCOVERY_KEYWORDS = (
+    "不知道买什么",
+    "不知道买啥",
+    "随便看看",
+    "随便选",
+    "有什么推荐",
+    "推荐一下",
+    "推荐点",
+    "看下推荐",
+    "看看推荐",
+    "热门有什么",
+    "有什么热门",
+    "不知道选什么",
+    "帮我选",
+)
+
+# 列出全部商品请求的关键词
+LIST_ALL_KEYWORDS = (
+    "列出所有商品",
+    "列出全部商品",
+    "列出所有",
+    "列出全部",
+    "展示全部商品",
+    "展示所有商品",
+    "全部商品",
+    "所有商品",
+    "所有的商品",
+    "把所有商品",
+    "把全部商品",
+    "全部列出",
+    "全部列出来",
+    "列出来所有",
+    "列出来全部",
+    "全都有哪些",
+    "有哪些商品",
+    "所有nft",
+    "全部nft",
+    "全部token",
+    "所有token",
+)
+
+
+# 兜底解析使用的购买/搜索动词
+BUY_KEYWORDS = ("买", "购买", "想要", "下单", "购买nft", "购买 nft")
+SEARCH_KEYWORDS = ("找", "搜索", "看看", "有没有")
+
+# 指示代词（默认引用最后一个商品）
+DEMONSTRATIVE_KEYWORDS = ("这个", "那个", "this", "that", "它")
+
+# 关键词分组：标签 -> 关键词
+KEYWORD_GROUPS = {
+    "DISCOVERY": DISCOVERY_KEYWORDS,
+    "LIST_ALL": LIST_ALL_KEYWORDS,
+    "BUY_VERB": BUY_KEYWORDS,
+    "SEARCH_VERB": SEARCH_KEYWORDS,
+    "DEMONSTRATIVE": DEMONSTRATIVE_KEYWORDS,
+    "NFT": ("nft",),
+    "TOKEN": ("token",),
+}
+
+
+def _build_keyword_automaton():
+    """构建所有关键词分组的 Aho-Corasick 自动机，匹配值为该关键词所属的标签"""
+    keyword_tags: Dict[str, List[str]] = {}
+    for tag, keywords in KEYWORD_GROUPS.items():
+        for keyword in keywords:
+            keyword_tags.setdefault(keyword, []).append(tag)
+    
+    automaton = ahocorasick.Automaton()
+    for keyword, tags in keyword_tags.items():
+        automaton.add_word(keyword, tuple(tags))
+    automaton.make_automaton()
+    return automaton
+
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton() if AHOCORASICK_AVAILABLE else None
+
+
+@lru_cache(maxsize=4096)
+def _keyword_tags(text: str) -> frozenset:
+    """
+    一次扫描得到文本（小写）命中的全部关键词分组标签
+    
+    常见口令重复出现，结果按文本缓存。
+    """
+    text_lower = text.lower()
+    if _KEYWORD_AUTOMATON is not None:
+        return frozenset(
+            tag
+            for _, tags in _KEYWORD_AUTOMATON.iter(text_lower)
+            for tag in tags
+        )
+    return frozenset(
+        tag
+        for tag, keywords in KEYWORD_GROUPS.items()
+        if any(keyword in text_lower for keyword in keywords)
+    )
+
+
+# 序号引用词 -> 商品下标；正则按长度降序排列，"第1个" 优先于 "1"
+_ORDINAL_TO_IDX = {
+    '第一个': 0, '第1个': 0, '1': 0, 'first': 0,
+    '第二个': 1, '第2个': 1, '2': 1, 'second': 1,
+    '第三个': 2, '第3个': 2, '3': 2, 'third': 2,
+    '第四个': 3, '第4个': 3, '4': 3, 'fourth': 3,
+    '第五个': 4, '第5个': 4, '5': 4, 'fifth': 4,
+}
+_ORDINAL_RE = re.compile(
+    "|".join(re.escape(keyword) for keyword in sorted(_ORDINAL_TO_IDX, key=len, reverse=True))
+)
+
+
+@lru_cache(maxsize=4096)
+def _reference_target(text: str) -> Optional[Tuple[str, int]]:
+    """
+    识别文本中的指代目标
+    
+    序号词优先（取最先出现的一个），其次是指示代词；结果按文本缓存。
+    
+    Returns:
+        (指代词, 商品下标)，指示代词的下标为 -1（最后一个商品）；未检测到返回 None
+    """
+    match = _ORDINAL_RE.search(text.lower())
+    if match:
+        keyword = match.group(0)
+        return keyword, _ORDINAL_TO_IDX[keyword]
+    if "DEMONSTRATIVE" in _keyword_tags(text):
+        return "指示代词", -1
+    return None
+
+
+# 数量/价格相关的词元：阿拉伯数字、中文数字和币种名
+_NUMERIC_TOKEN_RE = re.compile(
+    r"\d+(?:\.\d+)?|[零〇一二两三四五六七八九十百千万亿]+"
+    r"|(?<![a-z])(?:matic|pol|eth|weth|btc|usdt|usdc|dai)(?![a-z])|以太坊?|美元|人民币|元"
+)
+
+
+@lru_cache(maxsize=4096)
+def _numeric_signature(text: str) -> Tuple[str, ...]:
+    """
+    文本中按顺序出现的数字与币种词元
+    
+    语义相近的输入只差一个数字时句向量几乎不变（如 "100 MATIC 以下" 与
+    "500 MATIC 以下"），语义缓存命中前要求两者的数字签名完全一致。
+    """
+    return tuple(_NUMERIC_TOKEN_RE.findall(normalize_text(text)))
+
+
+# LLM 响应中的 JSON 代码块 / 花括号对象 / 方括号数组
+_JSON_BLOCK_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_JSON_BRACE_RE = re.compile(r'\{.*\}', re.DOTALL)
+_JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+
 
 class IntentType(Enum):
     """用户意图类型"""
@@ -67,16 +238,37 @@ class SemanticParser:
     
     职责：
     - 理解用户意图，提取关键实体
-    - 使用 LangChain ConversationChain 维护多轮对话
+    - 结合会话上下文维护多轮对话
     - 支持指代消解（这个、那个、第一个等）
     - 识别缺失信息并生成澄清问题
     
     Requirements: 2.1, 2.2, 2.3, 2.4, 2.5, 2.6
     """
     
-    _llm_lock = threading.Lock()
-    _last_call_ts = 0.0
     _min_interval_seconds = 1.2
+    # 实体提取提示：JSON Schema 在类加载时生成一次，调用时只拼接用户输入
+    _ENTITY_SCHEMA_HINT = (
+        "从以下用户输入中提取商品相关实体。以 JSON 对象返回结果，"
+        "字段遵循下面的 JSON Schema，未提及的字段省略：\n"
+        + orjson.dumps(EntityExtraction.model_json_schema()).decode()
+        + "\n\n用户输入: "
+    )
+    
+    # 对话历史中的角色标签，未列出的角色均视为 Assistant
+    _ROLE_LABELS = {'user': 'User'}
+    
+    # LLM 微批处理（LLM_CROSS_SESSION_BATCHING 开启时）：单批最大请求数与收集等待时间（秒）
+    LLM_BATCH_SIZE = 8
+    LLM_BATCH_WAIT_SECONDS = 0.05
+    
+    # 解析结果缓存：容量与允许缓存的最低置信度
+    PARSE_CACHE_SIZE = 2048
+    PARSE_CACHE_MIN_CONFIDENCE = 0.7
+    # 交易类意图依赖当前会话状态，结果一律不缓存
+    UNCACHED_INTENTS = frozenset({IntentType.PURCHASE, IntentType.CONFIRM, IntentType.CANCEL})
+    # 语义缓存：条目存活时间（秒）与多语言句向量模型
+    SEMANTIC_CACHE_TTL = 3600
+    SEMANTIC_CACHE_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
 
     # Few-shot learning 示例
     FEW_SHOT_EXAMPLES = """
@@ -123,28 +315,47 @@ class SemanticParser:
 实体: {}
 """
     
-    # 系统提示模板
-    SYSTEM_PROMPT_TEMPLATE = """你是一个 Web3 语音购物助手。用户会用自然语言描述想购买的 NFT 或 Token。
+    # 系统提示：角色、任务、示例和输出格式都是静态内容，类加载时拼好一次。
+    # 每次调用字节级相同，作为消息前缀可命中服务端的提示缓存
+    SYSTEM_PROMPT = """你是一个 Web3 语音购物助手。用户会用自然语言描述想购买的 NFT 或 Token。
 
 你的任务是：
 1. 识别用户意图（QUERY/PURCHASE/CONFIRM/CANCEL/HELP/HISTORY）
 2. 提取商品特征（类型、属性、价格范围、区块链网络）
 3. 如果信息不完整，识别缺失的必要信息
+""" + FEW_SHOT_EXAMPLES + """
+请分析用户意图并提取实体。以 JSON 格式返回结果：
+{
+  "intent": "意图类型",
+  "entities": {实体字典},
+  "confidence": 置信度(0-1),
+  "missing_info": [缺失信息列表]
+}
+"""
+    
+    # 用户消息模板：只包含每次调用变化的部分
+    USER_PROMPT_TEMPLATE = """当前对话历史：
+{history}
 
-{few_shot_examples}
+用户输入: {input}
+"""
+    # 模板在类加载时按占位符切分，调用时直接拼接，不再逐次解析 format 占位符；
+    # 用户输入中的花括号也无需转义
+    _USER_PROMPT_HEAD, _USER_PROMPT_TAIL = USER_PROMPT_TEMPLATE.split("{history}")
+    _USER_PROMPT_MIDDLE, _USER_PROMPT_END = _USER_PROMPT_TAIL.split("{input}")
+    
+    # 批量调用的用户消息模板：多个会话的请求合并为一次调用，共用同一系统提示
+    BATCH_PROMPT_TEMPLATE = """下面有 {count} 个相互独立的请求，每个请求有各自的对话历史和用户输入：
+
+{requests}
 
+请逐个分析用户意图并提取实体。以 JSON 数组返回结果，数组第 i 个元素对应请求 i，共 {count} 个元素，每个元素的格式与上面相同。
+"""
+    
+    BATCH_REQUEST_TEMPLATE = """请求 {index}:
 当前对话历史：
 {history}
-
 用户输入: {input}
-
-请分析用户意图并提取实体。以 JSON 格式返回结果：
-{{
-  "intent": "意图类型",
-  "entities": {{实体字典}},
-  "confidence": 置信度(0-1),
-  "missing_info": [缺失信息列表]
-}}
 """
     
     def __init__(
@@ -171,22 +382,50 @@ class SemanticParser:
         # 使用 LLM 适配器（不使用 langchain）
         self.llm_adapter = llm_adapter
         
+        # 跨会话合并会把多个用户的输入拼入同一提示，默认关闭：
+        # 各请求在调用线程中各自发出单条提示，相邻两次调用的发起时间至少间隔 _min_interval_seconds
+        self._llm_batcher: Optional[MicroBatcher] = None
+        if settings.llm_cross_session_batching:
+            # 并发请求合并为批量 LLM 调用，批量结果无法解析时逐条回退
+            self._llm_batcher = MicroBatcher(
+                single_call=self._complete,
+                batch_call=self._complete_batch,
+                max_batch_size=self.LLM_BATCH_SIZE,
+                max_wait=self.LLM_BATCH_WAIT_SECONDS,
+                min_interval=self._min_interval_seconds
+            )
+        self._next_call_ts = 0.0
+        self._rate_lock = threading.Lock()
+        
         # 简化的对话历史（不使用 langchain memory）
         self.conversation_history: List[Dict[str, str]] = []
         
+        # 相同输入（规范化文本 + 已选商品 + 对话历史）复用解析结果，跳过 LLM 调用
+        self._parse_cache = LRUCache(max_size=self.PARSE_CACHE_SIZE)
+        # 语义缓存：同义改写的输入（如"列出所有商品"与"全部商品有哪些"）也能命中
+        self._semantic_cache: Optional[SemanticCache] = None
+        if settings.semantic_cache_enabled and EMBEDDING_AVAILABLE:
+            self._semantic_cache = SemanticCache(
+                threshold=settings.semantic_cache_threshold,
+                max_size=settings.semantic_cache_max_size,
+                ttl=self.SEMANTIC_CACHE_TTL,
+                model_name=self.SEMANTIC_CACHE_MODEL,
+                quantize=settings.semantic_cache_quantize
+            )
+        
         logger.info(f"SemanticParser 初始化完成，使用模型: {llm_model}")
     
     def parse(
         self,
         text: str,
-        session_context: Optional[Dict] = None
+        session_context: Optional[Mapping[str, Any]] = None
     ) -> ParsedIntent:
         """
         解析用户输入文本
         
         Args:
             text: ASR 转录的文本
-            session_context: 会话上下文（历史对话、已选商品等）
+            session_context: 会话上下文（历史对话、已选商品等），只读不修改
         
         Returns:
             ParsedIntent: 解析后的意图对象
@@ -196,40 +435,45 @@ class SemanticParser:
         if not text or not text.strip():
             raise ValueError("输入文本为空")
         
+        # 构造提示中的对话历史（一次 join，避免逐条字符串拼接）
+        conversation_text = ""
+        if session_context and 'conversation_history' in session_context:
+            history = session_context['conversation_history']
+            conversation_text = "".join(
+                f"{self._ROLE_LABELS.get(msg.get('role'), 'Assistant')}: {msg.get('content')}\n"
+                for msg in history[-self.max_history*2:]
+            )
+        
+        cache_key = self._parse_cache_key(text, session_context, conversation_text)
+        cached = self._parse_cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"解析缓存命中: '{text}'")
+            return self._copy_intent(cached)
+        # 语义检索同时比较最近几轮输入的向量，上下文不同的条目不会命中
+        # 会话中保存的是编码后的向量，直接解码为矩阵，不重新编码历史文本
+        turn_embeddings = None
+        if self._semantic_cache is not None:
+            encoded_turns = (session_context or {}).get("turn_embeddings")
+            if encoded_turns:
+                turn_embeddings = decode_embeddings(encoded_turns)
+        if self._semantic_cache is not None:
+            cached = self._semantic_cache.get(text, context=turn_embeddings)
+            if cached is not None:
+                # 数字或币种不同的输入不复用实体（价格、数量必须与本次输入一致）
+                signature, cached_intent = cached
+                if signature == _numeric_signature(text):
+                    logger.debug(f"解析语义缓存命中: '{text}'")
+                    return self._copy_intent(cached_intent)
+                logger.debug(f"语义缓存命中的数字与输入不一致，已忽略: '{text}'")
+        
         logger.info(f"开始解析用户输入: '{text}'")
         
         try:
-            # 构造提示
-            conversation_text = ""
-            if session_context and 'conversation_history' in session_context:
-                # 转换历史格式
-                history = session_context['conversation_history']
-                for msg in history[-self.max_history*2:]:
-                    role = "User" if msg.get('role') == 'user' else "Assistant"
-                    conversation_text += f"{role}: {msg.get('content')}\n"
-
-            # 填充 System Prompt
-            prompt = self.SYSTEM_PROMPT_TEMPLATE.format(
-                few_shot_examples=self.FEW_SHOT_EXAMPLES,
-                history=conversation_text,
-                input=text
-            )
-
-            messages = [{"role": "user", "content": prompt}]
             response = None
             last_error = None
             for attempt in range(3):
                 try:
-                    with self._llm_lock:
-                        now = time.time()
-                        wait_seconds = self._min_interval_seconds - (now - self._last_call_ts)
-                        if wait_seconds > 0:
-                            time.sleep(wait_seconds)
-                        response = self.llm_adapter.chat_completion(
-                            messages=messages,
-                            temperature=self.temperature
-                        )
-                        self._last_call_ts = time.time()
+                    response = self._request_completion((conversation_text, text))
                     break
                 except Exception as e:
                     last_error = e
@@ -272,14 +516,178 @@ class SemanticParser:
                 f"entities={len(intent.entities)}"
             )
             
+            if self._is_cacheable(intent):
+                stored = self._copy_intent(intent)
+                self._parse_cache.put(cache_key, stored)
+                if self._semantic_cache is not None:
+                    self._semantic_cache.put(
+                        text, (_numeric_signature(text), stored), context=turn_embeddings
+                    )
+            
             return intent
             
         except Exception as e:
             logger.error(f"解析失败: {e}", exc_info=True)
             return self._fallback_parse(text)
 
+    def _is_cacheable(self, intent: ParsedIntent) -> bool:
+        """低置信度结果、指代类输入和交易类意图（依赖对话上下文）不缓存"""
+        return (
+            intent.confidence >= self.PARSE_CACHE_MIN_CONFIDENCE
+            and 'reference' not in intent.entities
+            and intent.intent not in self.UNCACHED_INTENTS
+        )
+
+    def turn_embedding(self, text: str) -> Optional[str]:
+        """
+        计算用户输入的句向量，供会话保存为后续轮次的缓存上下文
+        
+        Args:
+            text: 用户输入文本
+        
+        Returns:
+            float16 + base64 编码的向量，语义缓存未启用时返回 None
+        """
+        if self._semantic_cache is None:
+            return None
+        return self._semantic_cache.embed(text)
+
+    @staticmethod
+    def _parse_cache_key(
+        text: str,
+        session_context: Optional[Mapping[str, Any]],
+        conversation_text: str
+    ) -> tuple:
+        """
+        解析缓存键：规范化文本 + 已选商品 ID + 对话历史摘要
+        
+        提示中的对话历史不同，LLM 的解析结果也可能不同，因此历史摘要计入缓存键，
+        只有历史完全一致时才复用结果。
+        """
+        selected = (session_context or {}).get("selected_products") or []
+        selected_ids = tuple(sorted(
+            str(p.get("id")) if isinstance(p, dict) else str(p)
+            for p in selected
+        ))
+        context_digest = hashlib.blake2b(conversation_text.encode("utf-8"), digest_size=8).digest()
+        return normalize_text(text), selected_ids, context_digest
+
+    def _request_completion(self, payload: tuple) -> str:
+        """
+        发出一次解析请求：启用跨会话合并时交给微批处理器，否则直接发出单条提示
+        
+        单条提示可在多个线程中并发执行，只按 _min_interval_seconds 错开发起时间。
+        
+        Args:
+            payload: (对话历史文本, 用户输入)
+        
+        Returns:
+            LLM 响应文本
+        """
+        if self._llm_batcher is not None:
+            return self._llm_batcher.submit(payload).result()
+        with self._rate_lock:
+            now = time.monotonic()
+            start = max(now, self._next_call_ts)
+            self._next_call_ts = start + self._min_interval_seconds
+        if start > now:
+            time.sleep(start - now)
+        return self._complete(payload)
+
+    def _build_messages(self, user_content: str) -> List[Dict[str, str]]:
+        """静态系统提示在前、动态内容在后，保证请求前缀在各次调用间一致"""
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": user_content}
+        ]
+
+    def _complete(self, payload: tuple) -> str:
+        """
+        单条 LLM 调用
+        
+        Args:
+            payload: (对话历史文本, 用户输入)
+        
+        Returns:
+            LLM 响应文本
+        """
+        history, text = payload
+        user_content = (
+            self._USER_PROMPT_HEAD + history
+            + self._USER_PROMPT_MIDDLE + text
+            + self._USER_PROMPT_END
+        )
+        return self.llm_adapter.chat_completion(
+            messages=self._build_messages(user_content),
+            temperature=self.temperature
+        )
+
+    def _complete_batch(self, payloads: List[tuple]) -> List[str]:
+        """
+        批量 LLM 调用：多个请求合并为一个提示，要求模型返回 JSON 数组
+        
+        Args:
+            payloads: (对话历史文本, 用户输入) 列表
+        
+        Returns:
+            与输入顺序一致的单条响应文本列表
+        
+        Raises:
+            ValueError: 响应不是长度匹配的 JSON 对象数组
+        """
+        requests = "\n".join(
+            self.BATCH_REQUEST_TEMPLATE.format(index=i, history=history, input=text)
+            for i, (history, text) in enumerate(payloads, 1)
+        )
+        prompt = self.BATCH_PROMPT_TEMPLATE.format(count=len(payloads), requests=requests)
+        response = self.llm_adapter.chat_completion(
+            messages=self._build_messages(prompt),
+            temperature=self.temperature
+        )
+        return self._parse_llm_batch_response(response, len(payloads))
+
+    @staticmethod
+    def _parse_llm_batch_response(response: str, count: int) -> List[str]:
+        """
+        解析批量调用返回的 JSON 数组
+        
+        Args:
+            response: LLM 返回的文本
+            count: 期望的结果数量
+        
+        Returns:
+            每个请求对应的 JSON 文本，交由 _parse_llm_response 处理
+        
+        Raises:
+            ValueError: 无法解析或数量不符
+        """
+        try:
+            results = orjson.loads(response)
+        except orjson.JSONDecodeError:
+            json_match = _JSON_BLOCK_RE.search(response) or _JSON_ARRAY_RE.search(response)
+            if not json_match:
+                raise ValueError("批量响应中没有 JSON 数组")
+            results = orjson.loads(json_match.group(json_match.lastindex or 0))
+        
+        if (
+            not isinstance(results, list)
+            or len(results) != count
+            or not all(isinstance(item, dict) for item in results)
+        ):
+            raise ValueError(f"批量响应格式不符，期望 {count} 个 JSON 对象")
+        return [orjson.dumps(item).decode() for item in results]
+
+    @staticmethod
+    def _copy_intent(intent: ParsedIntent) -> ParsedIntent:
+        """复制解析结果，调用方修改实体不影响缓存"""
+        return replace(
+            intent,
+            entities=dict(intent.entities),
+            missing_info=list(intent.missing_info)
+        )
+
     def _fallback_parse(self, text: str) -> ParsedIntent:
-        text_lower = text.lower()
+        tags = _keyword_tags(text)
         entities: Dict[str, Any] = {}
         intent = IntentType.HELP
         confidence = 0.4
@@ -289,16 +697,16 @@ class SemanticParser:
             confidence = 0.75
             entities["list_all_products"] = True
 
-        if any(word in text_lower for word in ['买', '购买', '想要', '下单', '购买nft', '购买 nft']):
+        if "BUY_VERB" in tags:
             intent = IntentType.QUERY
             confidence = 0.6
-        elif any(word in text_lower for word in ['找', '搜索', '看看', '有没有']):
+        elif "SEARCH_VERB" in tags:
             intent = IntentType.QUERY
             confidence = 0.55
 
-        if 'nft' in text_lower:
+        if "NFT" in tags:
             entities['product_type'] = 'NFT'
-        if 'token' in text_lower:
+        if "TOKEN" in tags:
             entities['product_type'] = 'Token'
 
         missing_info = []
@@ -317,23 +725,7 @@ class SemanticParser:
         text: str,
         parsed_intent: Optional[ParsedIntent] = None
     ) -> bool:
-        text_lower = text.lower()
-        discovery_keywords = [
-            "不知道买什么",
-            "不知道买啥",
-            "随便看看",
-            "随便选",
-            "有什么推荐",
-            "推荐一下",
-            "推荐点",
-            "看下推荐",
-            "看看推荐",
-            "热门有什么",
-            "有什么热门",
-            "不知道选什么",
-            "帮我选",
-        ]
-        if any(keyword in text_lower for keyword in discovery_keywords):
+        if "DISCOVERY" in _keyword_tags(text):
             return True
 
         if not parsed_intent:
@@ -356,31 +748,7 @@ class SemanticParser:
         text: str,
         parsed_intent: Optional[Dict[str, Any]] = None
     ) -> bool:
-        text_lower = text.lower()
-        list_all_keywords = [
-            "列出所有商品",
-            "列出全部商品",
-            "列出所有",
-            "列出全部",
-            "展示全部商品",
-            "展示所有商品",
-            "全部商品",
-            "所有商品",
-            "所有的商品",
-            "把所有商品",
-            "把全部商品",
-            "全部列出",
-            "全部列出来",
-            "列出来所有",
-            "列出来全部",
-            "全都有哪些",
-            "有哪些商品",
-            "所有nft",
-            "全部nft",
-            "全部token",
-            "所有token"
-        ]
-        if any(keyword in text_lower for keyword in list_all_keywords):
+        if "LIST_ALL" in _keyword_tags(text):
             return True
 
         if not parsed_intent:
@@ -396,7 +764,7 @@ class SemanticParser:
         """
         提取命名实体（商品类型、属性、价格等）
         
-        使用 LLM Function Calling 能力进行结构化提取
+        使用 LLM 的 JSON 输出模式进行结构化提取
         
         Args:
             text: 用户输入文本
@@ -409,28 +777,18 @@ class SemanticParser:
         logger.info(f"提取实体: '{text}'")
         
         try:
-            # 创建输出解析器
-            parser = PydanticOutputParser(pydantic_object=EntityExtraction)
-            
-            # 构造提示
-            prompt_text = f"""从以下用户输入中提取商品相关实体：
-
-用户输入: {text}
-
-{parser.get_format_instructions()}
-"""
-            
-            # 调用 LLM
-            response = self.llm.predict(prompt_text)
+            # 调用 LLM（JSON 模式，不支持该参数的适配器会忽略）
+            response = self.llm_adapter.chat_completion(
+                messages=[{"role": "user", "content": self._ENTITY_SCHEMA_HINT + text}],
+                temperature=self.temperature,
+                response_format={"type": "json_object"}
+            )
             
-            # 解析结果
-            entity_obj = parser.parse(response)
+            # 解析并校验结果（兼容代码块包裹或夹带说明文字的回复）
+            entity_obj = EntityExtraction.model_validate(self._parse_llm_response(response))
             
             # 转换为字典，过滤 None 值
-            entities = {
-                k: v for k, v in entity_obj.dict().items()
-                if v is not None
-            }
+            entities = entity_obj.model_dump(exclude_none=True)
             
             logger.info(f"提取到 {len(entities)} 个实体")
             return entities
@@ -442,7 +800,7 @@ class SemanticParser:
     def resolve_reference(
         self,
         text: str,
-        context: Dict
+        context: Mapping[str, Any]
     ) -> Optional[Dict[str, Any]]:
         """
         解析指代词（这个、那个、第一个等）
@@ -465,47 +823,24 @@ class SemanticParser:
             logger.warning("上下文中没有可引用的商品")
             return None
         
-        # 检测序号引用
-        ordinal_map = {
-            '第一个': 0, '第1个': 0, '1': 0, 'first': 0,
-            '第二个': 1, '第2个': 1, '2': 1, 'second': 1,
-            '第三个': 2, '第3个': 2, '3': 2, 'third': 2,
-            '第四个': 3, '第4个': 3, '4': 3, 'fourth': 3,
-            '第五个': 4, '第5个': 4, '5': 4, 'fifth': 4,
-        }
+        # 指代词 -> 商品下标（按文本缓存），指示代词默认引用最后一个商品
+        target = _reference_target(text)
+        if target is None:
+            logger.info("未检测到有效的指代词")
+            return None
         
-        text_lower = text.lower()
-        
-        for keyword, index in ordinal_map.items():
-            if keyword in text_lower:
-                if index < len(selected_products):
-                    product = selected_products[index]
-                    logger.info(f"解析序号引用: {keyword} -> 商品 {product.get('id', 'unknown')}")
-                    return {
-                        'product_id': product.get('id'),
-                        'product_name': product.get('name'),
-                        'reference_resolved': True
-                    }
-                else:
-                    logger.warning(f"序号 {keyword} 超出商品列表范围")
-                    return None
-        
-        # 检测指示代词
-        demonstrative_keywords = ['这个', '那个', 'this', 'that', '它']
-        for keyword in demonstrative_keywords:
-            if keyword in text_lower:
-                # 默认引用最后一个商品
-                if selected_products:
-                    product = selected_products[-1]
-                    logger.info(f"解析指示代词: {keyword} -> 最后一个商品 {product.get('id', 'unknown')}")
-                    return {
-                        'product_id': product.get('id'),
-                        'product_name': product.get('name'),
-                        'reference_resolved': True
-                    }
-        
-        logger.info("未检测到有效的指代词")
-        return None
+        keyword, index = target
+        if index >= len(selected_products):
+            logger.warning(f"序号 {keyword} 超出商品列表范围")
+            return None
+        
+        product = selected_products[index]
+        logger.info(f"解析指代: {keyword} -> 商品 {product.get('id', 'unknown')}")
+        return {
+            'product_id': product.get('id'),
+            'product_name': product.get('name'),
+            'reference_resolved': True
+        }
     
     def _update_memory_from_context(self, conversation_history: List[Dict]) -> None:
         """
@@ -539,22 +874,19 @@ class SemanticParser:
         Returns:
             解析后的字典
         """
-        import json
-        import re
-        
         try:
             # 尝试直接解析 JSON
-            return json.loads(response)
-        except json.JSONDecodeError:
+            return orjson.loads(response)
+        except orjson.JSONDecodeError:
             # 如果失败，尝试提取 JSON 代码块
-            json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
+            json_match = _JSON_BLOCK_RE.search(response)
             if json_match:
-                return json.loads(json_match.group(1))
+                return orjson.loads(json_match.group(1))
             
             # 如果还是失败，尝试提取花括号内容
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
+            json_match = _JSON_BRACE_RE.search(response)
             if json_match:
-                return json.loads(json_match.group(0))
+                return orjson.loads(json_match.group(0))
             
             # 无法解析，返回默认结构
             logger.warning(f"无法解析 LLM 响应: {response}")
@@ -3,15 +3,27 @@
 负责维护用户会话和上下文，使用 Redis 存储
 """
 
-import json
 import uuid
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List, Any
-from dataclasses import dataclass, asdict, field
+from typing import Optional, Dict, List, Any, Tuple
+from dataclasses import dataclass, field
+import orjson
 import redis
 from config import settings
 
 
+# 进程内共享的阻塞式连接池：所有 SessionManager 实例复用连接，
+# 连接耗尽时排队而不是报错（创建连接池不会立即建立连接）
+_POOL = redis.BlockingConnectionPool(
+    host=settings.redis_host,
+    port=settings.redis_port,
+    db=settings.redis_db,
+    password=settings.redis_password,
+    decode_responses=True,  # 自动解码为字符串
+    max_connections=64
+)
+
+
 @dataclass
 class UserSession:
     """用户会话数据模型"""
@@ -20,6 +32,10 @@ class UserSession:
     conversation_history: List[Dict] = field(default_factory=list)
     selected_products: List[Dict] = field(default_factory=list)  # 存储商品字典而非对象
     current_state: str = "IDLE"
+    last_language: Optional[str] = None  # 首次识别出的语言，后续转录跳过语言检测
+    last_transcription: str = ""  # 最近一次语音转录的文本
+    confidence: Optional[float] = None  # 最近一次语音转录的置信度
+    turn_embeddings: List[str] = field(default_factory=list)  # 最近几轮用户输入的句向量（float16 + base64，语义缓存上下文）
     created_at: str = ""  # ISO 格式字符串
     expires_at: str = ""  # ISO 格式字符串
     
@@ -41,24 +57,31 @@ class SessionManager:
     - 使用 Redis 存储会话数据（TTL 10 分钟）
     - 实现会话序列化/反序列化（JSON）
     
+    存储结构：标量字段存放在哈希 session:{id} 中（值为 JSON），
+    列表字段各自存放在 Redis 列表中（每个元素一条 JSON），追加只传输新元素。
+    
     Requirements: 12.1, 12.2
     """
     
+    # 会话中保留的用户输入句向量轮数
+    MAX_TURN_EMBEDDINGS = 3
+    
+    # 以 Redis 列表存储的会话字段 -> 键前缀
+    LIST_FIELDS = {
+        "conversation_history": "history",
+        "selected_products": "selected",
+        "turn_embeddings": "turns",
+    }
+    
     def __init__(self, redis_client: Optional[redis.Redis] = None):
         """
         初始化会话管理器
         
         Args:
-            redis_client: Redis 客户端实例，如果为 None 则创建新连接
+            redis_client: Redis 客户端实例，如果为 None 则使用共享连接池
         """
         if redis_client is None:
-            self.redis_client = redis.Redis(
-                host=settings.redis_host,
-                port=settings.redis_port,
-                db=settings.redis_db,
-                password=settings.redis_password,
-                decode_responses=True  # 自动解码为字符串
-            )
+            self.redis_client = redis.Redis(connection_pool=_POOL)
         else:
             self.redis_client = redis_client
         
@@ -66,7 +89,7 @@ class SessionManager:
     
     def _get_session_key(self, session_id: str) -> str:
         """
-        生成 Redis 键名
+        生成会话哈希的 Redis 键名
         
         Args:
             session_id: 会话 ID
@@ -76,6 +99,29 @@ class SessionManager:
         """
         return f"session:{session_id}"
     
+    def _get_list_key(self, field_name: str, session_id: str) -> str:
+        """
+        生成列表字段的 Redis 键名
+        
+        Args:
+            field_name: 会话字段名（LIST_FIELDS 中的键）
+            session_id: 会话 ID
+            
+        Returns:
+            Redis 键名
+        """
+        return f"{self.LIST_FIELDS[field_name]}:{session_id}"
+    
+    def _get_history_key(self, session_id: str) -> str:
+        """生成对话历史列表的 Redis 键名"""
+        return self._get_list_key("conversation_history", session_id)
+    
+    def _get_all_keys(self, session_id: str) -> List[str]:
+        """会话涉及的全部 Redis 键（哈希在前）"""
+        return [self._get_session_key(session_id)] + [
+            self._get_list_key(field_name, session_id) for field_name in self.LIST_FIELDS
+        ]
+    
     def create_session(self, user_id: str) -> UserSession:
         """
         创建新会话
@@ -97,14 +143,17 @@ class SessionManager:
             user_id=user_id
         )
         
-        # 序列化并存储到 Redis
+        # 标量字段写入哈希；新会话的列表字段为空，不创建列表键
         session_key = self._get_session_key(session_id)
-        session_data = json.dumps(asdict(session))
-        self.redis_client.setex(
-            session_key,
-            self.session_ttl,
-            session_data
-        )
+        mapping = {
+            key: orjson.dumps(value)
+            for key, value in vars(session).items()
+            if key not in self.LIST_FIELDS
+        }
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(session_key, mapping=mapping)
+        pipe.expire(session_key, self.session_ttl)
+        pipe.execute()
         
         return session
     
@@ -120,19 +169,42 @@ class SessionManager:
             
         Requirements: 12.2
         """
-        session_key = self._get_session_key(session_id)
-        session_data = self.redis_client.get(session_key)
+        # 哈希和各列表在同一次往返中读取
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(self._get_session_key(session_id))
+        for field_name in self.LIST_FIELDS:
+            pipe.lrange(self._get_list_key(field_name, session_id), 0, -1)
+        session_hash, *lists = pipe.execute()
+        return self._deserialize(session_id, session_hash, lists)
+    
+    def _deserialize(
+        self,
+        session_id: str,
+        session_hash: Dict[str, str],
+        lists: List[List[str]]
+    ) -> Optional[UserSession]:
+        """
+        反序列化会话数据
         
-        if session_data is None:
+        Args:
+            session_id: 会话 ID
+            session_hash: 会话哈希的全部字段，键不存在时为空字典
+            lists: 与 LIST_FIELDS 顺序一致的列表字段原始元素
+            
+        Returns:
+            UserSession 对象，数据缺失或损坏时返回 None
+        """
+        if not session_hash:
             return None
         
-        # 反序列化
         try:
-            session_dict = json.loads(session_data)
+            session_dict = {key: orjson.loads(value) for key, value in session_hash.items()}
+            for field_name, items in zip(self.LIST_FIELDS, lists):
+                session_dict[field_name] = [orjson.loads(item) for item in items]
             return UserSession(**session_dict)
-        except (json.JSONDecodeError, TypeError) as e:
+        except (orjson.JSONDecodeError, TypeError):
             # 数据损坏，删除该会话
-            self.redis_client.delete(session_key)
+            self.redis_client.delete(*self._get_all_keys(session_id))
             return None
     
     def update_context(self, session_id: str, key: str, value: Any) -> None:
@@ -149,29 +221,87 @@ class SessionManager:
             
         Requirements: 12.2
         """
-        # 获取现有会话
-        session = self.get_session(session_id)
-        if session is None:
-            raise ValueError(f"Session {session_id} not found or expired")
+        self.update_fields(session_id, {key: value})
+    
+    def update_fields(self, session_id: str, fields: Dict[str, Any]) -> None:
+        """
+        批量更新会话字段（一次往返，只写入给定字段）
         
-        # 更新字段
-        if hasattr(session, key):
-            setattr(session, key, value)
-        else:
-            raise ValueError(f"Invalid session field: {key}")
+        Args:
+            session_id: 会话 ID
+            fields: 字段名到新值的映射；列表字段整体替换
+            
+        Raises:
+            ValueError: 如果会话不存在或字段无效
+        """
+        self._write(session_id, replace=fields)
+    
+    def _write(
+        self,
+        session_id: str,
+        replace: Optional[Dict[str, Any]] = None,
+        append: Optional[Dict[str, Tuple[List[Any], int]]] = None
+    ) -> None:
+        """
+        在一个 MULTI 事务中写入会话字段
+        
+        WATCH 会话哈希后读取其剩余 TTL：会话不存在时不执行任何写入；
+        写入的列表键与哈希同时过期，不会在哈希过期后残留。
+        会话在读取与提交之间被修改或过期时，事务自动重试。
+        
+        Args:
+            session_id: 会话 ID
+            replace: 字段名到新值的映射（标量写入哈希，列表字段整体替换）
+            append: 列表字段名到 (追加元素, 最多保留条数) 的映射，0 表示不截断
+            
+        Raises:
+            ValueError: 如果会话不存在或字段无效
+        """
+        replace = replace or {}
+        append = append or {}
+        for key in replace:
+            if key not in UserSession.__dataclass_fields__:
+                raise ValueError(f"Invalid session field: {key}")
         
-        # 保存回 Redis，保持原有的 TTL
         session_key = self._get_session_key(session_id)
-        ttl = self.redis_client.ttl(session_key)
         
-        # 如果 TTL 有效，使用剩余时间；否则使用默认 TTL
-        if ttl > 0:
-            expiry = ttl
-        else:
-            expiry = self.session_ttl
+        def write(pipe: redis.client.Pipeline) -> None:
+            # WATCH 之后、MULTI 之前的命令立即执行
+            ttl_ms = pipe.pttl(session_key)
+            if ttl_ms == -2:
+                raise ValueError(f"Session {session_id} not found or expired")
+            
+            def align_ttl(list_key: str) -> None:
+                """列表键的过期时间与会话哈希保持一致"""
+                if ttl_ms > 0:
+                    pipe.pexpire(list_key, ttl_ms)
+                else:
+                    pipe.persist(list_key)
+            
+            pipe.multi()
+            scalars = {}
+            for key, value in replace.items():
+                if key in self.LIST_FIELDS:
+                    list_key = self._get_list_key(key, session_id)
+                    pipe.delete(list_key)
+                    if value:
+                        pipe.rpush(list_key, *(orjson.dumps(item) for item in value))
+                        align_ttl(list_key)
+                else:
+                    scalars[key] = orjson.dumps(value)
+            if scalars:
+                pipe.hset(session_key, mapping=scalars)
+            
+            for key, (items, max_len) in append.items():
+                if not items:
+                    continue
+                list_key = self._get_list_key(key, session_id)
+                pipe.rpush(list_key, *(orjson.dumps(item) for item in items))
+                if max_len:
+                    pipe.ltrim(list_key, -max_len, -1)
+                align_ttl(list_key)
         
-        session_data = json.dumps(asdict(session))
-        self.redis_client.setex(session_key, expiry, session_data)
+        self.redis_client.transaction(write, session_key)
     
     def delete_session(self, session_id: str) -> bool:
         """
@@ -183,8 +313,7 @@ class SessionManager:
         Returns:
             是否成功删除
         """
-        session_key = self._get_session_key(session_id)
-        result = self.redis_client.delete(session_key)
+        result = self.redis_client.delete(*self._get_all_keys(session_id))
         return result > 0
     
     def extend_session(self, session_id: str, additional_seconds: int = None) -> bool:
@@ -201,8 +330,10 @@ class SessionManager:
         if additional_seconds is None:
             additional_seconds = self.session_ttl
         
-        session_key = self._get_session_key(session_id)
-        return self.redis_client.expire(session_key, additional_seconds)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in self._get_all_keys(session_id):
+            pipe.expire(key, additional_seconds)
+        return bool(pipe.execute()[0])
     
     def add_conversation_message(
         self,
@@ -220,21 +351,43 @@ class SessionManager:
             content: 消息内容
             metadata: 额外的元数据
         """
-        session = self.get_session(session_id)
-        if session is None:
-            raise ValueError(f"Session {session_id} not found or expired")
-        
-        message = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        self.add_conversation_messages(session_id, [(role, content, metadata)])
+    
+    def add_conversation_messages(
+        self,
+        session_id: str,
+        messages: List[Tuple[str, str, Optional[Dict]]],
+        turn_embedding: Optional[str] = None
+    ) -> None:
+        """
+        批量添加对话消息到会话历史（RPUSH 追加，不读取已有历史）
         
-        if metadata:
-            message["metadata"] = metadata
+        Args:
+            session_id: 会话 ID
+            messages: (角色, 消息内容, 元数据) 列表，元数据可为 None
+            turn_embedding: 本轮用户输入的编码句向量，保留最近几轮供语义缓存使用
+            
+        Raises:
+            ValueError: 如果会话不存在
+        """
+        timestamp = datetime.utcnow().isoformat()
+        history = []
+        for role, content, metadata in messages:
+            message = {
+                "role": role,
+                "content": content,
+                "timestamp": timestamp
+            }
+            
+            if metadata:
+                message["metadata"] = metadata
+            
+            history.append(message)
         
-        session.conversation_history.append(message)
-        self.update_context(session_id, "conversation_history", session.conversation_history)
+        append = {"conversation_history": (history, 0)}
+        if turn_embedding is not None:
+            append["turn_embeddings"] = ([turn_embedding], self.MAX_TURN_EMBEDDINGS)
+        self._write(session_id, append=append)
     
     def add_selected_product(self, session_id: str, product: Dict) -> None:
         """
@@ -244,12 +397,7 @@ class SessionManager:
             session_id: 会话 ID
             product: 商品字典
         """
-        session = self.get_session(session_id)
-        if session is None:
-            raise ValueError(f"Session {session_id} not found or expired")
-        
-        session.selected_products.append(product)
-        self.update_context(session_id, "selected_products", session.selected_products)
+        self._write(session_id, append={"selected_products": ([product], 0)})
     
     def clear_selected_products(self, session_id: str) -> None:
         """
@@ -275,11 +423,7 @@ class SessionManager:
         Returns:
             对话历史列表
         """
-        session = self.get_session(session_id)
-        if session is None:
-            return []
-        
-        history = session.conversation_history
-        if last_n is not None and last_n > 0:
-            return history[-last_n:]
-        return history
+        # 只读取需要的尾部消息，不反序列化整个会话
+        start = -last_n if last_n is not None and last_n > 0 else 0
+        items = self.redis_client.lrange(self._get_history_key(session_id), start, -1)
+        return [orjson.loads(item) for item in items]
@@ -0,0 +1,77 @@
+"""
+语义缓存上下文隔离测试
+
+运行方式（在 ai_service 目录下）：python -m unittest discover -s tests -t .
+"""
+
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from semantic_cache import SemanticCache
+
+
+DIM = 8
+
+
+def _basis(i: int):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+
+@unittest.skipIf(np is None, "需要 numpy")
+class SemanticCacheContextTest(unittest.TestCase):
+    """同一句话在不同对话历史下不能互相命中"""
+
+    def setUp(self):
+        paraphrase = _basis(0) + 0.1 * _basis(1)
+        self.vectors = {
+            "便宜一点的": _basis(0),
+            "再便宜一点": paraphrase / np.linalg.norm(paraphrase),
+            "演唱会门票": _basis(2),
+            "游戏道具": _basis(3),
+            "艺术品": _basis(4),
+        }
+        self.cache = SemanticCache(threshold=0.87, max_size=16, embedder=self.vectors.__getitem__)
+
+    def context(self, *texts):
+        return [self.vectors[t] for t in texts]
+
+    def test_same_context_hits(self):
+        self.cache.put("便宜一点的", "A", context=self.context("演唱会门票"))
+        self.assertEqual(self.cache.get("便宜一点的", context=self.context("演唱会门票")), "A")
+        self.assertEqual(self.cache.get("再便宜一点", context=self.context("演唱会门票")), "A")
+
+    def test_different_one_turn_history_misses(self):
+        self.cache.put("便宜一点的", "A", context=self.context("演唱会门票"))
+        self.assertIsNone(self.cache.get("便宜一点的", context=self.context("游戏道具")))
+        self.assertIsNone(self.cache.get("再便宜一点", context=self.context("游戏道具")))
+
+    def test_different_three_turn_history_misses(self):
+        self.cache.put("便宜一点的", "A", context=self.context("演唱会门票", "艺术品", "演唱会门票"))
+        self.assertIsNone(
+            self.cache.get("便宜一点的", context=self.context("游戏道具", "艺术品", "游戏道具"))
+        )
+
+    def test_context_and_no_context_do_not_mix(self):
+        self.cache.put("便宜一点的", "A", context=self.context("演唱会门票"))
+        self.assertIsNone(self.cache.get("便宜一点的"))
+        self.assertIsNone(self.cache.get("再便宜一点"))
+
+        self.cache.put("再便宜一点", "B")
+        self.assertIsNone(self.cache.get("便宜一点的", context=self.context("游戏道具")))
+        self.assertEqual(self.cache.get("便宜一点的"), "B")
+
+    def test_quantized_cache_keeps_context_isolation(self):
+        cache = SemanticCache(threshold=0.87, max_size=16, embedder=self.vectors.__getitem__, quantize=True)
+        cache.put("便宜一点的", "A", context=self.context("演唱会门票"))
+        self.assertEqual(cache.get("再便宜一点", context=self.context("演唱会门票")), "A")
+        self.assertIsNone(cache.get("再便宜一点", context=self.context("游戏道具")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,9 +6,10 @@
 import sounddevice as sd
 import soundfile as sf
 import numpy as np
-from typing import Optional
+from typing import Iterator, Optional
 from io import BytesIO
 import logging
+import queue
 
 # 尝试导入 noisereduce，如果失败则降噪功能不可用
 try:
@@ -31,6 +32,9 @@ class VoiceInputModule:
     - 降噪处理
     """
     
+    # 录音缓冲区初始容量 (秒)
+    INITIAL_BUFFER_SECONDS = 30
+    
     def __init__(
         self,
         sample_rate: int = 16000,
@@ -54,8 +58,13 @@ class VoiceInputModule:
         
         # 录音状态
         self._recording = False
-        self._audio_data = []
+        # 预分配的录音缓冲区 (frames, channels)，回调直接写入，容量不足时倍增
+        self._buffer = np.zeros((self.INITIAL_BUFFER_SECONDS * sample_rate, channels), dtype=np.float32)
+        self._length = 0
+        self._last_recording: Optional[np.ndarray] = None
         self._stream: Optional[sd.InputStream] = None
+        # 流式转录使用的音频块队列（None 表示录音结束）
+        self._chunk_queue: "queue.Queue[Optional[np.ndarray]]" = queue.Queue()
         
         logger.info(
             f"VoiceInputModule 初始化完成: "
@@ -74,7 +83,11 @@ class VoiceInputModule:
             raise RuntimeError("录音已经在进行中")
         
         self._recording = True
-        self._audio_data = []
+        # 每次录音使用新缓冲区，上一段录音的视图可能仍在转录中
+        self._buffer = np.zeros((self.INITIAL_BUFFER_SECONDS * self.sample_rate, self.channels), dtype=np.float32)
+        self._length = 0
+        self._last_recording = None
+        self._chunk_queue = queue.Queue()
         
         # 创建音频流
         self._stream = sd.InputStream(
@@ -94,6 +107,21 @@ class VoiceInputModule:
         Returns:
             bytes: WAV 格式的音频数据
             
+        Raises:
+            RuntimeError: 如果录音未开始
+        """
+        audio_array = self.finish_recording()
+        
+        # 转换为 WAV 格式的字节数据
+        return self._to_wav_bytes(audio_array)
+    
+    def finish_recording(self) -> np.ndarray:
+        """
+        停止录音并返回录音缓冲区的只读视图（不复制、不编码）
+        
+        Returns:
+            np.ndarray: float32 单声道音频数组
+            
         Raises:
             RuntimeError: 如果录音未开始
         """
@@ -107,20 +135,28 @@ class VoiceInputModule:
             self._stream = None
         
         self._recording = False
+        self._chunk_queue.put(None)
         
-        # 合并音频数据
-        if not self._audio_data:
+        if self._length == 0:
             logger.warning("录音数据为空")
-            audio_array = np.array([], dtype=np.float32)
-        else:
-            audio_array = np.concatenate(self._audio_data, axis=0)
+        
+        # 单声道取连续视图，多声道取第一声道
+        audio_array = self._buffer[:self._length, 0]
+        audio_array.flags.writeable = False
+        self._last_recording = audio_array
         
         logger.info(f"停止录音，录制了 {len(audio_array) / self.sample_rate:.2f} 秒")
         
-        # 转换为 WAV 格式的字节数据
-        wav_bytes = self._to_wav_bytes(audio_array)
+        return audio_array
+    
+    def get_audio_buffer(self) -> Optional[np.ndarray]:
+        """
+        获取最近一次录音的只读视图
         
-        return wav_bytes
+        Returns:
+            np.ndarray: float32 单声道音频数组，尚无录音时返回 None
+        """
+        return self._last_recording
     
     def detect_silence(self, audio_data: np.ndarray, threshold: Optional[float] = None) -> bool:
         """
@@ -139,8 +175,8 @@ class VoiceInputModule:
         if len(audio_data) == 0:
             return True
         
-        # 计算 RMS (Root Mean Square) 能量
-        rms = np.sqrt(np.mean(audio_data ** 2))
+        # 计算 RMS (Root Mean Square) 能量，点积求平方和，不分配 audio_data ** 2 临时数组
+        rms = np.sqrt(np.vdot(audio_data, audio_data) / audio_data.size)
         
         # 判断是否为静音
         is_silent = rms < self.rms_threshold
@@ -207,8 +243,37 @@ class VoiceInputModule:
             logger.warning(f"音频流状态: {status}")
         
         if self._recording:
-            # 复制音频数据并添加到缓冲区
-            self._audio_data.append(indata.copy())
+            # indata 由音频驱动复用，需要复制到录音缓冲区
+            end = self._length + frames
+            if end > len(self._buffer):
+                # 容量不足时倍增；已发出的视图仍指向旧缓冲区，数据不受影响
+                grown = np.zeros((max(end, len(self._buffer) * 2), self.channels), dtype=np.float32)
+                grown[:self._length] = self._buffer[:self._length]
+                self._buffer = grown
+            self._buffer[self._length:end] = indata
+            self._chunk_queue.put(self._buffer[self._length:end])
+            self._length = end
+    
+    def iter_audio_chunks(self, timeout: float = 5.0) -> Iterator[np.ndarray]:
+        """
+        逐块产出正在录制的音频，供流式转录使用
+        
+        Args:
+            timeout: 等待下一个音频块的超时时间 (秒)
+            
+        Yields:
+            np.ndarray: float32 单声道音频块
+        """
+        chunk_queue = self._chunk_queue
+        while True:
+            try:
+                chunk = chunk_queue.get(timeout=timeout)
+            except queue.Empty:
+                logger.warning("等待音频块超时，结束流式读取")
+                return
+            if chunk is None:
+                return
+            yield chunk[:, 0] if chunk.ndim > 1 else chunk
     
     def _to_wav_bytes(self, audio_array: np.ndarray) -> bytes:
         """
@@ -231,11 +296,8 @@ class VoiceInputModule:
             subtype='PCM_16'
         )
         
-        # 获取字节数据
-        buffer.seek(0)
-        wav_bytes = buffer.read()
-        
-        return wav_bytes
+        # getvalue 直接取出缓冲区内容，省去 seek + read 的再次拷贝
+        return buffer.getvalue()
     
     def _from_wav_bytes(self, wav_bytes: bytes) -> tuple[np.ndarray, int]:
         """